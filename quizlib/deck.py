@@ -0,0 +1,279 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import xbmcvfs
+
+import imdb
+import question
+import prefetch
+import logger
+
+log = logger.getLogger('deck')
+
+
+class QuestionDeck(object):
+    """
+    Questions built ahead of time, eg. for the non-interactive Cinema Experience mode where a stall
+    between two questions is visible. Decks are saved as zlib compressed JSON of the questions' toDict().
+
+    The key identifies the game type, enabled questions and library filters the deck was built for,
+    a saved deck with another key is not used.
+    """
+    MAGIC = 'MQDK'
+    VERSION = 2
+    HEADER = struct.Struct('<4sI')
+
+    def __init__(self, key, questions=None):
+        """
+        @param key: see createKey()
+        @type key: str
+        @param questions: the questions of the deck
+        @type questions: list
+        """
+        self.key = key
+        self.questions = questions or list()
+
+    @staticmethod
+    def createKey(gameType, questionCandidates, defaultLibraryFilters):
+        """
+        @param gameType: one of the game.GAMETYPE_* constants
+        @type gameType: str
+        @param questionCandidates: the enabled Question subclasses
+        @type questionCandidates: list
+        @param defaultLibraryFilters: the filters passed to each question
+        @type defaultLibraryFilters: list
+        """
+        names = sorted([candidate.__name__ for candidate in questionCandidates])
+        return hashlib.md5(json.dumps([gameType, names, defaultLibraryFilters], sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def load(path, key):
+        """
+        Loads a saved deck.
+
+        @return: the deck or None if there is no usable deck for the key
+        @rtype: QuestionDeck
+        """
+        if not os.path.exists(path):
+            return None
+
+        try:
+            f = open(path, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+
+            magic, version = QuestionDeck.HEADER.unpack_from(data)
+            if magic != QuestionDeck.MAGIC or version != QuestionDeck.VERSION:
+                log.info("Ignoring question deck %s with unsupported version", path)
+                return None
+
+            content = json.loads(zlib.decompress(data[QuestionDeck.HEADER.size:]))
+            if content['key'] != key:
+                log.info("Ignoring question deck %s built for other settings", path)
+                return None
+
+            return QuestionDeck(key, [question.Question.fromDict(item) for item in content['questions']])
+        except (struct.error, zlib.error, ValueError, KeyError, IndexError, TypeError):
+            log.exception("Ignoring invalid question deck %s", path)
+            return None
+
+    def save(self, path):
+        content = {
+            'key': self.key,
+            'created': int(time.time()),
+            'questions': [q.toDict() for q in self.questions]
+        }
+        data = zlib.compress(json.dumps(content, separators=(',', ':')), 9)
+
+        f = open(path + '.tmp', 'wb')
+        try:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+            f.write(data)
+        finally:
+            f.close()
+        imdb.replaceFile(path + '.tmp', path)
+        log.info("Saved %d questions to %s (%d bytes)", len(self.questions), path, self.HEADER.size + len(data))
+
+    def validate(self, previousQuestions=None):
+        """
+        Removes the questions whose video or audio file no longer exists in the library,
+        and the questions already used.
+
+        @param previousQuestions: unique identifiers of questions already used
+        @type previousQuestions: list
+        @return: the number of questions removed
+        """
+        valid = list()
+        for q in self.questions:
+            displayType = q.getDisplayType()
+            if previousQuestions and q.getUniqueIdentifier() in previousQuestions:
+                continue
+            elif isinstance(displayType, question.VideoDisplayType) and not xbmcvfs.exists(displayType.getVideoFile()):
+                continue
+            elif isinstance(displayType, question.AudioDisplayType) and not xbmcvfs.exists(displayType.getAudioFile()):
+                continue
+            valid.append(q)
+
+        removed = len(self.questions) - len(valid)
+        self.questions = valid
+        return removed
+
+    def fill(self, count, questionCandidates, defaultLibraryFilters, progress=None):
+        """
+        Builds questions until the deck holds count questions or no more questions can be found.
+
+        @param progress: optional callable invoked with the number of questions in the deck and count
+        @type progress: method
+        """
+        startTime = time.time()
+        previousQuestions = [q.getUniqueIdentifier() for q in self.questions]
+        builder = prefetch.QuestionPrefetcher(questionCandidates, defaultLibraryFilters, previousQuestions)
+        built = 0
+        while len(self.questions) < count:
+            q = builder.buildQuestion()
+            if q is None or q.getUniqueIdentifier() in [d.getUniqueIdentifier() for d in self.questions]:
+                break
+            self.questions.append(q)
+            built += 1
+            if progress is not None:
+                progress(len(self.questions), count)
+
+        log.info("Built %d deck questions in %.2f seconds", built, time.time() - startTime)
+
+
+def prepareDeck(path, count, gameType, questionCandidates, defaultLibraryFilters, progress=None):
+    """
+    Loads the saved deck, removes questions no longer valid for the library and builds the missing questions.
+
+    @param path: the file holding the saved deck
+    @type path: str
+    @param count: the number of questions wanted
+    @type count: int
+    @param progress: optional callable invoked with the number of questions in the deck and count
+    @type progress: method
+    @rtype: QuestionDeck
+    """
+    startTime = time.time()
+    key = QuestionDeck.createKey(gameType, questionCandidates, defaultLibraryFilters)
+    deck = QuestionDeck.load(path, key)
+    if deck is None:
+        deck = QuestionDeck(key)
+    else:
+        loaded = len(deck.questions)
+        removed = deck.validate()
+        log.info("Loaded %d deck questions, %d still valid", loaded, loaded - removed)
+
+    del deck.questions[count:]
+    deck.fill(count, questionCandidates, defaultLibraryFilters, progress)
+    log.info("Prepared deck of %d questions in %.2f seconds", len(deck.questions), time.time() - startTime)
+    return deck
+
+
+class DeckQuestionSource(object):
+    """
+    Serves the questions of a deck in place of a prefetch.QuestionPrefetcher.
+    If the deck runs out, questions are built by a prefetcher instead.
+
+    When stopped, a new deck is built and saved for the next game in the background.
+    stop(wait=True) waits for it, as it builds questions from the library snapshot.
+    """
+
+    def __init__(self, deck, path, count, questionCandidates, defaultLibraryFilters, previousQuestions):
+        self.deck = deck
+        self.path = path
+        self.count = count
+        self.questionCandidates = questionCandidates
+        self.defaultLibraryFilters = defaultLibraryFilters
+        self.previousQuestions = previousQuestions
+
+        self.position = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetcher = None
+        self.builder = None
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    def get(self, timeout=None):
+        """
+        Returns the next question, or None if no more questions could be found.
+
+        @raise Queue.Empty: if the deck is used up and no question is ready within timeout seconds
+        """
+        while self.position < len(self.deck.questions):
+            q = self.deck.questions[self.position]
+            self.position += 1
+            if not q.getUniqueIdentifier() in self.previousQuestions:
+                self.previousQuestions.append(q.getUniqueIdentifier())
+                self.hits += 1
+                return q
+
+        if self.prefetcher is None:
+            log.info("Question deck used up after %d questions", self.hits)
+            self.prefetcher = prefetch.QuestionPrefetcher(self.questionCandidates, self.defaultLibraryFilters,
+                                                          self.previousQuestions)
+            self.prefetcher.start()
+
+        q = self.prefetcher.get(timeout)
+        self.misses += 1
+        return q
+
+    def stop(self, wait=False):
+        """
+        @param wait: True to wait for the prefetcher building questions once the deck was used up,
+        and for the next deck to be saved
+        @type wait: bool
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.stop(wait)
+
+        if not self.stopped:
+            self.stopped = True
+            if self.hits + self.misses:
+                log.info("Question deck hit rate: %d of %d questions (%.0f%%)", self.hits, self.hits + self.misses,
+                         100.0 * self.hits / (self.hits + self.misses))
+
+            # not a daemon thread, so the deck is saved even if the script ends first
+            self.builder = threading.Thread(target=self._saveNextDeck, name='QuestionDeckBuilder')
+            self.builder.start()
+
+        if wait:
+            self.builder.join()
+
+    def _saveNextDeck(self):
+        try:
+            deck = QuestionDeck(self.deck.key, self.deck.questions[self.position:])
+            deck.validate(self.previousQuestions)
+            deck.fill(self.count, self.questionCandidates, self.defaultLibraryFilters)
+            deck.save(self.path)
+        except Exception, ex:
+            log.exception("%s while saving question deck", ex.__class__.__name__)
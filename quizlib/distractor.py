@@ -0,0 +1,166 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import random
+import time
+
+import logger
+
+log = logger.getLogger('distractor')
+
+DIFFICULTY_EASY = 0.2
+DIFFICULTY_NORMAL = 0.6
+DIFFICULTY_HARD = 0.9
+DIFFICULTIES = {
+    'Easy': DIFFICULTY_EASY,
+    'Normal': DIFFICULTY_NORMAL,
+    'Hard': DIFFICULTY_HARD
+}
+
+
+class DistractorEngine(object):
+    """
+    Picks plausible wrong answers for a library item: other items similar to it.
+
+    Each item gets a feature vector of the values of a few indexed fields, eg. its genres, cast and studio,
+    and optionally its year. Similarity is the weighted Jaccard similarity of the value sets plus the
+    closeness of the years. Only items sharing a value with the item are scored, found through the
+    postings of the table's index, so picking distractors does not scan the library.
+    """
+    YEAR_SCALE = 10.0
+    MAX_POSTINGS = 50
+
+    def __init__(self, table, weights, yearWeight=0.0):
+        """
+        @param table: the table of the items, eg. LibrarySnapshot.movies
+        @type table: snapshot.Table
+        @param weights: maps the indexed fields to use to their weight, eg. {'genre': 2.0, 'actor': 1.0}
+        @type weights: dict
+        @param yearWeight: the weight of the year, or 0 to ignore it
+        @type yearWeight: float
+        """
+        startTime = time.time()
+        self.table = table
+        self.version = table.version
+        self.index = table.index
+        self.weights = weights
+        self.yearWeight = yearWeight
+        self.features = dict()
+        self.years = dict()
+        self.largePostings = dict()
+
+        for idx, itemId in enumerate(table.ids):
+            features = dict()
+            for field in weights:
+                features[field] = frozenset([value.lower() if isinstance(value, basestring) else value
+                                             for value in table.getFieldValues(field, idx) if value])
+            self.features[itemId] = features
+            if yearWeight:
+                self.years[itemId] = table.columns['year'][idx]
+
+        log.debug("Built %d feature vectors in %.3f seconds", len(self.features), time.time() - startTime)
+
+    def getDistractors(self, itemId, count, within=None, accept=None, difficulty=DIFFICULTY_NORMAL):
+        """
+        Returns the ids of count items to use as wrong answers for the item,
+        or fewer if there are not enough items.
+
+        @param itemId: the id of the item the question is about, eg. a movieid
+        @type itemId: int
+        @param count: the number of wrong answers wanted
+        @type count: int
+        @param within: the ids of the items allowed, eg. those matching the default filters of the game
+        @type within: set
+        @param accept: optional callable taking an item id, that must return True for the item to be used
+        @type accept: method
+        @param difficulty: from 0 to 1, where 1 picks the most similar items and 0 picks among all similar items
+        @type difficulty: float
+        @rtype: list
+        """
+        features = self.features.get(itemId)
+        if features is None:
+            return list()
+
+        ranked = list()
+        for candidateId in self._getCandidates(itemId, features, within):
+            if accept is None or accept(candidateId):
+                # the random part orders equally similar items randomly
+                ranked.append((self.getSimilarity(itemId, candidateId) + random.random() * 0.01, candidateId))
+        ranked.sort(reverse=True)
+
+        # squared, so a high difficulty narrows the choice to the few most similar items
+        window = count + int(round((1.0 - difficulty) ** 2 * max(len(ranked) - count, 0)))
+        distractors = random.sample([candidateId for score, candidateId in ranked[:window]],
+                                    min(count, len(ranked)))
+
+        if len(distractors) < count:
+            distractors.extend(self._getRandomItems(count - len(distractors), set(distractors) | set([itemId]),
+                                                    within, accept))
+        return distractors
+
+    def getSimilarity(self, itemId, otherItemId):
+        """
+        @return: the similarity of the two items, 0 if they have nothing in common
+        """
+        features = self.features[itemId]
+        otherFeatures = self.features[otherItemId]
+        similarity = 0.0
+        for field, weight in self.weights.iteritems():
+            values = features[field]
+            otherValues = otherFeatures[field]
+            if values and otherValues:
+                similarity += weight * len(values & otherValues) / float(len(values | otherValues))
+
+        if self.yearWeight:
+            year = self.years[itemId]
+            otherYear = self.years[otherItemId]
+            if year and otherYear:
+                similarity += self.yearWeight * max(0.0, 1.0 - abs(year - otherYear) / self.YEAR_SCALE)
+        return similarity
+
+    def _getCandidates(self, itemId, features, within):
+        candidates = set()
+        for field in self.weights:
+            for value in features[field]:
+                postings = self.index.get(field, value)
+                if len(postings) > self.MAX_POSTINGS:
+                    # eg. a common genre, a sample of its items is enough
+                    if not (field, value) in self.largePostings:
+                        self.largePostings[(field, value)] = tuple(postings)
+                    postings = random.sample(self.largePostings[(field, value)], self.MAX_POSTINGS)
+                candidates.update(postings)
+
+        candidates.discard(itemId)
+        if within is not None:
+            candidates &= within
+        return candidates
+
+    def _getRandomItems(self, count, excluded, within, accept):
+        itemIds = list(within if within is not None else self.features)
+        items = list()
+        end = len(itemIds)
+        while end > 0 and len(items) < count:
+            pick = random.randint(0, end - 1)
+            end -= 1
+            itemIds[pick], itemIds[end] = itemIds[end], itemIds[pick]
+            candidateId = itemIds[end]
+            if not candidateId in excluded and (accept is None or accept(candidateId)):
+                items.append(candidateId)
+        return items
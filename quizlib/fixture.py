@@ -0,0 +1,161 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import random
+
+GENRES = [u'Action', u'Adventure', u'Animation', u'Comedy', u'Crime', u'Drama', u'Horror', u'Romance',
+          u'Science Fiction', u'Thriller']
+MPAA_RATINGS = [u'Rated R', u'Rated PG-13', u'Rated PG', u'Rated G', u'']
+CONTENT_RATINGS = [u'TV-MA', u'TV-14', u'TV-PG', u'TV-G', u'']
+
+
+def createLibrary(movies=1000, tvShows=30, artists=50, seed=None):
+    """
+    Creates a synthetic library for transport.FakeTransport, with the items shaped like JSON-RPC results.
+    The library is the same for the same arguments and seed.
+
+    @param movies: the number of movies
+    @type movies: int
+    @param tvShows: the number of tv shows, each with 1-5 seasons of 6-12 episodes
+    @type tvShows: int
+    @param artists: the number of artists, each with 1-4 albums of 8-12 songs
+    @type artists: int
+    @return: dict with the items keyed by result key, eg. {'movies': [...], 'tvshows': [...]}
+    """
+    r = random.Random(seed)
+    library = {
+        'movies': list(),
+        'tvshows': list(),
+        'seasons': list(),
+        'episodes': list(),
+        'songs': list(),
+        'albums': list(),
+        'artists': list()
+    }
+
+    # actors are shared between movies, so there are actors with several movies
+    actors = [u'Actor %d' % idx for idx in range(1, max(movies / 3, 10))]
+    directors = [u'Director %d' % idx for idx in range(1, max(movies / 4, 5))]
+    for movieId in range(1, movies + 1):
+        title = u'Movie %d' % movieId
+        library['movies'].append({
+            'movieid': movieId,
+            'label': title,
+            'title': title,
+            'set': r.random() < 0.15 and u'Collection %d' % r.randint(1, max(movies / 20, 1)) or u'',
+            'genre': r.sample(GENRES, r.randint(1, 3)),
+            'file': u'/movies/%s.mkv' % title,
+            'art': {'poster': u'/art/movie%d-poster.jpg' % movieId, 'fanart': u'/art/movie%d-fanart.jpg' % movieId},
+            'cast': _createCast(r, actors),
+            'year': r.randint(1950, 2013),
+            'tagline': r.random() < 0.7 and u'Tagline of %s' % title or u'',
+            'studio': [u'Studio %d' % r.randint(1, 20)],
+            'director': [r.choice(directors)],
+            'runtime': r.randint(80, 180) * 60,
+            'mpaa': r.choice(MPAA_RATINGS),
+            'playcount': r.randint(0, 2)
+        })
+
+    tvActors = [u'TV Actor %d' % idx for idx in range(1, max(tvShows * 4, 10))]
+    for tvShowId in range(1, tvShows + 1):
+        title = u'TV Show %d' % tvShowId
+        library['tvshows'].append({
+            'tvshowid': tvShowId,
+            'label': title,
+            'title': title,
+            'genre': r.sample(GENRES, r.randint(1, 2)),
+            'cast': _createCast(r, tvActors),
+            'file': u'/tvshows/%s/' % title,
+            'art': {'poster': u'/art/tvshow%d-poster.jpg' % tvShowId, 'fanart': u'/art/tvshow%d-fanart.jpg' % tvShowId},
+            'mpaa': r.choice(CONTENT_RATINGS),
+            'playcount': r.randint(0, 2)
+        })
+        for season in range(1, r.randint(1, 5) + 1):
+            library['seasons'].append({
+                'label': u'Season %d' % season,
+                'season': season,
+                'tvshowid': tvShowId,
+                'art': {'poster': u'/art/tvshow%d-season%d.jpg' % (tvShowId, season)}
+            })
+            for episode in range(1, r.randint(6, 12) + 1):
+                episodeId = len(library['episodes']) + 1
+                library['episodes'].append({
+                    'episodeid': episodeId,
+                    'label': u'%dx%02d. Episode %d' % (season, episode, episodeId),
+                    'title': u'Episode %d' % episodeId,
+                    'showtitle': title,
+                    'season': season,
+                    'episode': episode,
+                    'file': u'/tvshows/%s/S%02dE%02d.mkv' % (title, season, episode),
+                    'firstaired': u'%d-%02d-%02d' % (r.randint(1990, 2013), r.randint(1, 12), r.randint(1, 28)),
+                    'art': {'tvshow.poster': u'/art/tvshow%d-poster.jpg' % tvShowId,
+                            'thumb': u'/art/episode%d.jpg' % episodeId},
+                    'tvshowid': tvShowId,
+                    'playcount': r.randint(0, 2)
+                })
+
+    for artistId in range(1, artists + 1):
+        name = u'Artist %d' % artistId
+        library['artists'].append({
+            'artistid': artistId,
+            'artist': name,
+            'label': name,
+            'thumbnail': u'/art/artist%d.jpg' % artistId,
+            'fanart': u'/art/artist%d-fanart.jpg' % artistId
+        })
+        for album in range(r.randint(1, 4)):
+            albumId = len(library['albums']) + 1
+            genre = [r.choice(GENRES)]
+            library['albums'].append({
+                'albumid': albumId,
+                'label': u'Album %d' % albumId,
+                'title': u'Album %d' % albumId,
+                'artist': [name],
+                'artistid': [artistId],
+                'fanart': u'/art/artist%d-fanart.jpg' % artistId,
+                'thumbnail': u'/art/album%d.jpg' % albumId,
+                'genre': genre,
+                'playcount': r.randint(0, 2)
+            })
+            for track in range(r.randint(8, 12)):
+                songId = len(library['songs']) + 1
+                library['songs'].append({
+                    'songid': songId,
+                    'label': u'Song %d' % songId,
+                    'title': u'Song %d' % songId,
+                    'artist': [name],
+                    'artistid': [artistId],
+                    'file': u'/music/%s/Album %d/%02d.mp3' % (name, albumId, track + 1),
+                    'thumbnail': u'/art/album%d.jpg' % albumId,
+                    'genre': genre,
+                    'playcount': r.randint(0, 2)
+                })
+
+    return library
+
+
+def _createCast(r, actors):
+    cast = list()
+    for order, name in enumerate(r.sample(actors, min(len(actors), r.randint(4, 10)))):
+        castMember = {'name': name, 'role': u'Role %d' % order, 'order': order}
+        if r.random() < 0.8:
+            castMember['thumbnail'] = u'/art/%s.jpg' % name
+        cast.append(castMember)
+    return cast
@@ -17,9 +17,9 @@
 #  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
 #  http://www.gnu.org/copyleft/gpl.html
 #
-import random
 
 import threading
+import Queue
 import os
 import re
 import time
@@ -31,13 +31,19 @@ import xbmcgui
 import game
 import question
 import player
+import prefetch
+import deck
 import highscore
 import library
+import monitor
 
+import logger
 import buggalo
 
 from strings import *
 
+log = logger.getLogger('gui')
+
 # Constants from [xbmc]/xbmc/guilib/Key.h
 ACTION_SELECT_ITEM = 7
 ACTION_PARENT_DIR = 9
@@ -170,7 +176,7 @@ class MenuGui(xbmcgui.WindowXMLDialog):
 
         self.userId = -1
         self.statisticsLabel = None
-        self.localHighscore = highscore.LocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
+        self.localHighscore = highscore.getLocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
         self.globalHighscore = highscore.GlobalHighscoreDatabase(ADDON.getAddonInfo('version'))
         self.globalHighscorePage = 0
 
@@ -231,9 +237,10 @@ class MenuGui(xbmcgui.WindowXMLDialog):
                 listControl.addItem(xbmcgui.ListItem(repr(gameType)))
 
         # Check preconditions
-        hasMovies = library.hasMovies()
-        hasTVShows = library.hasTVShows()
-        hasMusic = library.hasMusic()
+        status = library.getLibraryStatus()
+        hasMovies = status['hasMovies']
+        hasTVShows = status['hasTVShows']
+        hasMusic = status['hasMusic']
 
         if not hasMovies and not hasTVShows and not hasMusic:
             self.close()
@@ -243,19 +250,19 @@ class MenuGui(xbmcgui.WindowXMLDialog):
                                 strings(E_REQUIREMENTS_MISSING_LINE2), strings(E_REQUIREMENTS_MISSING_LINE3))
             return
 
-        if not library.isAnyVideosWatched() and ADDON.getSetting(SETT_ONLY_WATCHED_MOVIES) == 'true':
+        if not status['isAnyVideosWatched'] and ADDON.getSetting(SETT_ONLY_WATCHED_MOVIES) == 'true':
             # Only watched movies requires at least one watched video files
             xbmcgui.Dialog().ok(strings(E_REQUIREMENTS_MISSING), strings(E_ONLY_WATCHED_LINE1),
                                 strings(E_ONLY_WATCHED_LINE2), strings(E_ONLY_WATCHED_LINE3))
             ADDON.setSetting(SETT_ONLY_WATCHED_MOVIES, 'false')
 
-        if not library.isAnyMPAARatingsAvailable() and ADDON.getSetting(SETT_MOVIE_RATING_LIMIT_ENABLED) == 'true':
+        if not status['isAnyMPAARatingsAvailable'] and ADDON.getSetting(SETT_MOVIE_RATING_LIMIT_ENABLED) == 'true':
             # MPAA rating requires ratings to be available in database
             xbmcgui.Dialog().ok(strings(E_REQUIREMENTS_MISSING), strings(E_MOVIE_RATING_LIMIT_LINE1),
                                 strings(E_MOVIE_RATING_LIMIT_LINE2), strings(E_MOVIE_RATING_LIMIT_LINE3))
             ADDON.setSetting(SETT_MOVIE_RATING_LIMIT_ENABLED, 'false')
 
-        if not library.isAnyContentRatingsAvailable() and ADDON.getSetting(SETT_TVSHOW_RATING_LIMIT_ENABLED) == 'true':
+        if not status['isAnyContentRatingsAvailable'] and ADDON.getSetting(SETT_TVSHOW_RATING_LIMIT_ENABLED) == 'true':
             # Content rating requires ratings to be available in database
             xbmcgui.Dialog().ok(strings(E_REQUIREMENTS_MISSING), strings(E_TVSHOW_RATING_LIMIT_LINE1),
                                 strings(E_TVSHOW_RATING_LIMIT_LINE2), strings(E_TVSHOW_RATING_LIMIT_LINE3))
@@ -314,7 +321,7 @@ class MenuGui(xbmcgui.WindowXMLDialog):
         if self.highscoreGameType == highscoreGameType and self.highscoreGlobal == highscoreGlobal and self.highscoreType == highscoreType:
             return
 
-        print 'reloading highscores...'
+        log.debug('Reloading highscores')
 
         self.highscoreGlobal = highscoreGlobal
         self.highscoreType = highscoreType
@@ -358,9 +365,6 @@ class MenuGui(xbmcgui.WindowXMLDialog):
         self.getControl(MenuGui.C_MENU_HIGHSCORE_TABLE_VISIBILITY).setVisible(True)
         self.getControl(MenuGui.C_MENU_ABOUT_VISIBILITY).setVisible(True)
 
-        if self.localHighscore:
-            self.localHighscore.close()
-
         super(MenuGui, self).close()
 
     @buggalo.buggalo_try_except()
@@ -449,12 +453,11 @@ class MenuGui(xbmcgui.WindowXMLDialog):
             item.setProperty('id', '-1')
             items.append(item)
 
-            localHighscore = highscore.LocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
+            localHighscore = highscore.getLocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
             for user in localHighscore.getUsers():
                 item = xbmcgui.ListItem(user['nickname'])
                 item.setProperty('id', str(user['id']))
                 items.append(item)
-            localHighscore.close()
 
         listControl.addItems(items)
         self.setFocus(listControl)
@@ -465,7 +468,7 @@ class MenuGui(xbmcgui.WindowXMLDialog):
         @param controlId: id of the control that was clicked
         @type controlId: int
         """
-        print 'onClick'
+        log.debug('onClick(%d)', controlId)
 
         if controlId == MenuGui.C_MENU_LIST:
             self.getControl(MenuGui.C_MENU_VISIBILITY).setVisible(True)
@@ -614,13 +617,11 @@ class MenuGui(xbmcgui.WindowXMLDialog):
                 elif item.getProperty('id') is not None:
                     self.userId = item.getProperty('id')
 
-                localHighscore = highscore.LocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
+                localHighscore = highscore.getLocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
                 nickname = localHighscore.getNickname(self.userId)
                 gamesPlayed = localHighscore.getGamesPlayed(self.userId)
                 self.getControl(MenuGui.C_MENU_GAMES_PLAYED_LOCAL).setLabel(str(gamesPlayed))
 
-                localHighscore.close()
-
                 self.getControl(MenuGui.C_MENU_CURRENT_PLAYER).setLabel(nickname)
                 self.userId = item.getProperty('id')
 
@@ -723,9 +724,8 @@ class MenuGui(xbmcgui.WindowXMLDialog):
             name = 'Unknown player'
 
         if name is not None:
-            localHighscore = highscore.LocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
+            localHighscore = highscore.getLocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
             userId = localHighscore.createUser(name)
-            localHighscore.close()
 
             return userId
 
@@ -769,15 +769,25 @@ class QuizGui(xbmcgui.WindowXML):
     STATE_PLAYING = 3
     STATE_GAME_OVER = 4
 
-    def __new__(cls, gameInstance = None):
+    # the game ends if no question is ready within this time, eg. if the prefetcher died,
+    # longer than the prefetcher may wait for IMDb data
+    QUESTION_TIMEOUT_SECONDS = prefetch.QuestionPrefetcher.MAX_IMDB_WAIT_SECONDS + 5
+
+    def __new__(cls, gameInstance = None, deckPath = None):
         return super(QuizGui, cls).__new__(cls, 'script-moviequiz-main.xml', ADDON.getAddonInfo('path'))
 
-    def __init__(self, gameInstance = None):
+    def __init__(self, gameInstance = None, deckPath = None):
+        """
+        @param deckPath: file to keep a deck of questions built ahead of time in, see deck.QuestionDeck
+        @type deckPath: str
+        """
         super(QuizGui, self).__init__()
 
         self.gameInstance = gameInstance
+        self.deckPath = deckPath
 
         self.player = player.TenSecondPlayer()
+        self.libraryMonitor = monitor.LibraryMonitor(question.LIBRARY)
         self.questionCandidates = []
         self.defaultLibraryFilters = []
 
@@ -785,6 +795,8 @@ class QuizGui(xbmcgui.WindowXML):
         self.questionPoints = 0
         self.question = None
         self.previousQuestions = []
+        self.questionPrefetcher = None
+        self.stoppedQuestionPrefetchers = []
         self.lastClickTime = -1
         self.delayedNewQuestionTimer = None
 
@@ -795,7 +807,11 @@ class QuizGui(xbmcgui.WindowXML):
         self.getControl(2).setVisible(False)
 
         startTime = datetime.datetime.now()
-        question.IMDB.loadData()
+        library.loadLibraryStatusInBackground()
+        question.LIBRARY.loadCacheInBackground(os.path.join(xbmc.translatePath(ADDON.getAddonInfo('profile')),
+                                                            'library.cache'))
+        if question.IMDB.isDataPresent():
+            question.IMDB.loadDataInBackground()
         delta = datetime.datetime.now() - startTime
         if delta.seconds < 2:
             xbmc.sleep(1000 * (2 - delta.seconds))
@@ -817,7 +833,7 @@ class QuizGui(xbmcgui.WindowXML):
         self.gameInstance = gameInstance
         self.gameInstance.reset()
 
-        xbmc.log("Starting game: %s" % str(self.gameInstance))
+        log.info("Starting game: %s", self.gameInstance)
 
         if self.gameInstance.getType() == game.GAMETYPE_TVSHOW:
             self.defaultBackground = BACKGROUND_TV
@@ -838,7 +854,10 @@ class QuizGui(xbmcgui.WindowXML):
         if ADDON.getSetting(SETT_ONLY_WATCHED_MOVIES) == 'true':
             self.defaultLibraryFilters.extend(library.buildOnlyWathcedFilter())
 
+        # the previous prefetcher must not build questions while the library snapshot is synchronized
+        self._stopQuestionPrefetcher(wait=True)
         self.questionCandidates = question.getEnabledQuestionCandidates(self.gameInstance)
+        question.LIBRARY.load(self.gameInstance.getType())
 
         self.questionPointsThread = None
         self.questionPoints = 0
@@ -846,9 +865,24 @@ class QuizGui(xbmcgui.WindowXML):
         self.previousQuestions = []
         self.uiState = self.STATE_LOADING
 
+        if self.deckPath is not None and isinstance(self.gameInstance, game.QuestionLimitedGame):
+            self.getControl(self.C_MAIN_LOADING).setPercent(0)
+            self.getControl(self.C_MAIN_LOADING_VISIBILITY).setVisible(True)
+            questionDeck = deck.prepareDeck(self.deckPath, self.gameInstance.questionLimit,
+                                            self.gameInstance.getType(), self.questionCandidates,
+                                            self.defaultLibraryFilters, self._onDeckProgress)
+            self.questionPrefetcher = deck.DeckQuestionSource(questionDeck, self.deckPath,
+                                                              self.gameInstance.questionLimit, self.questionCandidates,
+                                                              self.defaultLibraryFilters, self.previousQuestions)
+        else:
+            self.questionPrefetcher = prefetch.createPrefetcher(self.questionCandidates, self.defaultLibraryFilters,
+                                                                self.previousQuestions)
+        self.questionPrefetcher.start()
+
         self.onNewQuestion()
 
     def close(self):
+        self._stopQuestionPrefetcher()
         if self.player:
             if self.player.isPlaying():
                 self.player.stopPlayback(True)
@@ -883,7 +917,7 @@ class QuizGui(xbmcgui.WindowXML):
         difference = time.time() - self.lastClickTime
         self.lastClickTime = time.time()
         if difference < 0.7:
-            xbmc.log("Ignoring key-repeat onClick")
+            log.debug("Ignoring key-repeat onClick")
             return
 
         if not self.gameInstance.isInteractive():
@@ -916,6 +950,8 @@ class QuizGui(xbmcgui.WindowXML):
         if self.questionPointsThread is not None:
             self.questionPointsThread.cancel()
 
+        self._stopQuestionPrefetcher()
+
         if self.gameInstance.isInteractive():
             w = GameOverDialog(self, self.gameInstance)
             w.doModal()
@@ -1002,37 +1038,44 @@ class QuizGui(xbmcgui.WindowXML):
         self.onQuestionPointTimer()
 
     def _getNewQuestion(self):
+        """
+        Takes the next question from the prefetch queue. The loading bar is only shown
+        while the queue is empty, ie. while the first question of a game is being built.
+        """
         retries = 0
-        q = None
-        while retries < 100 and self.uiState == self.STATE_LOADING:
-            xbmc.sleep(10)  # give XBMC time to process other events
+        deadline = time.time() + self.QUESTION_TIMEOUT_SECONDS
+        while self.uiState == self.STATE_LOADING:
             retries += 1
+            self.getControl(self.C_MAIN_LOADING).setPercent(retries % 100)
 
-            self.getControl(self.C_MAIN_LOADING).setPercent(retries)
+            try:
+                return self.questionPrefetcher.get(timeout=0.1)
+            except Queue.Empty:
+                pass
 
-            random.shuffle(self.questionCandidates)
-            for candidate in self.questionCandidates:
-                try:
-                    q = candidate(self.defaultLibraryFilters)
-                    break
-                except question.QuestionException, ex:
-                    print "QuestionException: %s" % str(ex)
-                except Exception, ex:
-                    xbmc.log("%s in %s" % (ex.__class__.__name__, candidate.__name__))
-                    import traceback
-                    import sys
+            if time.time() > deadline:
+                log.warning("No question ready after %d seconds, ending the game", self.QUESTION_TIMEOUT_SECONDS)
+                break
 
-                    traceback.print_exc(file=sys.stdout)
+        return None
 
-            if q is None or len(q.getAnswers()) < 3:
-                continue
+    def _onDeckProgress(self, questions, count):
+        self.getControl(self.C_MAIN_LOADING).setPercent(100 * questions / max(count, 1))
 
-            print type(q)
-            if not q.getUniqueIdentifier() in self.previousQuestions:
-                self.previousQuestions.append(q.getUniqueIdentifier())
-                break
+    def _stopQuestionPrefetcher(self, wait=False):
+        """
+        @param wait: True to also wait for the prefetchers stopped earlier, eg. at the end of the previous game
+        @type wait: bool
+        """
+        if self.questionPrefetcher is not None:
+            self.questionPrefetcher.stop()
+            self.stoppedQuestionPrefetchers.append(self.questionPrefetcher)
+            self.questionPrefetcher = None
 
-        return q
+        if wait:
+            for questionPrefetcher in self.stoppedQuestionPrefetchers:
+                questionPrefetcher.stop(wait=True)
+            del self.stoppedQuestionPrefetchers[:]
 
     @buggalo.buggalo_try_except()
     def onQuestionPointTimer(self):
@@ -1073,7 +1116,7 @@ class QuizGui(xbmcgui.WindowXML):
         @param answer: the chosen answer by the user
         @type answer: Answer
         """
-        xbmc.log("onQuestionAnswered(..)")
+        log.debug("onQuestionAnswered(..)")
         if self.questionPointsThread is not None:
             self.questionPointsThread.cancel()
 
@@ -1264,12 +1307,11 @@ class GameOverDialog(xbmcgui.WindowXMLDialog):
 
     def loadHighscores(self):
         # Local highscore
-        localHighscore = highscore.LocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
+        localHighscore = highscore.getLocalHighscoreDatabase(xbmc.translatePath(ADDON.getAddonInfo('profile')))
         self.localHighscoreNewId = localHighscore.addHighscore(self.game)
         name = localHighscore.getNickname(self.game.getUserId())
 
         self.localHighscoreEntries = localHighscore.getHighscoresNear(self.game, self.localHighscoreNewId)
-        localHighscore.close()
         self.showHighscores(M_LOCAL_HIGHSCORE, self.localHighscoreEntries, self.localHighscoreNewId)
 
         # Global highscore
@@ -24,11 +24,52 @@ import hashlib
 import os
 import StringIO
 import gzip
+import functools
+import threading
 
 import xbmc
 
 import sqlite3
 
+import logger
+
+log = logger.getLogger('highscore')
+
+_localDatabases = dict()
+_localDatabasesLock = threading.Lock()
+
+
+def getLocalHighscoreDatabase(path):
+    """
+    Returns the LocalHighscoreDatabase of the directory, shared by the whole process.
+    The database is opened and migrated the first time it is asked for, and stays open.
+
+    @param path: the directory holding highscore.db, eg. the addon profile
+    @type path: str
+    @rtype: LocalHighscoreDatabase
+    """
+    _localDatabasesLock.acquire()
+    try:
+        if not path in _localDatabases:
+            _localDatabases[path] = LocalHighscoreDatabase(path)
+        return _localDatabases[path]
+    finally:
+        _localDatabasesLock.release()
+
+
+def _synchronized(method):
+    """
+    Runs the method holding the lock of the database, as the connection is shared between threads.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.lock.acquire()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.release()
+    return wrapper
+
 
 class GlobalHighscoreDatabase(object):
     STATUS_OK = 'OK'
@@ -76,7 +117,7 @@ class GlobalHighscoreDatabase(object):
             'page': page
         }
 
-        print req
+        log.debug('Requesting highscores: %s', req)
 
         resp = self._request(req)
         if resp['status'] == 'OK':
@@ -142,22 +183,44 @@ class GlobalHighscoreDatabase(object):
 
 
 class LocalHighscoreDatabase(object):
+    """
+    Highscores of the local users, kept in highscore.db in the addon profile.
+
+    Use getLocalHighscoreDatabase() to share one instance and connection, which may be used from any thread.
+    The connection caches the compiled SQL statements, so repeated queries are not parsed again.
+
+    Positions are computed when reading highscores instead of being stored with each highscore,
+    so adding a highscore is a single insert. Highscores are ordered by score, then by age.
+    The position column is no longer maintained.
+    """
     HIGHSCORE_DB = 'highscore.db'
 
+    # Highscores of a game ranked before a highscore with the given score, timestamp and id
+    RANKED_BEFORE = ('h.type=? AND h.gameType=? AND h.gameSubType=? AND (h.score > ? OR (h.score = ? AND '
+                     '(h.timestamp < ? OR (h.timestamp = ? AND h.id < ?))))')
+
     def __init__(self, path):
         highscoreDbPath = os.path.join(path, LocalHighscoreDatabase.HIGHSCORE_DB)
 
+        self.lock = threading.RLock()
         self.conn = sqlite3.connect(highscoreDbPath, check_same_thread=False)
         self.conn.row_factory = self._sqlite_dict_factory
-        #xbmc.log("HighscoreDatabase opened: " + highscoreDbPath)
+        # with a write-ahead log, saving a highscore does not block reading the highscores,
+        # and syncing at checkpoints only is safe
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        log.debug('HighscoreDatabase opened: %s', highscoreDbPath)
 
-        self._createTables()
+        self._migrate()
 
+    @_synchronized
     def close(self):
         if hasattr(self, 'conn') and self.conn is not None:
             self.conn.close()
-            print "LocalHighscoreDatabase closed"
+            self.conn = None
+            log.debug('LocalHighscoreDatabase closed')
 
+    @_synchronized
     def addHighscore(self, game):
         if game.getPoints() <= 0:
             return -1
@@ -169,28 +232,27 @@ class LocalHighscoreDatabase(object):
              game.getCorrectAnswers(), game.getTotalAnswers()])
         self.conn.commit()
         rowid = c.lastrowid
-
-        # reposition highscore
-        highscores = self.getHighscores(game)
-        for idx, highscore in enumerate(highscores):
-            c.execute("UPDATE highscore SET position=? WHERE id=?", [idx + 1, highscore['id']])
-        self.conn.commit()
         c.close()
 
         return rowid
 
+    @_synchronized
     def getHighscores(self, game):
         """
         @type game: quizlib.game.Game
         @param game: game instance
         """
         c = self.conn.cursor()
-        c.execute('SELECT h.*, u.nickname FROM highscore h, user u WHERE h.user_id=u.id AND h.type=? AND h.gameType=? and h.gameSubType=? ORDER BY h.score DESC, h.timestamp ASC',
+        c.execute('SELECT h.*, u.nickname FROM highscore h, user u WHERE h.user_id=u.id AND h.type=? AND h.gameType=? and h.gameSubType=? ORDER BY h.score DESC, h.timestamp ASC, h.id ASC',
             [game.getType(), game.getGameType(), game.getGameSubType()])
         result = c.fetchall()
         c.close()
+
+        for idx, highscore in enumerate(result):
+            highscore['position'] = idx + 1
         return result
 
+    @_synchronized
     def getHighscoresNear(self, game, highscoreId, limit=50):
         """
         @type game: quizlib.game.Game
@@ -199,19 +261,45 @@ class LocalHighscoreDatabase(object):
         @param highscoreId: the highscoreId to get highscores near
         """
         c = self.conn.cursor()
-        c.execute('SELECT position FROM highscore WHERE id=?', [highscoreId])
+        c.execute('SELECT score, timestamp, id FROM highscore WHERE id=?', [highscoreId])
         r = c.fetchone()
-        if r:
-            position = r['position']
-        else:
-            position = 1
-
-        c.execute("SELECT h.*, u.nickname FROM highscore h, user u WHERE h.user_id=u.id AND h.type=? AND h.gameType=? and h.gameSubType=? AND h.position > ? AND h.position < ? ORDER BY h.position",
-            [game.getType(), game.getGameType(), game.getGameSubType(), position - (limit / 2), position + (limit / 2)])
-        result = c.fetchall()
+        if not r:
+            c.close()
+            return self.getHighscores(game)[:limit / 2]
+
+        gameParams = [game.getType(), game.getGameType(), game.getGameSubType()]
+        rankParams = gameParams + [r['score'], r['score'], r['timestamp'], r['timestamp'], r['id']]
+
+        # each count is a range of the highscore_rank index
+        c.execute('SELECT (SELECT COUNT(*) FROM highscore h WHERE h.type=? AND h.gameType=? AND h.gameSubType=? AND h.score > ?)'
+                  + ' + (SELECT COUNT(*) FROM highscore h WHERE h.type=? AND h.gameType=? AND h.gameSubType=? AND h.score = ? AND h.timestamp < ?)'
+                  + ' + (SELECT COUNT(*) FROM highscore h WHERE h.type=? AND h.gameType=? AND h.gameSubType=? AND h.score = ? AND h.timestamp = ? AND h.id < ?)'
+                  + ' AS cnt',
+                  gameParams + [r['score']] + gameParams + [r['score'], r['timestamp']]
+                  + gameParams + [r['score'], r['timestamp'], r['id']])
+        position = c.fetchone()['cnt'] + 1
+
+        # the highscores ranked just before, scanning the index upwards from the score
+        c.execute('SELECT h.*, u.nickname FROM highscore h, user u WHERE h.user_id=u.id AND h.score >= ? AND '
+                  + self.RANKED_BEFORE + ' ORDER BY h.score ASC, h.timestamp DESC, h.id DESC LIMIT ?',
+                  [r['score']] + rankParams + [limit / 2 - 1])
+        before = c.fetchall()
+        before.reverse()
+
+        # the highscore and the highscores ranked after it, scanning the index downwards from the score
+        c.execute('SELECT h.*, u.nickname FROM highscore h, user u WHERE h.user_id=u.id AND h.score <= ? AND '
+                  + 'h.type=? AND h.gameType=? AND h.gameSubType=? AND NOT (' + self.RANKED_BEFORE + ')'
+                  + ' ORDER BY h.score DESC, h.timestamp ASC, h.id ASC LIMIT ?',
+                  [r['score']] + gameParams + rankParams + [limit / 2])
+        after = c.fetchall()
         c.close()
+
+        result = before + after
+        for idx, highscore in enumerate(result):
+            highscore['position'] = position - len(before) + idx
         return result
 
+    @_synchronized
     def getGamesPlayed(self, userId):
         c = self.conn.cursor()
         c.execute('SELECT COUNT(*) AS cnt FROM highscore WHERE user_id=?', [userId])
@@ -220,6 +308,7 @@ class LocalHighscoreDatabase(object):
 
         return row['cnt']
 
+    @_synchronized
     def createUser(self, nickname):
         c = self.conn.cursor()
         c.execute("INSERT INTO user(nickname, last_used) VALUES(?, datetime('now'))",
@@ -230,6 +319,7 @@ class LocalHighscoreDatabase(object):
 
         return rowid
 
+    @_synchronized
     def getUsers(self):
         c = self.conn.cursor()
         c.execute('SELECT * FROM user ORDER BY last_used DESC, nickname')
@@ -238,6 +328,7 @@ class LocalHighscoreDatabase(object):
 
         return users
 
+    @_synchronized
     def deleteUser(self, id):
         c = self.conn.cursor()
         c.execute('DELETE FROM user WHERE id = ?', [id])
@@ -245,6 +336,7 @@ class LocalHighscoreDatabase(object):
         self.conn.commit()
         c.close()
 
+    @_synchronized
     def getNickname(self, userId):
         c = self.conn.cursor()
         c.execute("UPDATE user SET last_used = datetime('now') WHERE id = ?", [userId])
@@ -258,52 +350,84 @@ class LocalHighscoreDatabase(object):
         c.close()
         return nickname
 
-    def _createTables(self):
-        xbmc.log('Migrating Highscore Database')
-
+    def _migrate(self):
+        """
+        Brings the database up to date by running the migrations newer than its version in order.
+        The sqlite3 module commits before each schema change, so a migration is not atomic with its
+        version row. An interrupted migration is run again and each migration must therefore be idempotent.
+        """
         c = self.conn.cursor()
+        version = self._getVersion(c)
+        log.debug('Highscore Database version: %s', version)
+
+        for migrationVersion, migration in self.MIGRATIONS:
+            if version < migrationVersion:
+                log.info("Migrating Highscore Database to v%d.%d.%d", *migrationVersion)
+                migration(self, c)
+                c.execute('CREATE TABLE IF NOT EXISTS version (major INTEGER, minor INTEGER, patch INTEGER)')
+                c.execute('DELETE FROM version')
+                c.execute('INSERT INTO version VALUES(?, ?, ?)', list(migrationVersion))
+                self.conn.commit()
+                version = migrationVersion
 
+        c.close()
+        log.info('Highscore Database is up-to-date')
+
+    def _getVersion(self, c):
         try:
             c.execute('SELECT major, minor, patch FROM version')
-            version = c.fetchone().values()
+            row = c.fetchone()
         except sqlite3.OperationalError:
-            version = [0, 0, 0]
-
-        #xbmc.log("Highscore Database version: " + str(version))
-
-        if version < [0, 4, 1]:
-            xbmc.log("Migrating Highscore Database to v0.4.1")
-
-            c.execute('CREATE TABLE IF NOT EXISTS highscore ('
-                      + 'id INTEGER PRIMARY KEY,'
-                      + 'user_id INTEGER,'
-                      + 'type TEXT,'
-                      + 'gameType TEXT,'
-                      + 'gameSubType TEXT,'
-                      + 'position INTEGER,'
-                      + 'score REAL,'
-                      + 'correctAnswers INTEGER,'
-                      + 'numberOfQuestions INTEGER,'
-                      + 'timestamp INTEGER,'
-                      + 'FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE )'
-                      )
-
-            c.execute('CREATE TABLE IF NOT EXISTS user ('
-                      + 'id INTEGER PRIMARY KEY,'
-                      + 'nickname TEXT )')
-
-        if version < [0, 4, 2]:
-            xbmc.log("Migrating Highscore Database to v0.4.2")
-
-            c.execute('CREATE TABLE IF NOT EXISTS version (major INTEGER, minor INTEGER, patch INTEGER)')
-            c.execute('INSERT INTO version VALUES(0, 4, 2)')
-
+            row = None
+
+        if row is None:
+            return 0, 0, 0
+        return row['major'], row['minor'], row['patch']
+
+    def _migrateTo041(self, c):
+        c.execute('CREATE TABLE IF NOT EXISTS highscore ('
+                  + 'id INTEGER PRIMARY KEY,'
+                  + 'user_id INTEGER,'
+                  + 'type TEXT,'
+                  + 'gameType TEXT,'
+                  + 'gameSubType TEXT,'
+                  + 'position INTEGER,'
+                  + 'score REAL,'
+                  + 'correctAnswers INTEGER,'
+                  + 'numberOfQuestions INTEGER,'
+                  + 'timestamp INTEGER,'
+                  + 'FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE )'
+                  )
+
+        c.execute('CREATE TABLE IF NOT EXISTS user ('
+                  + 'id INTEGER PRIMARY KEY,'
+                  + 'nickname TEXT )')
+
+    def _migrateTo042(self, c):
+        c.execute('PRAGMA table_info(user)')
+        if 'last_used' not in [row['name'] for row in c.fetchall()]:
             c.execute('ALTER TABLE user ADD COLUMN last_used INTEGER')
 
-        self.conn.commit()
-        c.close()
-
-        xbmc.log('Highscore Database is up-to-date')
+    def _migrateTo043(self, c):
+        c.execute('CREATE INDEX IF NOT EXISTS highscore_rank'
+                  + ' ON highscore(type, gameType, gameSubType, score DESC, timestamp)')
+
+    def _migrateTo044(self, c):
+        # getGamesPlayed() and deleteUser()
+        c.execute('CREATE INDEX IF NOT EXISTS highscore_user ON highscore(user_id)')
+        # getUsers()
+        c.execute('CREATE INDEX IF NOT EXISTS user_last_used ON user(last_used DESC, nickname)')
+
+        # users created before v0.4.2 were never used according to last_used, use their latest highscore
+        c.execute('UPDATE user SET last_used = (SELECT MAX(h.timestamp) FROM highscore h WHERE h.user_id = user.id)'
+                  + ' WHERE last_used IS NULL')
+
+    MIGRATIONS = [
+        ((0, 4, 1), _migrateTo041),
+        ((0, 4, 2), _migrateTo042),
+        ((0, 4, 3), _migrateTo043),
+        ((0, 4, 4), _migrateTo044)
+    ]
 
     def _sqlite_dict_factory(self, cursor, row):
         d = {}
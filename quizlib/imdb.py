@@ -24,56 +24,718 @@ import os
 import urllib2
 import zlib
 import time
+import mmap
+import struct
+import hashlib
+import array
+import sys
+import threading
+import Queue
+import json
+import sqlite3
 
 from strings import *
 
 import xbmc
 import xbmcgui
 
+import logger
+
+log = logger.getLogger('imdb')
+
+class QuotesIndex(object):
+    """
+    Memory-mapped index of the titles in QUOTES_LIST.
+
+    The file starts with a header followed by fixed-width records sorted by title key and finally
+    the title keys themselves, so a title is found with a binary search without loading the file.
+    Titles are normalized by normalizeTitle(), like in QuotesDatabase.
+
+    Header: magic, version, number of records
+    Record: offset of key, offset of quotes in QUOTES_LIST, length of quotes in QUOTES_LIST
+    """
+    MAGIC = 'MQQI'
+    VERSION = 2
+    HEADER = struct.Struct('<4sII')
+    RECORD = struct.Struct('<IQI')
+
+    MOVIE_TITLE_PATTERN = re.compile('^(.+?) \\([0-9?]{4}(/[IVXL]+)?\\)')
+    TVSHOW_TITLE_PATTERN = re.compile('^"(.+?)" \\([0-9?]{4}(/[IVXL]+)?\\)( \\{.*?\\(#([0-9]+)\\.([0-9]+)\\)\\})?')
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = None
+        self.count = 0
+
+        header = self.file.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            self.file.close()
+            raise ValueError('%s is empty' % path)
+
+        magic, version, self.count = self.HEADER.unpack(header)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.file.close()
+            raise ValueError('%s is in an old format, IMDb data must be downloaded again' % path)
+
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.keysOffset = self.HEADER.size + self.count * self.RECORD.size
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def find(self, name, season=None, episode=None):
+        """
+        Finds the position of the quotes of a movie or tv show in QUOTES_LIST.
+
+        @param name: the name of the movie or tv show
+        @type name: unicode
+        @return: a tuple of offset and length or None if the title is not in the index
+        """
+        if season is not None and episode is not None:
+            position = self._find(self.tvShowKey(name, season, episode))
+            if position is not None:
+                return position
+            return self._find(self.tvShowKey(name))
+
+        return self._find(self.movieKey(name))
+
+    def _find(self, key):
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) / 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self._key(low) == key:
+            keyOffset, start, length = self.RECORD.unpack_from(self.map, self.HEADER.size + low * self.RECORD.size)
+            return start, length
+        return None
+
+    def _key(self, idx):
+        keyOffset = self.RECORD.unpack_from(self.map, self.HEADER.size + idx * self.RECORD.size)[0]
+        start = self.keysOffset + keyOffset
+        end = self.map.find('\n', start)
+        return self.map[start:end]
+
+    @staticmethod
+    def movieKey(name):
+        return normalizeTitle(name)
+
+    @staticmethod
+    def tvShowKey(name, season=None, episode=None):
+        key = '"%s"' % normalizeTitle(name)
+        if season is not None and episode is not None:
+            key += ' #%d.%d' % (int(season), int(episode))
+        return key
+
+    @staticmethod
+    def titleKey(title):
+        """
+        Creates the key of a title as it appears in QUOTES_LIST, eg. Matrix (1999) or
+        "Friends" (1994) {The One Where Monica Gets a Roommate (#1.1)}
+
+        @param title: the title as read from QUOTES_LIST
+        @type title: str
+        """
+        title = title.decode('iso-8859-1')
+        m = QuotesIndex.TVSHOW_TITLE_PATTERN.match(title)
+        if m is not None:
+            if m.group(4) is not None:
+                return QuotesIndex.tvShowKey(m.group(1), m.group(4), m.group(5))
+            return QuotesIndex.tvShowKey(m.group(1))
+
+        m = QuotesIndex.MOVIE_TITLE_PATTERN.match(title)
+        if m is not None:
+            return QuotesIndex.movieKey(m.group(1))
+        return None
+
+    @staticmethod
+    def write(path, entries):
+        """
+        Writes an index file.
+
+        @param path: the path of the index file
+        @type path: str
+        @param entries: list of tuples of title key, offset and length
+        @type entries: list
+        """
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+
+        f = open(path, 'wb')
+        f.write(QuotesIndex.HEADER.pack(QuotesIndex.MAGIC, QuotesIndex.VERSION, len(entries)))
+        keyOffset = 0
+        for key, start, length in entries:
+            f.write(QuotesIndex.RECORD.pack(keyOffset, start, length))
+            keyOffset += len(key) + 1
+        for key, start, length in entries:
+            f.write(key + '\n')
+        f.close()
+
+
+class ActorIndex(object):
+    """
+    Memory-mapped hash set of the names in ACTORS_LIST and ACTRESSES_LIST.
+
+    Each name is stored as a 32 bit hash value in one of BUCKETS buckets, chosen by another 16 bits
+    of the hash. The lowest bit of the value is the gender. The buckets are sorted, so a lookup is
+    a table lookup and a binary search within a bucket of usually less than a hundred values.
+
+    Header: magic, version, number of values
+    Bucket table: BUCKETS + 1 offsets of the first value in each bucket
+    Values: sorted hash values
+    """
+    MAGIC = 'MQAI'
+    VERSION = 1
+    HEADER = struct.Struct('<4sII')
+    OFFSET = struct.Struct('<I')
+    BUCKETS = 65536
+
+    GENDER_MALE = 0
+    GENDER_FEMALE = 1
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = None
+        self.count = 0
+
+        header = self.file.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            self.file.close()
+            raise ValueError('%s is empty' % path)
+
+        magic, version, self.count = self.HEADER.unpack(header)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.file.close()
+            raise ValueError('%s is in an old format, IMDb data must be downloaded again' % path)
+
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.valuesOffset = self.HEADER.size + (self.BUCKETS + 1) * self.OFFSET.size
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def getGender(self, name):
+        """
+        @param name: the name of the actor, eg. Firstname Lastname
+        @type name: unicode
+        @return: GENDER_MALE, GENDER_FEMALE or None if the name is unknown or used by both an actor and an actress
+        """
+        bucket, value = ActorIndex.hash(name)
+        low = self.OFFSET.unpack_from(self.map, self.HEADER.size + bucket * self.OFFSET.size)[0]
+        end = self.OFFSET.unpack_from(self.map, self.HEADER.size + (bucket + 1) * self.OFFSET.size)[0]
+
+        # values for the same name are next to each other, male first
+        high = end
+        while low < high:
+            middle = (low + high) / 2
+            if self._value(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+
+        genders = list()
+        while low < end and self._value(low) | 1 == value | 1:
+            genders.append(self._value(low) & 1)
+            low += 1
+
+        if len(genders) == 1:
+            return genders[0]
+        return None
+
+    def _value(self, idx):
+        return self.OFFSET.unpack_from(self.map, self.valuesOffset + idx * self.OFFSET.size)[0]
+
+    @staticmethod
+    def hash(name, gender=GENDER_MALE):
+        """
+        @return: a tuple of bucket and value
+        """
+        if isinstance(name, str):
+            name = name.decode('utf-8', 'ignore')
+        digest = hashlib.md5(' '.join(name.lower().split()).encode('utf-8')).digest()
+        bucket, value = struct.unpack('<HI', digest[:6])
+        return bucket, (value & ~1) | gender
+
+    @staticmethod
+    def createBuckets():
+        return [array.array('I') for bucket in range(ActorIndex.BUCKETS)]
+
+    @staticmethod
+    def write(path, buckets):
+        """
+        Writes an index file.
+
+        @param path: the path of the index file
+        @type path: str
+        @param buckets: the buckets created by createBuckets() filled with values created by hash()
+        @type buckets: list
+        """
+        for idx, bucket in enumerate(buckets):
+            buckets[idx] = array.array('I', sorted(set(bucket)))
+            if sys.byteorder == 'big':
+                buckets[idx].byteswap()
+
+        f = open(path, 'wb')
+        f.write(ActorIndex.HEADER.pack(ActorIndex.MAGIC, ActorIndex.VERSION, sum([len(bucket) for bucket in buckets])))
+        offset = 0
+        for bucket in buckets:
+            f.write(ActorIndex.OFFSET.pack(offset))
+            offset += len(bucket)
+        f.write(ActorIndex.OFFSET.pack(offset))
+        for bucket in buckets:
+            f.write(bucket.tostring())
+        f.close()
+
+
+class QuotesDatabase(object):
+    """
+    SQLite database with one row per quote in QUOTES_LIST, an alternative to QuotesIndex.
+
+    Titles are stored normalized by normalizeTitle(), so eg. The Matrix and Matrix, The are the same title.
+    Movies and quotes for a whole tv show are stored with season and episode -1.
+    The covering index on (title, season, episode, length) lets a random quote be picked without
+    reading the quote texts, and the full text index makes it possible to search the quotes.
+    """
+    TITLE_PATTERN = re.compile('^("?)(.+?)"? \\([0-9?]{4}(/[IVXL]+)?\\)( \\{.*?\\(#([0-9]+)\\.([0-9]+)\\)\\})?')
+
+    def __init__(self, path):
+        # the database is loaded by the background loader and queried by the question prefetcher
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def getRandomQuote(self, name, season=None, episode=None, maxLength=None):
+        """
+        Returns a random quote shorter than maxLength. Quotes from the episode are preferred
+        over quotes for the whole tv show.
+
+        @return: the quote or None if no quote was found
+        """
+        if season is not None and episode is not None:
+            title = '"%s"' % normalizeTitle(name)
+            season = int(season)
+            episode = int(episode)
+        else:
+            title = normalizeTitle(name)
+            season = episode = -1
+        if maxLength is None:
+            maxLength = sys.maxint
+
+        self.lock.acquire()
+        try:
+            c = self.conn.cursor()
+            c.execute('SELECT text FROM quotes WHERE id = (SELECT id FROM quotes WHERE title = ? AND season IN (?, -1)'
+                      ' AND episode IN (?, -1) AND length < ? ORDER BY season = -1, random() LIMIT 1)',
+                      [title.decode('utf-8'), season, episode, maxLength])
+            row = c.fetchone()
+            c.close()
+        finally:
+            self.lock.release()
+
+        if row is None:
+            return None
+        return row[0]
+
+    def search(self, text, limit=10):
+        """
+        Searches the quotes using the full text index.
+
+        @param text: the words to search for
+        @type text: unicode
+        @return: a list of tuples of title, season, episode and quote
+        """
+        self.lock.acquire()
+        try:
+            c = self.conn.cursor()
+            c.execute('SELECT q.title, q.season, q.episode, q.text FROM quotes_fts f, quotes q'
+                      ' WHERE f.text MATCH ? AND q.id = f.rowid LIMIT ?', [text, limit])
+            rows = c.fetchall()
+            c.close()
+        finally:
+            self.lock.release()
+        return rows
+
+    @staticmethod
+    def write(path, quotesListPath):
+        """
+        Creates the database from QUOTES_LIST.
+
+        @param path: the path of the database
+        @type path: str
+        @param quotesListPath: the path of QUOTES_LIST
+        @type quotesListPath: str
+        """
+        if os.path.exists(path):
+            os.remove(path)
+
+        conn = sqlite3.connect(path)
+        conn.text_factory = str
+        c = conn.cursor()
+        c.execute('PRAGMA synchronous = OFF')
+        c.execute('CREATE TABLE quotes (id INTEGER PRIMARY KEY, title TEXT NOT NULL, season INTEGER NOT NULL,'
+                  ' episode INTEGER NOT NULL, length INTEGER NOT NULL, text TEXT NOT NULL)')
+        c.executemany('INSERT INTO quotes(title, season, episode, length, text) VALUES(?, ?, ?, ?, ?)',
+                      QuotesDatabase._readQuotes(quotesListPath))
+        c.execute('CREATE INDEX quotes_title_season_episode_length ON quotes(title, season, episode, length)')
+
+        try:
+            c.execute("CREATE VIRTUAL TABLE quotes_fts USING fts4(content='quotes', text)")
+            c.execute("INSERT INTO quotes_fts(quotes_fts) VALUES('rebuild')")
+        except sqlite3.OperationalError:
+            # external content tables require sqlite 3.7.9
+            c.execute('CREATE VIRTUAL TABLE quotes_fts USING fts3(text)')
+            c.execute('INSERT INTO quotes_fts(rowid, text) SELECT id, text FROM quotes')
+
+        conn.commit()
+        c.close()
+        conn.close()
+
+    @staticmethod
+    def _readQuotes(quotesListPath):
+        """
+        Yields a row for each quote in QUOTES_LIST.
+        """
+        f = open(quotesListPath, 'rb')
+        title = None
+        lines = list()
+        for line in f:
+            if line.startswith('#'):
+                for row in QuotesDatabase._createRows(title, lines):
+                    yield row
+                title = line[2:].strip()
+                lines = list()
+            elif title is not None:
+                lines.append(line)
+        for row in QuotesDatabase._createRows(title, lines):
+            yield row
+        f.close()
+
+    @staticmethod
+    def _createRows(title, lines):
+        if title is None:
+            return
+        m = QuotesDatabase.TITLE_PATTERN.match(title.decode('iso-8859-1'))
+        if m is None:
+            return
+
+        name = normalizeTitle(m.group(2))
+        season = episode = -1
+        if m.group(1):
+            name = '"%s"' % name
+            if m.group(5) is not None:
+                season = int(m.group(5))
+                episode = int(m.group(6))
+        name = name.decode('utf-8')
+
+        for quote in ''.join(lines).split('\n\n'):
+            quote = quote.strip().replace('\n  ', ' ')
+            if quote:
+                text = quote.decode('iso-8859-1')
+                yield name, season, episode, len(text), text
+
+
+def normalizeTitle(title):
+    """
+    Normalizes case, whitespace and trailing articles, eg. Matrix, The becomes the matrix.
+
+    @param title: the title of a movie or tv show
+    @type title: unicode
+    @return: the normalized title encoded as utf-8
+    """
+    if isinstance(title, str):
+        title = title.decode('utf-8', 'ignore')
+    title = ' '.join(title.lower().split())
+    m = TRAILING_ARTICLE_PATTERN.match(title)
+    if m is not None:
+        title = '%s %s' % (m.group(2), m.group(1))
+    return title.encode('utf-8')
+
+
+TRAILING_ARTICLE_PATTERN = re.compile("^(.+), (the|a|an|der|die|das|le|la|les|l'|el|los|las|il|de|het)$")
+
+
+class BackgroundIterator(threading.Thread):
+    """
+    Consumes an iterator in a background thread and makes its items available through a bounded queue,
+    so producing the next items overlaps with processing the current ones.
+    Exceptions raised by the iterator are raised again in the consuming thread.
+    """
+    QUEUE_SIZE = 16
+
+    def __init__(self, iterator):
+        super(BackgroundIterator, self).__init__(name='BackgroundIterator')
+        self.daemon = True
+        self.iterator = iterator
+        self.queue = Queue.Queue(self.QUEUE_SIZE)
+        self.stopped = threading.Event()
+        self.start()
+
+    def run(self):
+        try:
+            for item in self.iterator:
+                if not self._put((True, item)):
+                    return
+            self._put((True, StopIteration))
+        except Exception:
+            self._put((False, sys.exc_info()))
+
+    def _put(self, item):
+        while not self.stopped.isSet():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def stop(self):
+        """
+        Stops the background thread. A consumer waiting for the next item gets StopIteration,
+        eg. another BackgroundIterator consuming this one.
+        """
+        self.stopped.set()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            try:
+                ok, item = self.queue.get(timeout=0.5)
+                break
+            except Queue.Empty:
+                if self.stopped.isSet():
+                    raise StopIteration
+        if not ok:
+            raise item[0], item[1], item[2]
+        if item is StopIteration:
+            raise StopIteration
+        return item
+
+
+class DownloadProgress(object):
+    REPORT_INTERVAL = 0.5
+
+    def __init__(self, size, offset=0):
+        self.size = size
+        self.offset = offset
+        self.received = offset
+        self.startTime = time.time()
+        self.lastReport = 0
+
+    def isReportDue(self):
+        now = time.time()
+        if now - self.lastReport >= self.REPORT_INTERVAL or self.received == self.size:
+            self.lastReport = now
+            return True
+        return False
+
+    def getPercentage(self):
+        if not self.size:
+            return 0
+        return int(self.received * 100 / self.size)
+
+    def getElapsed(self):
+        return time.time() - self.startTime
+
+    def getSpeed(self):
+        """
+        @return: the average download speed in bytes per second
+        """
+        elapsed = self.getElapsed()
+        if elapsed <= 0:
+            return 0.0
+        return (self.received - self.offset) / elapsed
+
+
+def replaceFile(source, destination):
+    """
+    Renames source to destination, replacing destination if it exists.
+    """
+    if os.name == 'nt' and os.path.exists(destination):
+        # rename does not replace existing files on windows
+        os.remove(destination)
+    os.rename(source, destination)
+
+
 class Imdb(object):
+    CHUNK_SIZE = 102400
     ACTOR_PATTERN = re.compile('^([^\t\(]+)( \([^\)]+\))?\t.*?$')
 
+    BASE_URL = 'http://ftp.sunet.se/pub/tv+movies/imdb/'
     QUOTES_INDEX = 'quotes.index'
     QUOTES_LIST = 'quotes.list'
-    QUOTES_URL = 'http://ftp.sunet.se/pub/tv+movies/imdb/quotes.list.gz'
     ACTORS_LIST = 'actors.list'
-    ACTORS_URL = 'http://ftp.sunet.se/pub/tv+movies/imdb/actors.list.gz' 
+    ACTRESSES_LIST = 'actresses.list'
+    ACTORS_INDEX = 'actors.index'
+    QUOTES_DATABASE = 'quotes.db'
+    DOWNLOADS_STATE = 'downloads.json'
+
+    DOWNLOAD_CANCELED = 0
+    DOWNLOAD_COMPLETE = 1
+    DOWNLOAD_UNCHANGED = 2
 
-    def __init__(self):
-        listsPath = xbmc.translatePath(ADDON.getAddonInfo('profile'))
+    def __init__(self, listsPath=None, baseUrl=BASE_URL):
+        """
+        @param listsPath: the directory of the downloaded files, defaults to the addon profile
+        @type listsPath: str
+        @param baseUrl: the url the gzip compressed lists are downloaded from
+        @type baseUrl: str
+        """
+        if listsPath is None:
+            listsPath = xbmc.translatePath(ADDON.getAddonInfo('profile'))
+        self.quotesUrl = baseUrl + self.QUOTES_LIST + '.gz'
+        self.actorsUrl = baseUrl + self.ACTORS_LIST + '.gz'
+        self.actressesUrl = baseUrl + self.ACTRESSES_LIST + '.gz'
+        self.downloadsStatePath = os.path.join(listsPath, self.DOWNLOADS_STATE)
         self.actorsPath = os.path.join(listsPath, self.ACTORS_LIST)
+        self.actressesPath = os.path.join(listsPath, self.ACTRESSES_LIST)
+        self.actorsIndexPath = os.path.join(listsPath, self.ACTORS_INDEX)
         self.quotesIndexPath = os.path.join(listsPath, self.QUOTES_INDEX)
         self.quotesListPath = os.path.join(listsPath, self.QUOTES_LIST)
+        self.quotesDatabasePath = os.path.join(listsPath, self.QUOTES_DATABASE)
 
-        self.actorNames = None
+        self.actorsIndex = None
         self.quotesIndex = None
+        self.quotesDatabase = None
+
+        self.dataLoaded = threading.Event()
+        self.loaderLock = threading.Lock()
+        self.loader = None
 
     def isDataPresent(self):
-        return os.path.exists(self.actorsPath) and os.path.exists(self.quotesIndexPath) and os.path.exists(self.quotesListPath)
+        return os.path.exists(self.actorsIndexPath) and os.path.exists(self.quotesIndexPath) and os.path.exists(self.quotesListPath)
+
+    def loadDataInBackground(self):
+        """
+        Starts loading the data in a background thread, unless it is already loading.
+
+        @return: a threading.Event which is set when the data is loaded
+        """
+        self.loaderLock.acquire()
+        try:
+            if self.loader is None and not self.dataLoaded.isSet():
+                self.loader = threading.Thread(target=self._loadDataInBackground, name='ImdbLoader')
+                self.loader.daemon = True
+                self.loader.start()
+        finally:
+            self.loaderLock.release()
+        return self.dataLoaded
+
+    def isLoadingData(self):
+        """
+        Returns True while the data is being loaded in the background.
+        """
+        return self.loader is not None and self.loader.isAlive() and not self.dataLoaded.isSet()
+
+    def isDataLoaded(self):
+        """
+        Returns True if the data is loaded, otherwise loading is started in the background.
+        """
+        if not self.dataLoaded.isSet():
+            self.loadDataInBackground()
+        return self.dataLoaded.isSet()
+
+    def _loadDataInBackground(self):
+        try:
+            self.loadData()
+        finally:
+            # questions waiting for the data must not wait forever if loading failed
+            self.dataLoaded.set()
 
     def loadData(self):
+        startTime = time.time()
         if os.path.exists(self.quotesIndexPath):
-            startTime = time.time()
-            f = open(self.quotesIndexPath)
-            self.quotesIndex = f.read()
-            f.close()
-            xbmc.log("Loaded %d MB quotes index in %d seconds" % (len(self.quotesIndex) / 1048576, (time.time() - startTime)))
+            try:
+                self.quotesIndex = QuotesIndex(self.quotesIndexPath)
+                log.info("Opened quotes index with %d titles", self.quotesIndex.count)
+            except ValueError, ex:
+                log.warning(str(ex))
+                # otherwise downloadFiles() skips the unchanged list and the index is never created again
+                os.remove(self.quotesIndexPath)
 
-        if os.path.exists(self.actorsPath):
-            startTime = time.time()
-            f = open(self.actorsPath)
-            self.actorNames = f.read().decode('iso-8859-1').splitlines()
-            f.close()
-            xbmc.log("Loaded %d actor names in %d seconds" % (len(self.actorNames), (time.time() - startTime)))
+        if self.isQuotesDatabaseEnabled() and os.path.exists(self.quotesDatabasePath):
+            self.quotesDatabase = QuotesDatabase(self.quotesDatabasePath)
+            log.info("Opened quotes database")
+
+        if os.path.exists(self.actorsIndexPath):
+            try:
+                self.actorsIndex = ActorIndex(self.actorsIndexPath)
+                log.info("Opened actors index with %d names", self.actorsIndex.count)
+            except ValueError, ex:
+                log.warning(str(ex))
+                os.remove(self.actorsIndexPath)
+
+        self.dataLoaded.set()
+        log.info("Loaded IMDb data in %.3f seconds", time.time() - startTime)
+
+    def isQuotesDatabaseEnabled(self):
+        return ADDON.getSetting('imdb.quotes.database') == 'true'
 
     def downloadFiles(self, downloadState):
+        """
+        Downloads the lists and creates the indexes. Lists which have not changed since they
+        were last downloaded are skipped and a canceled download is resumed the next time.
+
+        @return: False if the download was canceled
+        """
         downloadState.idx += 1
-        self._downloadGzipFile(self.QUOTES_URL, self.quotesListPath, downloadState.progress, self._createQuotesIndex)
-        downloadState.idx += 1
-        self._downloadGzipFile(self.ACTORS_URL, self.actorsPath, downloadState.progress, self._postprocessActorNames)
+        self.quotesIndexEntries = list()
+        self.bytesProcessed = 0
+        self.previousQuotesTitle = None
+        quotesPaths = [self.quotesIndexPath]
+        if self.isQuotesDatabaseEnabled():
+            quotesPaths.append(self.quotesDatabasePath)
+        quotesStatus = self._downloadGzipFile(self.quotesUrl, self.quotesListPath, downloadState.progress,
+                                              self._createQuotesIndex, quotesPaths)
+        if quotesStatus == self.DOWNLOAD_CANCELED:
+            return False
+        elif quotesStatus == self.DOWNLOAD_COMPLETE:
+            self._writeQuotesIndex()
+            if self.isQuotesDatabaseEnabled():
+                self._writeQuotesDatabase()
+            self._setDownloadComplete(self.quotesUrl)
+
+        self.actorBuckets = ActorIndex.createBuckets()
+        actorStatuses = list()
+        for url, path, gender in [(self.actorsUrl, self.actorsPath, ActorIndex.GENDER_MALE),
+                                  (self.actressesUrl, self.actressesPath, ActorIndex.GENDER_FEMALE)]:
+            downloadState.idx += 1
+            self.actorGender = gender
+            self.previousLastnameFirstname = None
+            status = self._downloadGzipFile(url, path, downloadState.progress, self._postprocessActorNames,
+                                            [self.actorsIndexPath])
+            if status == self.DOWNLOAD_CANCELED:
+                return False
+            actorStatuses.append((url, path, gender, status))
+
+        if [status for url, path, gender, status in actorStatuses if status == self.DOWNLOAD_COMPLETE]:
+            # the index is created from both lists, so names from an unchanged list are read from disk
+            for url, path, gender, status in actorStatuses:
+                if status == self.DOWNLOAD_UNCHANGED:
+                    self._hashActorNames(path, gender)
+            self._writeActorsIndex()
+            for url, path, gender, status in actorStatuses:
+                self._setDownloadComplete(url)
+        del self.actorBuckets
 
+        return True
 
     def getRandomQuote(self, name, season = None, episode = None, maxLength = None):
+        if self.quotesDatabase is not None:
+            return self.quotesDatabase.getRandomQuote(name, season, episode, maxLength)
+
         quotes = self._loadQuotes(name, season, episode)
         if not quotes:
             return None
@@ -88,112 +750,317 @@ class Imdb(object):
         return re.sub('\n  ', ' ', quote)
 
     def isActor(self, name):
-        if self.actorNames:
-            #m = re.search('^%s$' % name, self.actorNames, re.MULTILINE)
-            return name in self.actorNames
+        gender = self.getGender(name)
+        if gender is None and self.actorsIndex is None:
+            return None
+        return gender == ActorIndex.GENDER_MALE
+
+    def getGender(self, name):
+        """
+        @param name: the name of the actor, eg. Firstname Lastname
+        @type name: unicode
+        @return: ActorIndex.GENDER_MALE, ActorIndex.GENDER_FEMALE or None if the gender is unknown
+        """
+        if self.actorsIndex:
+            return self.actorsIndex.getGender(name)
         else:
-            xbmc.log("%s does not exists, has it been downloaded yet?" % self.ACTORS_LIST)
+            log.warning("%s does not exists, has it been downloaded yet?", self.ACTORS_INDEX)
             return None
 
 
-    def _postprocessActorNames(self, line):
+    def _postprocessActorNames(self, lines):
         """
-        Changes author names from Lastname, Firstname into Firstname Lastname line by line
+        Changes author names from Lastname, Firstname into Firstname Lastname
         and removes duplicate lines. It is assumed the lines are provided sorted.
 
-        @param line: a line from ACTORS_LIST
-        @type line: str
+        @param lines: a block of lines from ACTORS_LIST
+        @type lines: list
         """
         if not hasattr(self, 'previousLastnameFirstname'):
             self.previousLastnameFirstname = None
+        if not hasattr(self, 'actorGender'):
+            self.actorGender = ActorIndex.GENDER_MALE
+
+        search = self.ACTOR_PATTERN.search
+        buckets = getattr(self, 'actorBuckets', None)
+        result = list()
+        for line in lines:
+            m = search(line)
+            if m is None:
+                continue
 
-        m = self.ACTOR_PATTERN.search(line)
-        if m is not None:
             lastnameFirstname = m.group(1).strip()
-            if lastnameFirstname != self.previousLastnameFirstname:
-                self.previousLastnameFirstname = lastnameFirstname
+            if lastnameFirstname == self.previousLastnameFirstname:
+                continue
+            self.previousLastnameFirstname = lastnameFirstname
 
-                parts = lastnameFirstname.split(', ', 2)
-                if len(parts) == 2:
-                    firstnameLastname = "%s %s\n" % (parts[1], parts[0])
-                    return firstnameLastname
+            parts = lastnameFirstname.split(', ', 2)
+            if len(parts) == 2:
+                firstnameLastname = "%s %s\n" % (parts[1], parts[0])
+                if buckets is not None:
+                    bucket, value = ActorIndex.hash(firstnameLastname.decode('iso-8859-1'), self.actorGender)
+                    buckets[bucket].append(value)
+                result.append(firstnameLastname)
 
-        return ''
+        return result
 
-    def _createQuotesIndex(self, line):
+    def _createQuotesIndex(self, lines):
         """
-        Creates an index file of the QUOTES_LIST file. The index contains
-        byte offsets of each movie title to make it possible to load just 
-        part of the QUOTES_LIST file.
+        Collects the byte offsets of each movie and tv show title in the QUOTES_LIST file
+        to make it possible to load just part of the QUOTES_LIST file.
+        The index is written by _writeQuotesIndex() when the download is complete.
 
-        @param line: a line from QUOTES_LIST
-        @type line: str
+        @param lines: a block of lines from QUOTES_LIST
+        @type lines: list
         """
-        if not hasattr(self, 'indexFile'):
+        if not hasattr(self, 'bytesProcessed'):
             self.bytesProcessed = 0
-            self.indexFile = open(self.quotesIndexPath, 'w')
+            self.previousQuotesTitle = None
+
+        for line in lines:
+            if line.startswith('#'):
+                self._addQuotesIndexEntry()
+                self.previousQuotesTitle = (QuotesIndex.titleKey(line[2:].strip()), self.bytesProcessed)
+
+            self.bytesProcessed += len(line)
+        return lines
+
+    def _addQuotesIndexEntry(self):
+        if self.previousQuotesTitle is not None and self.previousQuotesTitle[0] is not None:
+            key, start = self.previousQuotesTitle
+            self.quotesIndexEntries.append((key, start, self.bytesProcessed - start))
+
+    def _writeQuotesIndex(self):
+        if hasattr(self, 'bytesProcessed'):
+            self._addQuotesIndexEntry()
+            del self.bytesProcessed
+
+        if self.quotesIndex is not None:
+            self.quotesIndex.close()
+            self.quotesIndex = None
+
+        QuotesIndex.write(self.quotesIndexPath + '.tmp', self.quotesIndexEntries)
+        replaceFile(self.quotesIndexPath + '.tmp', self.quotesIndexPath)
+        self.quotesIndexEntries = list()
 
-        if line.startswith('#'):
-            self.indexFile.write(line[2:].strip() + "\t" + str(self.bytesProcessed) + "\n")
+    def _writeQuotesDatabase(self):
+        if self.quotesDatabase is not None:
+            self.quotesDatabase.close()
+            self.quotesDatabase = None
 
-        self.bytesProcessed += len(line)
-        return line
+        startTime = time.time()
+        QuotesDatabase.write(self.quotesDatabasePath + '.tmp', self.quotesListPath)
+        replaceFile(self.quotesDatabasePath + '.tmp', self.quotesDatabasePath)
+        log.info("Created quotes database in %d seconds", time.time() - startTime)
 
+    def _writeActorsIndex(self):
+        if self.actorsIndex is not None:
+            self.actorsIndex.close()
+            self.actorsIndex = None
 
-    def _downloadGzipFile(self, url, destination, progressCallback = None, postprocessLineCallback = None):
+        ActorIndex.write(self.actorsIndexPath + '.tmp', self.actorBuckets)
+        replaceFile(self.actorsIndexPath + '.tmp', self.actorsIndexPath)
+
+    def _hashActorNames(self, path, gender):
+        """
+        Adds the names in a previously downloaded and postprocessed actors list to the actor index.
+        """
+        f = open(path, 'rb')
+        for line in f:
+            bucket, value = ActorIndex.hash(line.decode('iso-8859-1'), gender)
+            self.actorBuckets[bucket].append(value)
+        f.close()
+
+    def _loadDownloadsState(self):
+        if not os.path.exists(self.downloadsStatePath):
+            return dict()
+        try:
+            f = open(self.downloadsStatePath)
+            state = json.load(f)
+            f.close()
+            return state
+        except ValueError:
+            return dict()
+
+    def _saveDownloadState(self, url, state):
+        downloadsState = self._loadDownloadsState()
+        downloadsState[url] = state
+        f = open(self.downloadsStatePath + '.tmp', 'w')
+        json.dump(downloadsState, f)
+        f.close()
+        replaceFile(self.downloadsStatePath + '.tmp', self.downloadsStatePath)
+
+    def _setDownloadComplete(self, url):
+        state = self._loadDownloadsState().get(url, dict())
+        state['complete'] = True
+        self._saveDownloadState(url, state)
+
+
+    def _downloadGzipFile(self, url, destination, progressCallback = None, postprocessLinesCallback = None,
+                          dependentPaths = None):
         """
         Downloads a gzip compressed file and extracts it on the fly.
-        Optionally providing progress via the progressCallback and postprocessing on a line level
-        via the postprocessLineCallback.
+        Optionally providing progress via the progressCallback and postprocessing of blocks of lines
+        via the postprocessLinesCallback.
+
+        Reading from the network and decompressing runs in background threads,
+        so they overlap with the postprocessing in the calling thread.
+
+        The compressed file is kept in destination.gz.part until it has been extracted, so an interrupted
+        download is resumed with a HTTP Range request. A file which has been downloaded completely is only
+        downloaded again if the ETag or Last-Modified header of the url has changed.
+        The extracted file replaces destination when it is complete.
 
         @param url: the full url of the gzip file
         @type url: str
         @param destination: the full path of the destination file
         @type destination: str
-        @param progressCallback: a callback function which is invoked periodically with progress information
+        @param progressCallback: a callback function which is invoked periodically with progress information,
+        it is passed received bytes, total bytes, percentage and bytes per second and returns False to cancel
         @type progressCallback: method
+        @param postprocessLinesCallback: a callback function which is passed a list of lines
+        and returns a list of lines to write
+        @type postprocessLinesCallback: method
+        @param dependentPaths: files created from destination, which must exist for the download to be skipped
+        @type dependentPaths: list
+        @return: DOWNLOAD_COMPLETE, DOWNLOAD_UNCHANGED or DOWNLOAD_CANCELED
         """
-        response = urllib2.urlopen(url, timeout=30)
-        file = open(destination, 'wb')
-        decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+        partPath = destination + '.gz.part'
+        state = self._loadDownloadsState().get(url, dict())
+        validator = state.get('etag') or state.get('lastModified')
 
-        partialLine = None
-        contentReceived = 0
-        contentLength = int(response.info()['Content-Length'])
-        while True:
-            chunk = response.read(102400)
-            if not chunk:
-                break
-            contentReceived += len(chunk)
-            decompressedChunk = decompressor.decompress(chunk)
-
-            if postprocessLineCallback is not None:
-                if partialLine is not None:
-                    decompressedChunk = partialLine + decompressedChunk
-                    partialLine = None
-
-                lines = decompressedChunk.splitlines(True)
-                processedChunk = ''
-                
-                for line in lines:
-                    if line[-1:] == '\n': # We have a complete line
-                        processedLine = postprocessLineCallback(line)
-                        if processedLine != '':
-                            processedChunk += processedLine
-                    else: # partial line
-                        partialLine = line
-                file.write(processedChunk)
-            
+        request = urllib2.Request(url)
+        offset = 0
+        if os.path.exists(partPath) and validator is not None:
+            offset = os.path.getsize(partPath)
+            request.add_header('Range', 'bytes=%d-' % offset)
+            request.add_header('If-Range', validator)
+        elif state.get('complete') and os.path.exists(destination) and \
+                not [path for path in dependentPaths or [] if not os.path.exists(path)]:
+            if state.get('etag'):
+                request.add_header('If-None-Match', state['etag'])
+            if state.get('lastModified'):
+                request.add_header('If-Modified-Since', state['lastModified'])
+
+        try:
+            response = urllib2.urlopen(request, timeout=30)
+        except urllib2.HTTPError, ex:
+            if ex.code == 304:
+                log.info("%s has not changed since it was downloaded", url)
+                return self.DOWNLOAD_UNCHANGED
+            elif ex.code == 416 and offset > 0:
+                # the partial file is already complete
+                response = None
             else:
-                file.write(decompressedChunk)
+                raise
+
+        if response is None:
+            contentLength = offset
+        elif response.getcode() == 206:
+            contentLength = offset + int(response.info()['Content-Length'])
+        else:
+            offset = 0
+            contentLength = int(response.info()['Content-Length'])
+            if response.info().get('ETag') is None and response.info().get('Last-Modified') is None:
+                log.warning("%s does not support conditional requests", url)
+            self._saveDownloadState(url, {
+                'etag': response.info().get('ETag'),
+                'lastModified': response.info().get('Last-Modified'),
+                'complete': False
+            })
+        progress = DownloadProgress(contentLength, offset)
+
+        chunks = BackgroundIterator(self._readChunks(response, progress, partPath, offset))
+        blocks = BackgroundIterator(self._decompressLines(chunks, postprocessLinesCallback is not None))
+        file = open(destination + '.tmp', 'wb')
+        status = self.DOWNLOAD_COMPLETE
+        try:
+            for block in blocks:
+                if postprocessLinesCallback is not None:
+                    block = ''.join(postprocessLinesCallback(block))
+                file.write(block)
 
-            if progressCallback is not None:
-                percentage = int(contentReceived * 100 / contentLength)
-                if not progressCallback(contentReceived, contentLength, percentage):
+                if progressCallback is not None and progress.isReportDue():
+                    if not progressCallback(progress.received, contentLength, progress.getPercentage(), progress.getSpeed()):
+                        status = self.DOWNLOAD_CANCELED
+                        break
+        except:
+            # the partial file is kept to resume the download, the partly extracted file is not
+            file.close()
+            os.remove(destination + '.tmp')
+            raise
+        finally:
+            chunks.stop()
+            blocks.stop()
+            file.close()
+            if response is not None:
+                response.close()
+
+        if status == self.DOWNLOAD_COMPLETE:
+            replaceFile(destination + '.tmp', destination)
+            os.remove(partPath)
+            log.info("Downloaded %s in %d seconds, %.2f MB/s", url, progress.getElapsed(), progress.getSpeed() / 1048576.0)
+        else:
+            os.remove(destination + '.tmp')
+        return status
+
+    def _readChunks(self, response, progress, partPath, offset):
+        """
+        Yields the first offset bytes from the partial file followed by the response, which is appended to the partial file.
+        """
+        if offset > 0:
+            partFile = open(partPath, 'rb')
+            while partFile.tell() < offset:
+                chunk = partFile.read(min(self.CHUNK_SIZE, offset - partFile.tell()))
+                if not chunk:
                     break
+                yield chunk
+            partFile.close()
+        if response is None:
+            return
 
-        file.close()
-        response.close()
+        partFile = open(partPath, offset > 0 and 'ab' or 'wb')
+        try:
+            while True:
+                chunk = response.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                partFile.write(chunk)
+                progress.received += len(chunk)
+                yield chunk
+        finally:
+            partFile.close()
+        if progress.received < progress.size:
+            # keep the partial file, so the download is resumed next time
+            raise IOError('Connection closed after %d of %d bytes' % (progress.received, progress.size))
+
+    def _decompressLines(self, chunks, splitLines):
+        """
+        Decompresses the chunks and yields blocks of data, or lists of complete lines if splitLines is True.
+        """
+        decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+        partialLine = ''
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if not splitLines:
+                yield data
+                continue
+
+            end = data.rfind('\n') + 1
+            if end == 0:
+                partialLine += data
+                continue
+
+            lines = (partialLine + data[:end]).splitlines(True)
+            partialLine = data[end:]
+            yield lines
+
+        data = partialLine + decompressor.flush()
+        if data:
+            if splitLines:
+                yield data.splitlines(True)
+            else:
+                yield data
 
     def _loadQuotes(self, name, season, episode):
         """
@@ -209,22 +1076,17 @@ class Imdb(object):
         @return a list containing the individual quotes from the movie or tv show
         """
         # find position using index
-        if season is not None and episode is not None:
-            pattern = '\n"%s" \([0-9]+\)( \{.*?\(\#%s.%s\)\})?\t([0-9]+)\n[^\t]+\t([0-9]+)' % (name, season, episode)
-            start = 2
-            end = 3
-        else:
-            pattern = '\n%s [^\t]+\t([0-9]+)\n[^\t]+\t([0-9]+)' % name
-            start = 1
-            end = 2
-        m = re.search(pattern, self.quotesIndex, re.DOTALL)
-        if m is None:
+        if self.quotesIndex is None:
+            return []
+        position = self.quotesIndex.find(name, season, episode)
+        if position is None:
             return []
 
         # load quotes based on position
-        f = open(self.quotesListPath)
-        f.seek(int(m.group(start)))
-        quotes = f.read(int(m.group(end)) - int(m.group(start)))
+        start, length = position
+        f = open(self.quotesListPath, 'rb')
+        f.seek(start)
+        quotes = f.read(length)
         f.close()
 
         # remove first line and split on double new lines
@@ -242,16 +1104,17 @@ if __name__ == '__main__':
             self.idx = 0
             self.count = count
 
-        def progress(self, received, size, percentage):
+        def progress(self, received, size, percentage, speed):
             line1 = strings(S_FILE_X_OF_Y) % (self.idx, self.count)
             line2 = strings(S_RETRIEVED_X_OF_Y_MB) % (received / 1048576, size / 1048576)
-            d.update(percentage, line1, line2)
+            line3 = '%.2f MB/s' % (speed / 1048576.0)
+            d.update(percentage, line1, line2, line3)
             return not d.iscanceled()
 
     i = Imdb()
     d = xbmcgui.DialogProgress()
     try:
-        ds = DownloadState(2)
+        ds = DownloadState(3)
         d.create(strings(S_DOWNLOADING_IMDB_DATA))
         i.downloadFiles(ds)
 
@@ -0,0 +1,159 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import random
+
+
+class LibraryIndex(object):
+    """
+    Inverted index over library items, eg. actor -> movieids.
+
+    Postings are kept as sets keyed by the lowercased value, so lookups are O(1) and
+    "with" and "without" queries are plain set intersections and differences.
+    """
+
+    def __init__(self, fields):
+        """
+        @param fields: the fields to index, eg. ['actor', 'director']
+        @type fields: list
+        """
+        self.fields = fields
+        self.postings = dict([(field, dict()) for field in fields])
+        self.names = dict([(field, dict()) for field in fields])
+        self.itemIds = set()
+        self.frequentKeys = dict()
+
+    def toData(self):
+        """
+        Returns the postings as a dict of marshal-compatible values, see fromData().
+        """
+        return {'postings': self.postings, 'names': self.names, 'itemIds': self.itemIds}
+
+    def fromData(self, data):
+        """
+        Replaces the postings with the ones returned by toData(), instead of adding every item again.
+        """
+        self.postings = data['postings']
+        self.names = data['names']
+        self.itemIds = data['itemIds']
+        self.frequentKeys.clear()
+
+    def add(self, itemId, field, values):
+        """
+        Adds an item to the postings of each of the values.
+
+        @param itemId: the library id of the item, eg. a movieid
+        @type itemId: int
+        @param field: the indexed field
+        @type field: str
+        @param values: the values of the field for the item, eg. the names of the cast
+        @type values: list
+        """
+        self.itemIds.add(itemId)
+        self.frequentKeys.clear()
+        postings = self.postings[field]
+        names = self.names[field]
+        for value in values:
+            if value is None or value == '':
+                continue
+            key = _key(value)
+            if not key in postings:
+                postings[key] = set()
+                names[key] = value
+            postings[key].add(itemId)
+
+    def discard(self, itemId, field, values):
+        """
+        Removes an item from the postings of each of the values, the reverse of add(),
+        so only the postings of the values are inspected.
+        """
+        self.itemIds.discard(itemId)
+        self.frequentKeys.clear()
+        postings = self.postings[field]
+        for value in values:
+            if value is None or value == '':
+                continue
+            key = _key(value)
+            if key in postings:
+                postings[key].discard(itemId)
+                if not postings[key]:
+                    del postings[key]
+                    del self.names[field][key]
+
+    def get(self, field, value):
+        """
+        Returns the ids of the items having the value, eg. the movies an actor is in.
+        The returned set must not be modified.
+        """
+        return self.postings[field].get(_key(value), _EMPTY)
+
+    def having(self, field, value, within=None):
+        """
+        Returns the ids of the items having the value, optionally limited to the ids in within.
+        """
+        itemIds = self.get(field, value)
+        if within is not None:
+            return itemIds & within
+        return set(itemIds)
+
+    def without(self, field, value, within=None):
+        """
+        Returns the ids of the items not having the value, optionally limited to the ids in within.
+        """
+        if within is None:
+            within = self.itemIds
+        return within - self.get(field, value)
+
+    def randomKey(self, field, minimum=1, within=None, accept=None):
+        """
+        Returns a random value having at least minimum items, or None if no value qualifies.
+        Values are tried in random order, so only a few postings are usually inspected.
+
+        @param accept: optional callable that must return True for the value to be used
+        @type accept: method
+        """
+        if not (field, minimum) in self.frequentKeys:
+            self.frequentKeys[(field, minimum)] = [key for key, itemIds in self.postings[field].iteritems()
+                                                   if len(itemIds) >= minimum]
+        keys = list(self.frequentKeys[(field, minimum)])
+        end = len(keys)
+        while end > 0:
+            # shuffle lazily, most of the time one of the first few keys is used
+            pick = random.randint(0, end - 1)
+            end -= 1
+            keys[pick], keys[end] = keys[end], keys[pick]
+            key = keys[end]
+
+            if within is not None and len(self.postings[field][key] & within) < minimum:
+                continue
+            name = self.names[field][key]
+            if accept is not None and not accept(name):
+                continue
+            return name
+        return None
+
+
+_EMPTY = frozenset()
+
+
+def _key(value):
+    if isinstance(value, basestring):
+        return value.lower()
+    return value
@@ -18,8 +18,38 @@
 #  http://www.gnu.org/copyleft/gpl.html
 #
 
-import xbmc
 import json
+import threading
+import time
+
+import logger
+import transport
+
+log = logger.getLogger('library')
+
+# Notifications sent by XBMC when the content of the library changes
+LIBRARY_CHANGED_NOTIFICATIONS = [
+    'VideoLibrary.OnScanFinished', 'VideoLibrary.OnCleanFinished', 'VideoLibrary.OnUpdate', 'VideoLibrary.OnRemove',
+    'AudioLibrary.OnScanFinished', 'AudioLibrary.OnCleanFinished', 'AudioLibrary.OnUpdate', 'AudioLibrary.OnRemove'
+]
+
+_transport = None
+
+
+def setTransport(t):
+    """
+    Sets the transport used to send JSON-RPC requests, eg. transport.SocketTransport
+    to run outside XBMC. The default is transport.XbmcTransport.
+    """
+    global _transport
+    _transport = t
+
+
+def getTransport():
+    global _transport
+    if _transport is None:
+        _transport = transport.XbmcTransport()
+    return _transport
 
 
 def getMovies(properties=None):
@@ -46,11 +76,11 @@ def getEpisodes(properties=None):
 
 
 def getMovieCount():
-    return getMovies().limitTo(1).getResponse()['result']['limits']['total']
+    return getLibraryStatus()['movieCount']
 
 
 def getTVShowsCount():
-    return getTVShows().limitTo(1).getResponse()['result']['limits']['total']
+    return getLibraryStatus()['tvShowCount']
 
 
 def getSeasonsCount(tvShowId):
@@ -58,7 +88,7 @@ def getSeasonsCount(tvShowId):
 
 
 def getEpisodesCount():
-    return getEpisodes().limitTo(1).getResponse()['result']['limits']['total']
+    return getLibraryStatus()['episodeCount']
 
 
 def getSongs(properties=None):
@@ -87,42 +117,159 @@ def getArtistDetails(artistId, properties=None):
 
 
 def hasMovies():
-    return Query('XBMC.GetInfoBooleans', {'booleans': ['Library.HasContent(Movies)']},
-                 resultKey='Library.HasContent(Movies)').asList()
+    return getLibraryStatus()['hasMovies']
 
 
 def hasTVShows():
-    return Query('XBMC.GetInfoBooleans', {'booleans': ['Library.HasContent(TVShows)']},
-                 resultKey='Library.HasContent(TVShows)').asList()
+    return getLibraryStatus()['hasTVShows']
 
 
 def hasMusic():
-    return Query('XBMC.GetInfoBooleans', {'booleans': ['Library.HasContent(Music)']},
-                 resultKey='Library.HasContent(Music)').asList()
+    return getLibraryStatus()['hasMusic']
 
 
 def isAnyVideosWatched():
-    return len(getMovies([]).minPlayCount(1).limitTo(1).asList()) > 0
+    return getLibraryStatus()['isAnyVideosWatched']
 
 
 def isAnyMPAARatingsAvailable():
+    return getLibraryStatus()['isAnyMPAARatingsAvailable']
+
+
+def isAnyContentRatingsAvailable():
+    return getLibraryStatus()['isAnyContentRatingsAvailable']
+
+
+def getLibraryStatus():
+    """
+    Returns what the library contains, see LibraryStatusCache.
+
+    @return: a dict with the results of hasMovies(), hasTVShows(), hasMusic(), isAnyVideosWatched(),
+    isAnyMPAARatingsAvailable() and isAnyContentRatingsAvailable(), keyed by the function names,
+    and the movieCount, tvShowCount and episodeCount
+    """
+    return _statusCache.get()
+
+
+def loadLibraryStatusInBackground():
+    """
+    Checks the library content in a background thread, eg. while the splash screen is shown,
+    unless the result is already cached.
+    """
+    threading.Thread(target=_statusCache.get, name='LibraryStatus').start()
+
+
+def invalidateLibraryStatus():
+    _statusCache.invalidate()
+
+
+def onNotification(method):
+    """
+    Handles a JSON-RPC notification from XBMC, eg. VideoLibrary.OnScanFinished.
+    Notifications about library changes invalidate the cached library status.
+
+    @param method: the method of the notification
+    @type method: str
+    """
+    if method in LIBRARY_CHANGED_NOTIFICATIONS:
+        log.debug("%s invalidates the library status", method)
+        _statusCache.invalidate()
+
+
+class LibraryStatusCache(object):
+    """
+    Caches the library status, as the menu checks it each time it is opened.
+
+    The status is checked with a single batch request, sent again when XBMC notifies of library changes,
+    see onNotification(), or when the status is older than ttl seconds in case a notification was missed.
+    Threads asking at the same time share one request.
+    """
+    TTL_SECONDS = 600
+
+    def __init__(self, ttl=TTL_SECONDS):
+        self.ttl = ttl
+        self.status = None
+        self.timestamp = 0.0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        self.lock.acquire()
+        try:
+            # read once, invalidate() may clear it at any time
+            status, timestamp = self.status, self.timestamp
+            if status is None or time.time() - timestamp > self.ttl:
+                generation = self.generation
+                startTime = time.time()
+                status = _queryLibraryStatus()
+                log.info("Checked library status in %.3f seconds", time.time() - startTime)
+                if generation == self.generation:
+                    # not invalidated while querying
+                    self.status = status
+                    self.timestamp = startTime
+            return dict(status)
+        finally:
+            self.lock.release()
+
+    def invalidate(self):
+        # not locked, so a notification is never blocked by a running query
+        self.generation += 1
+        self.status = None
+
+
+def _queryLibraryStatus():
+    batch = QueryBatch()
+    booleans = batch.add(Query('XBMC.GetInfoBooleans', {'booleans': [
+        'Library.HasContent(Movies)', 'Library.HasContent(TVShows)', 'Library.HasContent(Music)'
+    ]}))
+    videosWatched = batch.add(_anyVideosWatchedQuery())
+    mpaaRatings = batch.add(_anyMPAARatingsQuery())
+    contentRatings = batch.add(_anyContentRatingsQuery())
+    movies = batch.add(getMovies([]).limitTo(1))
+    tvShows = batch.add(getTVShows([]).limitTo(1))
+    episodes = batch.add(getEpisodes([]).limitTo(1))
+    batch.execute()
+
+    result = booleans.getResponse().get('result', dict())
+    return {
+        'hasMovies': bool(result.get('Library.HasContent(Movies)')),
+        'hasTVShows': bool(result.get('Library.HasContent(TVShows)')),
+        'hasMusic': bool(result.get('Library.HasContent(Music)')),
+        'isAnyVideosWatched': len(videosWatched.asList()) > 0,
+        'isAnyMPAARatingsAvailable': len(mpaaRatings.asList()) > 0,
+        'isAnyContentRatingsAvailable': len(contentRatings.asList()) > 0,
+        'movieCount': _getTotal(movies),
+        'tvShowCount': _getTotal(tvShows),
+        'episodeCount': _getTotal(episodes)
+    }
+
+
+def _getTotal(query):
+    return query.getResponse().get('result', dict()).get('limits', dict()).get('total', 0)
+
+
+def _anyVideosWatchedQuery():
+    return getMovies([]).minPlayCount(1).limitTo(1)
+
+
+def _anyMPAARatingsQuery():
     query = getMovies([]).limitTo(1)
     query.filters.append({
         'operator': 'isnot',
         'field': 'mpaarating',
         'value': ''
     })
-    return len(query.asList()) > 0
+    return query
 
 
-def isAnyContentRatingsAvailable():
+def _anyContentRatingsQuery():
     query = getTVShows([]).limitTo(1)
     query.filters.append({
         'operator': 'isnot',
         'field': 'rating',
         'value': ''
     })
-    return len(query.asList()) > 0
+    return query
 
 
 def buildRatingsFilters(field, ratings):
@@ -145,35 +292,83 @@ def buildOnlyWathcedFilter():
             }]
 
 
+def execute(description, command):
+    """
+    Sends a JSON-RPC command using the transport and logs the size of the response and the time it took.
+
+    @param description: a description of the command for the log, eg. the method
+    @type description: str
+    @param command: the JSON encoded request
+    @type command: str
+    @return: the JSON encoded response
+    """
+    startTime = time.time()
+    resp = getTransport().execute(command)
+    log.info('%s returned %d bytes in %.3f seconds', description, len(resp), time.time() - startTime)
+    if log.isPayloadEnabled():
+        log.info('Request: %s', command)
+        log.info('Response: %s', resp)
+    return resp
+
+
+# The key holding the library id of the items in each type of result
+ID_KEYS = {
+    'movies': 'movieid',
+    'tvshows': 'tvshowid',
+    'episodes': 'episodeid',
+    'songs': 'songid',
+    'albums': 'albumid',
+    'artists': 'artistid'
+}
+
+
 class Query(object):
     def __init__(self, method, params, properties=None, resultKey=None, id=1):
         self.properties = properties
         self.params = params
         self.filters = list()
         self.resultKey = resultKey
+        self.response = None
+        self.limit = None
+        self.excludedIds = set()
         self.query = {
             'jsonrpc': '2.0',
             'id': id,
             'method': method
         }
 
-    def getResponse(self):
+    def buildRequest(self):
+        """
+        Returns the JSON-RPC request object or None if the query is not sent to XBMC.
+        """
         if self.filters:
             self.params['filter'] = {'and': self.filters}
+        if self.excludedIds and self.limit is not None:
+            # the excluded items are dropped from the response
+            self.params['limits'] = {'start': 0, 'end': self.limit + len(self.excludedIds)}
         if self.properties:
             self.params['properties'] = self.properties
         if self.params:
             self.query['params'] = self.params
+        return self.query
 
-        command = json.dumps(self.query)
-        resp = xbmc.executeJSONRPC(command)
-        print resp
-        return json.loads(resp)
+    def setResponse(self, response):
+        self.response = response
+
+    def getResponse(self):
+        if self.response is None:
+            command = json.dumps(self.buildRequest())
+            self.response = json.loads(execute(self.query['method'], command))
+        return self.response
 
     def asList(self):
         response = self.getResponse()
         if 'result' in response and self.resultKey in response['result']:
-            return response['result'][self.resultKey]
+            items = response['result'][self.resultKey]
+            if self.excludedIds:
+                idKey = ID_KEYS.get(self.resultKey)
+                items = [item for item in items if not item.get(idKey) in self.excludedIds][:self.limit]
+            return items
         else:
             return list()
 
@@ -189,26 +384,72 @@ class Query(object):
         return self
 
     def limitTo(self, end):
+        self.limit = end
         self.params['limits'] = {'start': 0, 'end': end}
         return self
 
-    def excludeTitles(self, titles):
-        if type(titles) == list:
-            for title in titles:
-                self.filters.append({
-                    'operator': 'doesnotcontain',
-                    'field': 'title',
-                    'value': title
-                })
-        else:
-            self.filters.append({
-                'operator': 'isnot',
-                'field': 'title',
-                'value': titles
-            })
+    def excludeIds(self, itemIds):
+        """
+        Excludes the items with the library ids, eg. the answers chosen so far.
+
+        XBMC can not filter on ids, so the query asks for as many more items as are excluded and
+        drops the excluded items from the response. Unlike filtering on titles, the cost does not
+        grow with each excluded item and "Aliens" is not dropped when excluding "Alien".
+
+        @param itemIds: the ids of the items, eg. movieids for movies
+        @type itemIds: list
+        """
+        self.excludedIds.update(itemIds)
         return self
 
 
+class QueryBatch(object):
+    """
+    Sends several queries to XBMC as one JSON-RPC batch request.
+    The responses are matched to the queries by id, after execute() the
+    results are available from the queries as usual, eg. with asList().
+    """
+
+    def __init__(self):
+        self.queries = list()
+
+    def add(self, query):
+        """
+        @type query: Query
+        @return: the query
+        """
+        self.queries.append(query)
+        return query
+
+    def execute(self):
+        requests = list()
+        queriesById = dict()
+        for query in self.queries:
+            request = query.buildRequest()
+            if request is None:
+                continue
+            request['id'] = len(requests) + 1
+            queriesById[request['id']] = query
+            requests.append(request)
+
+        if not requests:
+            return
+
+        resp = execute('batch of %d requests' % len(requests), json.dumps(requests))
+        responses = json.loads(resp)
+        if type(responses) != list:
+            # the batch as a whole failed
+            responses = [dict(responses, id=id) for id in queriesById.keys()]
+
+        for response in responses:
+            query = queriesById.get(response.get('id'))
+            if query is not None:
+                query.setResponse(response)
+        for query in queriesById.values():
+            if query.response is None:
+                query.setResponse(dict())
+
+
 class VideoQuery(Query):
     def inSet(self, set):
         self.filters.append({
@@ -331,3 +572,6 @@ class AudioQuery(Query):
             'value': artist
         })
         return self
+
+
+_statusCache = LibraryStatusCache()
@@ -0,0 +1,122 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import sys
+import traceback
+
+import xbmc
+
+from strings import ADDON
+
+DEBUG = 0
+INFO = 1
+WARNING = 2
+ERROR = 3
+
+XBMC_LEVELS = {
+    DEBUG: xbmc.LOGDEBUG,
+    INFO: xbmc.LOGNOTICE,
+    WARNING: xbmc.LOGWARNING,
+    ERROR: xbmc.LOGERROR
+}
+
+SETT_LOGGING_LEVEL = 'logging.level'
+SETT_LOGGING_PAYLOADS = 'logging.payloads'
+
+
+class Logger(object):
+    """
+    Writes messages to the XBMC log if their level is enabled.
+
+    Messages are formatted with the arguments only if they are written,
+    so debug messages cost next to nothing when debug logging is disabled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def isEnabledFor(self, level):
+        return level >= _level
+
+    def isPayloadEnabled(self):
+        """
+        Returns True if complete JSON-RPC requests and responses should be logged.
+        """
+        return _payloads
+
+    def debug(self, msg, *args):
+        self.log(DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(ERROR, msg, *args)
+
+    def exception(self, msg, *args):
+        """
+        Logs an error with the traceback of the exception being handled.
+        """
+        if self.isEnabledFor(ERROR):
+            self.log(ERROR, '%s\n%s' % (_format(msg, args), ''.join(traceback.format_exception(*sys.exc_info()))))
+
+    def log(self, level, msg, *args):
+        if not self.isEnabledFor(level):
+            return
+
+        msg = '[script.moviequiz] %s: %s' % (self.name, _format(msg, args))
+        if isinstance(msg, unicode):
+            msg = msg.encode('utf-8', 'ignore')
+        xbmc.log(msg, XBMC_LEVELS[level])
+
+
+def getLogger(name):
+    """
+    @param name: the name of the module logging, eg. library
+    @type name: str
+    @rtype: Logger
+    """
+    if not name in _loggers:
+        _loggers[name] = Logger(name)
+    return _loggers[name]
+
+
+def reloadSettings():
+    global _level, _payloads
+    if ADDON.getSetting(SETT_LOGGING_LEVEL) == 'Debug':
+        _level = DEBUG
+    else:
+        _level = INFO
+    _payloads = ADDON.getSetting(SETT_LOGGING_PAYLOADS) == 'true'
+
+
+def _format(msg, args):
+    if args:
+        return msg % args
+    return msg
+
+
+_loggers = dict()
+_level = INFO
+_payloads = False
+reloadSettings()
@@ -0,0 +1,75 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import json
+
+import xbmc
+
+import library
+import logger
+
+log = logger.getLogger('monitor')
+
+
+class LibraryMonitor(xbmc.Monitor):
+    """
+    Passes notifications about changes to the XBMC library on to library.onNotification(),
+    so results cached from the library are checked again, and to a snapshot.LibrarySnapshot,
+    which fetches the changed items instead of loading the library again.
+    """
+
+    def __init__(self, librarySnapshot):
+        """
+        @param librarySnapshot: the snapshot to keep in sync, eg. question.LIBRARY
+        @type librarySnapshot: snapshot.LibrarySnapshot
+        """
+        xbmc.Monitor.__init__(self)
+        self.librarySnapshot = librarySnapshot
+        if self.isNotified():
+            self.librarySnapshot.startListening()
+        else:
+            log.info("Library notifications are not available, the library snapshot catches up at each game")
+
+    @staticmethod
+    def isNotified():
+        """
+        Returns True if XBMC calls onNotification(), from Gotham (xbmc.python 2.14).
+        On Frodo only onDatabaseUpdated() is called, without the items changed.
+        """
+        return hasattr(xbmc.Monitor, 'onNotification')
+
+    def onNotification(self, sender, method, data):
+        library.onNotification(method)
+        try:
+            data = json.loads(data)
+        except (TypeError, ValueError):
+            data = None
+        self.librarySnapshot.onNotification(method, data)
+
+    def onScanFinished(self, database):
+        log.debug("Library scan of %s finished", database)
+        library.invalidateLibraryStatus()
+
+    def onCleanFinished(self, database):
+        log.debug("Library clean of %s finished", database)
+        library.invalidateLibraryStatus()
+
+    def onDatabaseUpdated(self, database):
+        library.invalidateLibraryStatus()
@@ -18,9 +18,12 @@
 #  http://www.gnu.org/copyleft/gpl.html
 #
 
+import os
+
 import xbmc
 
 from quizlib import game
+from quizlib.strings import ADDON
 from quizlib.gui import QuizGui
 
 import buggalo
@@ -34,13 +37,21 @@ def runCinemaExperience(type, automatic, maxRating, genre, questionLimit):
     Keyword arguments:
     type -- ignored
     automatic -- pass True if the quiz should run non-interactively, ie. progressing automatically.
+                 The questions are then taken from a deck built ahead of time and kept between runs.
     maxRating -- the maximum allow MPAA rating to use.
     genre -- Unused at the moment.
     questionLimit -- the number of questions to go through before the quiz ends.
     """
     xbmc.log("Starting Movie Quiz in Cinema Experience mode with params: automatic=%s, maxRating=%s, genre=%s, questionLimit=%d"
              % ( automatic, maxRating, genre, questionLimit))
-    w = QuizGui(game.QuestionLimitedGame(game.GAMETYPE_MOVIE, -1, not automatic, questionLimit))
+    deckPath = None
+    if automatic:
+        profilePath = xbmc.translatePath(ADDON.getAddonInfo('profile'))
+        if not os.path.exists(profilePath):
+            os.makedirs(profilePath)
+        deckPath = os.path.join(profilePath, 'cinema-experience.deck')
+
+    w = QuizGui(game.QuestionLimitedGame(game.GAMETYPE_MOVIE, -1, not automatic, questionLimit), deckPath)
     w.doModal()
     del w
     
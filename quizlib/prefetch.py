@@ -0,0 +1,503 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import os
+import random
+import threading
+import time
+import Queue
+
+import question
+import logger
+
+from strings import ADDON
+
+log = logger.getLogger('prefetch')
+
+SETT_PROCESSES = 'prefetch.processes'
+SETT_QUEUE_SIZE = 'prefetch.queue.size'
+SETT_PROCESS_BATCH = 'prefetch.process.batch'
+
+
+class CandidateStatistics(object):
+    """
+    Success rate and build cost of one question type, and the state of its circuit breaker.
+    """
+
+    def __init__(self, candidate):
+        self.candidate = candidate
+        self.attempts = 0
+        self.successes = 0
+        self.consecutiveFailures = 0
+        self.averageCost = None
+        self.disabledUntil = 0.0
+        self.backoff = 0.0
+
+    def getSuccessRate(self):
+        # smoothed, so a type is neither written off nor trusted after a single build
+        return (self.successes + 1.0) / (self.attempts + 2.0)
+
+    def isAvailable(self, now):
+        return now >= self.disabledUntil
+
+
+class QuestionScheduler(object):
+    """
+    Decides the order in which the question types of a game are tried.
+
+    Types are picked at random, weighted toward types that build successfully and cheaply.
+    A type failing FAILURE_THRESHOLD times in a row is disabled for a while, doubling the
+    period each time it fails again after being enabled, so a library without eg. taglines
+    or theme songs does not pay for the failing type on every question.
+    """
+    FAILURE_THRESHOLD = 3
+    INITIAL_BACKOFF_SECONDS = 5.0
+    MAX_BACKOFF_SECONDS = 300.0
+    COST_SMOOTHING = 0.3
+    REFERENCE_COST_SECONDS = 0.05
+    MIN_WEIGHT = 0.05
+
+    def __init__(self, questionCandidates):
+        """
+        @param questionCandidates: the enabled Question subclasses
+        @type questionCandidates: list
+        """
+        self.statistics = [CandidateStatistics(candidate) for candidate in questionCandidates]
+        self.lock = threading.Lock()
+
+    def getCandidates(self):
+        """
+        Returns the question types to try for the next question, most promising types first.
+        Disabled types are left out, unless all types are disabled.
+
+        @rtype: list
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            statistics = [s for s in self.statistics if s.isAvailable(now)]
+            if not statistics:
+                # rather than giving up, try the types that will be enabled first
+                statistics = sorted(self.statistics, key=lambda s: s.disabledUntil)[:1]
+
+            # weighted random order, see Efraimidis & Spirakis: sort by u ^ (1 / weight)
+            keys = [(random.random() ** (1.0 / self._getWeight(s)), s.candidate) for s in statistics]
+        finally:
+            self.lock.release()
+
+        keys.sort(reverse=True)
+        return [candidate for key, candidate in keys]
+
+    def recordSuccess(self, candidate, cost):
+        self.lock.acquire()
+        try:
+            s = self._getStatistics(candidate)
+            s.attempts += 1
+            s.successes += 1
+            s.consecutiveFailures = 0
+            s.backoff = 0.0
+            self._recordCost(s, cost)
+        finally:
+            self.lock.release()
+
+    def recordFailure(self, candidate, cost):
+        self.lock.acquire()
+        try:
+            s = self._getStatistics(candidate)
+            s.attempts += 1
+            s.consecutiveFailures += 1
+            self._recordCost(s, cost)
+
+            if s.consecutiveFailures >= self.FAILURE_THRESHOLD:
+                s.backoff = min(max(s.backoff * 2, self.INITIAL_BACKOFF_SECONDS), self.MAX_BACKOFF_SECONDS)
+                s.disabledUntil = time.time() + s.backoff
+                # allow a single trial when enabled again
+                s.consecutiveFailures = self.FAILURE_THRESHOLD - 1
+                log.info("Disabled %s for %d seconds after %d of %d builds failed",
+                         candidate.__name__, s.backoff, s.attempts - s.successes, s.attempts)
+        finally:
+            self.lock.release()
+
+    def getStatistics(self):
+        """
+        @return: list of (name, attempts, successes, average cost in seconds, disabled) tuples
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            return [(s.candidate.__name__, s.attempts, s.successes, s.averageCost, not s.isAvailable(now))
+                    for s in self.statistics]
+        finally:
+            self.lock.release()
+
+    def _getWeight(self, s):
+        weight = s.getSuccessRate()
+        if s.averageCost is not None:
+            weight /= 1.0 + s.averageCost / self.REFERENCE_COST_SECONDS
+        # keep some variety, even between types with very different costs
+        return max(weight, self.MIN_WEIGHT)
+
+    def _getStatistics(self, candidate):
+        for s in self.statistics:
+            if s.candidate == candidate:
+                return s
+        s = CandidateStatistics(candidate)
+        self.statistics.append(s)
+        return s
+
+    def _recordCost(self, s, cost):
+        if s.averageCost is None:
+            s.averageCost = cost
+        else:
+            s.averageCost += self.COST_SMOOTHING * (cost - s.averageCost)
+
+
+class QuestionPrefetcher(threading.Thread):
+    """
+    Builds questions in a background thread and keeps a bounded queue of ready questions,
+    so the next question is available as soon as the current one has been answered.
+    """
+    DEFAULT_SIZE = 3
+    MAX_RETRIES = 100
+    MAX_BUILD_SECONDS = 0.5
+    IMDB_WAIT_SECONDS = 0.5
+    # the build deadline is extended while waiting for IMDb data, but never beyond this
+    MAX_IMDB_WAIT_SECONDS = 10.0
+
+    def __init__(self, questionCandidates, defaultLibraryFilters, previousQuestions, size=DEFAULT_SIZE):
+        """
+        @param questionCandidates: the enabled Question subclasses
+        @type questionCandidates: list
+        @param defaultLibraryFilters: the filters passed to each question
+        @type defaultLibraryFilters: list
+        @param previousQuestions: unique identifiers of the questions used so far in the game
+        @type previousQuestions: list
+        @param size: the maximum number of ready questions
+        @type size: int
+        """
+        super(QuestionPrefetcher, self).__init__(name='QuestionPrefetcher')
+        self.daemon = True
+
+        self.questionCandidates = list(questionCandidates)
+        self.scheduler = QuestionScheduler(self.questionCandidates)
+        self.defaultLibraryFilters = defaultLibraryFilters
+        self.previousQuestions = previousQuestions
+        self.queue = Queue.Queue(size)
+        self.stopped = False
+
+        self.questionsBuilt = 0
+        self.totalFillTime = 0.0
+        self.lastFillTime = 0.0
+
+    def stop(self, wait=False):
+        """
+        Stops building questions.
+
+        @param wait: True to wait for the question being built, eg. before the library snapshot is changed
+        @type wait: bool
+        """
+        if not self.stopped:
+            self.stopped = True
+            for name, attempts, successes, averageCost, disabled in self.scheduler.getStatistics():
+                if attempts:
+                    log.debug("%s: %d of %d built, average %.3f seconds%s", name, successes, attempts, averageCost,
+                              disabled and ', disabled' or '')
+        if wait and self.isAlive() and threading.currentThread() is not self:
+            self.join()
+
+    def run(self):
+        while not self.stopped:
+            startTime = time.time()
+            q = self.buildQuestion()
+            self.lastFillTime = time.time() - startTime
+            self.totalFillTime += self.lastFillTime
+            self.questionsBuilt += 1
+
+            while not self.stopped:
+                try:
+                    self.queue.put(q, timeout=0.5)
+                    break
+                except Queue.Full:
+                    pass
+
+            if q is None:
+                # no more questions can be found, the consumer ends the game
+                break
+
+    def get(self, timeout=None):
+        """
+        Returns the next ready question, or None if no more questions could be found.
+
+        @raise Queue.Empty: if no question is ready within timeout seconds
+        """
+        q = self.queue.get(timeout=timeout)
+        log.info("Question queue depth: %d, fill latency: %.3f seconds (average %.3f seconds)",
+                 self.getDepth(), self.lastFillTime, self.getAverageFillTime())
+        return q
+
+    def getDepth(self):
+        return self.queue.qsize()
+
+    def getAverageFillTime(self):
+        if not self.questionsBuilt:
+            return 0.0
+        return self.totalFillTime / self.questionsBuilt
+
+    def buildQuestion(self):
+        """
+        Builds a question not used before in the game, also used to build questions ahead of time.
+
+        @return: the question, or None if no question could be built
+        """
+        retries = 0
+        deadline = time.time() + self.MAX_BUILD_SECONDS
+        finalDeadline = time.time() + self.MAX_IMDB_WAIT_SECONDS
+        while retries < self.MAX_RETRIES and time.time() < deadline and not self.stopped:
+            retries += 1
+            notLoaded = 0
+            q = None
+
+            candidates = self.scheduler.getCandidates()
+            for candidate in candidates:
+                startTime = time.time()
+                candidateQuestion = None
+                try:
+                    candidateQuestion = candidate(self.defaultLibraryFilters)
+                except question.ImdbDataNotLoadedException:
+                    notLoaded += 1
+                    continue
+                except question.QuestionException, ex:
+                    log.debug("QuestionException in %s: %s", candidate.__name__, ex)
+                except Exception, ex:
+                    log.exception("%s in %s", ex.__class__.__name__, candidate.__name__)
+
+                if candidateQuestion is not None and len(candidateQuestion.getAnswers()) >= 3:
+                    self.scheduler.recordSuccess(candidate, time.time() - startTime)
+                    q = candidateQuestion
+                    break
+                self.scheduler.recordFailure(candidate, time.time() - startTime)
+
+            if q is None and notLoaded == len(candidates):
+                # only questions using IMDb data are enabled, wait for it instead of giving up
+                waitStartTime = time.time()
+                question.IMDB.loadDataInBackground().wait(self.IMDB_WAIT_SECONDS)
+                deadline = min(deadline + time.time() - waitStartTime, finalDeadline)
+                retries -= 1
+                continue
+
+            if q is not None and not q.getUniqueIdentifier() in self.previousQuestions:
+                self.previousQuestions.append(q.getUniqueIdentifier())
+                return q
+
+        return None
+
+
+class ProcessPoolPrefetcher(threading.Thread):
+    """
+    Builds questions in a pool of worker processes, so question generation does not hold the GIL
+    of the process running the GUI and can use more than one core.
+
+    The workers are forked after the library snapshot has been loaded, so they build questions from
+    their copy of it and return them as Question.toDict(). Offers the same methods as QuestionPrefetcher.
+
+    Experimental: the forked workers still call the xbmc, xbmcvfs and xbmcaddon modules of the parent,
+    eg. xbmcvfs.exists() and ADDON.getSetting(). This has only been verified with the stand-ins of
+    tools/benchmark.py, not inside XBMC, which is why prefetch.processes defaults to 0.
+    """
+    RESULT_TIMEOUT_SECONDS = 0.5
+    MAX_DUPLICATE_RESULTS = 5
+
+    def __init__(self, questionCandidates, defaultLibraryFilters, previousQuestions,
+                 size=QuestionPrefetcher.DEFAULT_SIZE, processes=2, batchSize=1):
+        """
+        @param processes: the number of worker processes
+        @type processes: int
+        @param batchSize: the number of questions each worker builds per request
+        @type batchSize: int
+        @raise OSError: if the worker processes can not be started, eg. where fork is not available
+        """
+        super(ProcessPoolPrefetcher, self).__init__(name='ProcessPoolPrefetcher')
+        self.daemon = True
+
+        import multiprocessing
+
+        self.previousQuestions = previousQuestions
+        self.queue = Queue.Queue(size)
+        self.results = Queue.Queue()
+        self.processes = processes
+        self.batchSize = batchSize
+        self.stopped = False
+
+        self.pool = multiprocessing.Pool(processes, _initializeWorker, (questionCandidates, defaultLibraryFilters))
+        self.startTime = time.time()
+        self.questionsBuilt = 0
+        self.duplicates = 0
+        self.duplicateResults = 0
+        self.workers = dict()
+
+    def stop(self, wait=False):
+        """
+        Stops the worker processes.
+
+        @param wait: True to wait for the thread collecting the results of the workers
+        @type wait: bool
+        """
+        if wait and self.isAlive() and threading.currentThread() is not self:
+            self.stopped = True
+            self.join()
+        if self.pool is None:
+            return
+        self.stopped = True
+        self.pool.terminate()
+        self.pool = None
+
+        elapsed = time.time() - self.startTime
+        log.info("Built %d questions in %d processes (queue size %d, %d per request), %d duplicates dropped",
+                 self.questionsBuilt, self.processes, self.queue.maxsize, self.batchSize, self.duplicates)
+        for pid, (questions, buildTime) in sorted(self.workers.items()):
+            log.info("Worker %d: %d questions, %.3f seconds per question, %.1f questions per second", pid, questions,
+                     buildTime / max(questions, 1), questions / max(elapsed, 0.001))
+
+    def run(self):
+        pending = 0
+        try:
+            while not self.stopped:
+                # keep the workers busy while the queue has room for the questions requested
+                while pending < self.processes and self.queue.qsize() + pending * self.batchSize < self.queue.maxsize:
+                    self.pool.apply_async(_buildQuestionsInWorker, (list(self.previousQuestions), self.batchSize),
+                                          callback=self.results.put)
+                    pending += 1
+
+                try:
+                    pid, buildTime, questions = self.results.get(timeout=self.RESULT_TIMEOUT_SECONDS)
+                except Queue.Empty:
+                    continue
+                pending -= 1
+
+                if questions:
+                    self._addWorkerStatistics(pid, buildTime, len(questions))
+                if not questions or not self._putQuestions([question.Question.fromDict(data) for data in questions]):
+                    # no more questions can be found, the consumer ends the game
+                    self._put(None)
+                    return
+        except Exception, ex:
+            if not self.stopped:
+                log.exception("%s in question prefetcher", ex.__class__.__name__)
+                self._put(None)
+
+    def get(self, timeout=None):
+        """
+        Returns the next ready question, or None if no more questions could be found.
+
+        @raise Queue.Empty: if no question is ready within timeout seconds
+        """
+        q = self.queue.get(timeout=timeout)
+        log.info("Question queue depth: %d", self.getDepth())
+        return q
+
+    def getDepth(self):
+        return self.queue.qsize()
+
+    def _putQuestions(self, questions):
+        """
+        Queues the questions not used before in the game.
+
+        @return: False if the workers have built only duplicates MAX_DUPLICATE_RESULTS times in a row
+        """
+        unique = [q for q in questions if not q.getUniqueIdentifier() in self.previousQuestions]
+        self.duplicates += len(questions) - len(unique)
+        if unique:
+            self.duplicateResults = 0
+        else:
+            # workers build the same question at times, but only duplicates means the library has run out
+            self.duplicateResults += 1
+            if self.duplicateResults >= self.MAX_DUPLICATE_RESULTS:
+                return False
+
+        for q in unique:
+            if not q.getUniqueIdentifier() in self.previousQuestions:
+                self.previousQuestions.append(q.getUniqueIdentifier())
+                self._put(q)
+        return True
+
+    def _put(self, q):
+        while not self.stopped:
+            try:
+                self.queue.put(q, timeout=0.5)
+                break
+            except Queue.Full:
+                pass
+
+    def _addWorkerStatistics(self, pid, buildTime, questions):
+        self.questionsBuilt += questions
+        previousQuestions, previousBuildTime = self.workers.get(pid, (0, 0.0))
+        self.workers[pid] = (previousQuestions + questions, previousBuildTime + buildTime)
+
+
+def createPrefetcher(questionCandidates, defaultLibraryFilters, previousQuestions):
+    """
+    Creates the prefetcher configured in the settings, building questions in worker processes
+    if any are configured and they can be started, otherwise in a thread.
+    """
+    size = int(ADDON.getSetting(SETT_QUEUE_SIZE) or QuestionPrefetcher.DEFAULT_SIZE)
+    processes = int(ADDON.getSetting(SETT_PROCESSES) or 0)
+    if processes > 0 and question.IMDB.isLoadingData():
+        # a forked worker would wait for the data forever, as the loader thread is not forked along
+        log.info("IMDb data is loading, building questions in a thread instead of %d workers", processes)
+    elif processes > 0:
+        log.warning("Building questions in %d worker processes, an experimental setting", processes)
+        try:
+            return ProcessPoolPrefetcher(questionCandidates, defaultLibraryFilters, previousQuestions, size, processes,
+                                         int(ADDON.getSetting(SETT_PROCESS_BATCH) or 1))
+        except (ImportError, OSError, NotImplementedError), ex:
+            log.warning("Unable to start %d question workers, building questions in a thread: %s", processes, ex)
+
+    return QuestionPrefetcher(questionCandidates, defaultLibraryFilters, previousQuestions, size)
+
+
+def _initializeWorker(questionCandidates, defaultLibraryFilters):
+    global _worker
+    # forked workers start with the random state of the parent process
+    random.seed()
+    _worker = QuestionPrefetcher(questionCandidates, defaultLibraryFilters, list())
+
+
+def _buildQuestionsInWorker(previousQuestions, count):
+    """
+    Builds up to count questions in a worker process.
+
+    @return: tuple of the process id, the build time and the built questions as dicts
+    """
+    startTime = time.time()
+    _worker.previousQuestions = previousQuestions
+    questions = list()
+    try:
+        for idx in range(count):
+            q = _worker.buildQuestion()
+            if q is None:
+                break
+            questions.append(q.toDict())
+    except Exception, ex:
+        # the result must be returned, the prefetcher waits for it
+        log.exception("%s in question worker %d", ex.__class__.__name__, os.getpid())
+    return os.getpid(), time.time() - startTime, questions
+
+
+_worker = None
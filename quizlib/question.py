@@ -24,16 +24,22 @@ import datetime
 import re
 import imdb
 import game
-import library
+import snapshot
+import distractor
 
 import xbmcvfs
 
 from strings import *
 
 IMDB = imdb.Imdb()
+LIBRARY = snapshot.LibrarySnapshot()
+
+SETT_DISTRACTOR_DIFFICULTY = 'question.difficulty'
 
 
 class Answer(object):
+    __slots__ = ('id', 'text', 'coverFile', 'sortWeight', 'correct')
+
     def __init__(self, id, text, image=None, sortWeight=None, correct=False):
         self.correct = correct
         self.id = id
@@ -44,11 +50,33 @@ class Answer(object):
     def setCoverFile(self, coverFile):
         self.coverFile = coverFile
 
+    def toDict(self):
+        return {'id': self.id, 'text': self.text, 'coverFile': self.coverFile, 'sortWeight': self.sortWeight,
+                'correct': self.correct}
+
+    @staticmethod
+    def fromDict(data):
+        return Answer(data['id'], data['text'], data['coverFile'], data['sortWeight'], data['correct'])
+
     def __repr__(self):
         return "<Answer(id=%s, text=%s, correct=%s)>" % (self.id, self.text, self.correct)
 
 
+class QuestionType(type):
+    """
+    Gives Question subclasses empty __slots__ unless they declare their own,
+    so question instances never get a __dict__.
+    """
+
+    def __new__(mcs, name, bases, attributes):
+        attributes.setdefault('__slots__', ())
+        return super(QuestionType, mcs).__new__(mcs, name, bases, attributes)
+
+
 class Question(object):
+    __metaclass__ = QuestionType
+    __slots__ = ('answers', 'text', 'fanartFile', 'displayType')
+
     def __init__(self, displayType=None):
         """
         Base class for Questions
@@ -98,6 +126,39 @@ class Question(object):
     def getDisplayType(self):
         return self.displayType
 
+    def toDict(self):
+        """
+        Returns the built question as a dict of plain values, eg. to save it or send it to another process.
+        """
+        displayType = None
+        if self.displayType is not None:
+            displayType = self.displayType.toDict()
+
+        return {
+            'type': self.__class__.__name__,
+            'text': self.text,
+            'fanartFile': self.fanartFile,
+            'displayType': displayType,
+            'answers': [answer.toDict() for answer in self.answers]
+        }
+
+    @staticmethod
+    def fromDict(data):
+        """
+        Recreates a question returned by toDict() without querying the library.
+
+        @raise KeyError: if the question type does not exist
+        """
+        candidate = _getQuestionTypes()[data['type']]
+
+        # the constructors of the questions build them, so only the base class is initialized
+        q = candidate.__new__(candidate)
+        Question.__init__(q, DisplayType.fromDict(data['displayType']))
+        q.text = data['text']
+        q.fanartFile = data['fanartFile']
+        q.answers = [Answer.fromDict(answer) for answer in data['answers']]
+        return q
+
     @staticmethod
     def isEnabled():
         raise
@@ -123,10 +184,41 @@ class Question(object):
 
 
 class DisplayType(object):
-    pass
+    __slots__ = ()
+    TYPE = None
+
+    def toDict(self):
+        data = {'type': self.TYPE}
+        for name in self.__slots__:
+            data[name] = getattr(self, name)
+        return data
+
+    @staticmethod
+    def fromDict(data):
+        """
+        Recreates a display type returned by toDict(), without checking the files exist.
+
+        @return: the display type or None if data is None
+        """
+        if data is None:
+            return None
+
+        for displayType in DisplayType.__subclasses__():
+            if displayType.TYPE == data['type']:
+                d = displayType()
+                for name in displayType.__slots__:
+                    setattr(d, name, data[name])
+                return d
+        raise KeyError(data['type'])
 
 
 class VideoDisplayType(DisplayType):
+    __slots__ = ('videoFile',)
+    TYPE = 'video'
+
+    def __init__(self):
+        self.videoFile = None
+
     def setVideoFile(self, videoFile):
         self.videoFile = videoFile
         if not xbmcvfs.exists(self.videoFile):
@@ -137,6 +229,12 @@ class VideoDisplayType(DisplayType):
 
 
 class PhotoDisplayType(DisplayType):
+    __slots__ = ('photoFile',)
+    TYPE = 'photo'
+
+    def __init__(self):
+        self.photoFile = None
+
     def setPhotoFile(self, photoFile):
         self.photoFile = photoFile
 
@@ -145,17 +243,29 @@ class PhotoDisplayType(DisplayType):
 
 
 class ThreePhotoDisplayType(DisplayType):
-    def addPhoto(self, photo, label):
-        if not hasattr(self, 'photos'):
-            self.photos = list()
+    __slots__ = ('photos',)
+    TYPE = 'threephoto'
 
+    def __init__(self):
+        self.photos = list()
+
+    def addPhoto(self, photo, label):
         self.photos.append((photo, label))
 
     def getPhotoFile(self, index):
         return self.photos[index]
 
+    def toDict(self):
+        return {'type': self.TYPE, 'photos': [list(photo) for photo in self.photos]}
+
 
 class QuoteDisplayType(DisplayType):
+    __slots__ = ('quoteText',)
+    TYPE = 'quote'
+
+    def __init__(self):
+        self.quoteText = None
+
     def setQuoteText(self, quoteText):
         self.quoteText = quoteText
 
@@ -164,6 +274,12 @@ class QuoteDisplayType(DisplayType):
 
 
 class AudioDisplayType(DisplayType):
+    __slots__ = ('audioFile',)
+    TYPE = 'audio'
+
+    def __init__(self):
+        self.audioFile = None
+
     def setAudioFile(self, audioFile):
         self.audioFile = audioFile
 
@@ -187,7 +303,7 @@ class WhatMovieIsThisQuestion(MovieQuestion):
         videoDisplayType = VideoDisplayType()
         super(WhatMovieIsThisQuestion, self).__init__(videoDisplayType)
 
-        correctAnswer = library.getMovies(['title', 'set', 'genre', 'file', 'art']).withFilters(
+        correctAnswer = LIBRARY.getMovies(['title', 'set', 'genre', 'file', 'art']).withFilters(
             defaultFilters).limitTo(1).asItem()
         if not correctAnswer:
             raise QuestionException('No movies found')
@@ -195,25 +311,12 @@ class WhatMovieIsThisQuestion(MovieQuestion):
         self.addCorrectAnswer(id=correctAnswer['movieid'], text=correctAnswer['title'],
                               image=correctAnswer['art']['poster'])
 
-        # Find other movies in set
-        if correctAnswer['set'] is not None:
-            otherMoviesInSet = library.getMovies(['title', 'art']).withFilters(defaultFilters).inSet(
-                correctAnswer['set']).excludeTitles(self.getAnswerTexts()).limitTo(3).asList()
-            for movie in otherMoviesInSet:
-                self.addAnswer(id=movie['movieid'], text=movie['title'], image=movie['art']['poster'])
-
-        # Find other movies in genre
-        if len(self.answers) < 4:
-            otherMoviesInGenre = library.getMovies(['title', 'art']).withFilters(defaultFilters).inGenre(
-                correctAnswer['genre']).excludeTitles(self.getAnswerTexts()).limitTo(4 - len(self.answers)).asList()
-            for movie in otherMoviesInGenre:
-                self.addAnswer(id=movie['movieid'], text=movie['title'], image=movie['art']['poster'])
-
-        # Fill with random movies
-        if len(self.answers) < 4:
-            theRest = library.getMovies(['title', 'art']).withFilters(defaultFilters).excludeTitles(
-                self.getAnswerTexts()).limitTo(4 - len(self.answers)).asList()
-            for movie in theRest:
+        # similar movies, eg. from the same set or genre
+        otherMovieIds = LIBRARY.getMovieDistractors().getDistractors(
+            correctAnswer['movieid'], 6, LIBRARY.getMovieIds(defaultFilters), difficulty=getDistractorDifficulty())
+        for movie in LIBRARY.getMovies(['title', 'art']).withIds(otherMovieIds).asList():
+            # remakes have the same title
+            if len(self.answers) < 4 and not movie['title'] in self.getAnswerTexts():
                 self.addAnswer(id=movie['movieid'], text=movie['title'], image=movie['art']['poster'])
 
         random.shuffle(self.answers)
@@ -233,10 +336,13 @@ class WhatActorIsThisQuestion(MovieQuestion):
         photoDisplayType = PhotoDisplayType()
         super(WhatActorIsThisQuestion, self).__init__(photoDisplayType)
 
+        if IMDB.isDataPresent() and not IMDB.isDataLoaded():
+            raise ImdbDataNotLoadedException('IMDb data is not loaded yet')
+
         # Find a bunch of actors with thumbnails
         actors = list()
         names = list()
-        for movie in library.getMovies(['cast']).withFilters(defaultFilters).limitTo(10).asList():
+        for movie in LIBRARY.getMovies(['cast']).withFilters(defaultFilters).limitTo(10).asList():
             for actor in movie['cast']:
                 if 'thumbnail' in actor and actor['name'] not in names:
                     actors.append(actor)
@@ -252,10 +358,10 @@ class WhatActorIsThisQuestion(MovieQuestion):
         self.addCorrectAnswer(id=actor['name'], text=actor['name'])
 
         # Check gender
-        actorGender = IMDB.isActor(actor['name'])
+        actorGender = IMDB.getGender(actor['name'])
 
         for otherActor in actors:
-            if IMDB.isActor(otherActor['name']) == actorGender:
+            if IMDB.getGender(otherActor['name']) == actorGender:
                 self.addAnswer(otherActor['name'].encode('utf-8', 'ignore'), otherActor['name'])
                 if len(self.answers) == 4:
                     break
@@ -277,42 +383,30 @@ class ActorNotInMovieQuestion(MovieQuestion):
         photoDisplayType = PhotoDisplayType()
         super(ActorNotInMovieQuestion, self).__init__(photoDisplayType)
 
-        actors = list()
-        for movie in library.getMovies(['cast']).withFilters(defaultFilters).limitTo(10).asList():
-            for actor in movie['cast']:
-                if 'thubmnail' in actor:
-                    actors.append(actor)
-
-        if not actors:
-            raise QuestionException("Didn't find any actors with thumbnail")
-
-        random.shuffle(actors)
-
-        actor = None
-        for actor in actors:
-            # Movie actor is in
-            movies = library.getMovies(['title', 'art']).withFilters(defaultFilters).withActor(actor['name']).limitTo(3).asList()
-            if len(movies) < 3:
-                continue
-
-            for movie in movies:
-                self.addAnswer(-1, movie['title'], image=movie['art']['poster'])
+        movieIndex = LIBRARY.getMovieIndex()
+        movieIds = LIBRARY.getMovieIds(defaultFilters)
 
-            # Movies actor is not in
-            correctAnswer = library.getMovies(['title', 'art']).withFilters(defaultFilters).withoutActor(
-                actor['name']).limitTo(1).asItem()
-            if not correctAnswer:
-                raise QuestionException('No movies found')
-            self.addCorrectAnswer(actor['name'], correctAnswer['title'], image=correctAnswer['art']['poster'])
+        # Find an actor with thumbnail and at least three movies
+        actor = movieIndex.randomKey('actor', minimum=3, within=movieIds, accept=LIBRARY.getActorThumbnail)
+        if actor is None:
+            raise QuestionException("Didn't find any actors with at least three movies")
 
-            break
+        # Movies actor is in
+        movies = LIBRARY.getMovies(['title', 'art']).withIds(movieIndex.having('actor', actor, movieIds)).limitTo(
+            3).asList()
+        for movie in movies:
+            self.addAnswer(-1, movie['title'], image=movie['art']['poster'])
 
-        if not self.answers:
-            raise QuestionException("Didn't find any actors with at least three movies")
+        # Movie actor is not in
+        otherMovieIds = movieIndex.without('actor', actor, movieIds)
+        if not otherMovieIds:
+            raise QuestionException('No movies found')
+        correctAnswer = LIBRARY.getMovies(['title', 'art']).withIds(otherMovieIds).limitTo(1).asItem()
+        self.addCorrectAnswer(actor, correctAnswer['title'], image=correctAnswer['art']['poster'])
 
         random.shuffle(self.answers)
-        self.text = strings(Q_WHAT_MOVIE_IS_ACTOR_NOT_IN, actor['name'])
-        photoDisplayType.setPhotoFile(actor['thumbnail'])
+        self.text = strings(Q_WHAT_MOVIE_IS_ACTOR_NOT_IN, actor)
+        photoDisplayType.setPhotoFile(LIBRARY.getActorThumbnail(actor))
 
     @staticmethod
     def isEnabled():
@@ -326,7 +420,7 @@ class WhatYearWasMovieReleasedQuestion(MovieQuestion):
         """
         super(WhatYearWasMovieReleasedQuestion, self).__init__()
 
-        movie = library.getMovies(['title', 'year', 'art']).withFilters(defaultFilters).fromYear(1900).limitTo(
+        movie = LIBRARY.getMovies(['title', 'year', 'art']).withFilters(defaultFilters).fromYear(1900).limitTo(
             1).asItem()
         if not movie:
             raise QuestionException('No movies found')
@@ -340,12 +434,8 @@ class WhatYearWasMovieReleasedQuestion(MovieQuestion):
             maxYear = thisYear
             minYear = thisYear - 10
 
-        years = list()
-        years.append(int(movie['year']))
-        while len(years) < 4:
-            year = random.randint(minYear, maxYear)
-            if not year in years:
-                years.append(year)
+        years = [int(movie['year'])]
+        years.extend(random.sample([year for year in range(minYear, maxYear + 1) if year != years[0]], 3))
 
         list.sort(years)
 
@@ -368,7 +458,7 @@ class WhatTagLineBelongsToMovieQuestion(MovieQuestion):
         super(WhatTagLineBelongsToMovieQuestion, self).__init__()
 
         movie = None
-        items = library.getMovies(['title', 'tagline', 'art']).withFilters(defaultFilters).limitTo(10).asList()
+        items = LIBRARY.getMovies(['title', 'tagline', 'art']).withFilters(defaultFilters).limitTo(10).asList()
         for item in items:
             if not item['tagline']:
                 continue
@@ -380,15 +470,12 @@ class WhatTagLineBelongsToMovieQuestion(MovieQuestion):
             raise QuestionException('No movies found')
         self.addCorrectAnswer(id=movie['movieid'], text=movie['tagline'])
 
-        otherMovies = library.getMovies(['tagline']).withFilters(defaultFilters).excludeTitles(movie['title']).limitTo(
-            10).asList()
-        for otherMovie in otherMovies:
-            if not otherMovie['tagline']:
-                continue
-
-            self.addAnswer(id=otherMovie['movieid'], text=otherMovie['tagline'])
-            if len(self.answers) == 4:
-                break
+        otherMovieIds = LIBRARY.getMovieDistractors().getDistractors(
+            movie['movieid'], 6, LIBRARY.getMovieIds(defaultFilters),
+            accept=lambda movieId: LIBRARY.movies.getValue(movieId, 'tagline'), difficulty=getDistractorDifficulty())
+        for otherMovie in LIBRARY.getMovies(['tagline']).withIds(otherMovieIds).asList():
+            if len(self.answers) < 4 and not otherMovie['tagline'] in self.getAnswerTexts():
+                self.addAnswer(id=otherMovie['movieid'], text=otherMovie['tagline'])
 
         random.shuffle(self.answers)
         self.text = strings(Q_WHAT_TAGLINE_BELONGS_TO_MOVIE, movie['title'])
@@ -407,7 +494,7 @@ class WhatStudioReleasedMovieQuestion(MovieQuestion):
         super(WhatStudioReleasedMovieQuestion, self).__init__()
 
         movie = None
-        items = library.getMovies(['title', 'studio', 'art']).withFilters(defaultFilters).limitTo(10).asList()
+        items = LIBRARY.getMovies(['title', 'studio', 'art']).withFilters(defaultFilters).limitTo(10).asList()
         for item in items:
             if not item['studio']:
                 continue
@@ -421,11 +508,10 @@ class WhatStudioReleasedMovieQuestion(MovieQuestion):
         studio = random.choice(movie['studio'])
         self.addCorrectAnswer(id=movie['movieid'], text=studio)
 
-        otherMovies = library.getMovies(['studio']).withFilters(defaultFilters).excludeTitles(movie['title']).limitTo(
-            10).asList()
-        for otherMovie in otherMovies:
-            if not otherMovie['studio']:
-                continue
+        otherMovieIds = LIBRARY.getMovieDistractors().getDistractors(
+            movie['movieid'], 10, LIBRARY.getMovieIds(defaultFilters),
+            accept=lambda movieId: LIBRARY.movies.getValue(movieId, 'studio'), difficulty=getDistractorDifficulty())
+        for otherMovie in LIBRARY.getMovies(['studio']).withIds(otherMovieIds).asList():
 
             studioFound = False
             for otherStudio in otherMovie['studio']:
@@ -457,7 +543,7 @@ class WhoPlayedRoleInMovieQuestion(MovieQuestion):
         super(WhoPlayedRoleInMovieQuestion, self).__init__()
 
         movie = None
-        items = library.getMovies(['title', 'cast', 'genre', 'art']).withFilters(defaultFilters).limitTo(10).asList()
+        items = LIBRARY.getMovies(['title', 'cast', 'genre', 'art']).withFilters(defaultFilters).limitTo(10).asList()
         for item in items:
             if len(item['cast']) < 4:
                 continue
@@ -507,9 +593,12 @@ class WhatMovieIsThisQuoteFrom(MovieQuestion):
         quoteDisplayType = QuoteDisplayType()
         super(WhatMovieIsThisQuoteFrom, self).__init__(quoteDisplayType)
 
+        if not IMDB.isDataLoaded():
+            raise ImdbDataNotLoadedException('IMDb data is not loaded yet')
+
         quoteText = None
         row = None
-        for item in library.getMovies(['title', 'art']).withFilters(defaultFilters).limitTo(10).asList():
+        for item in LIBRARY.getMovies(['title', 'art']).withFilters(defaultFilters).limitTo(10).asList():
             quoteText = IMDB.getRandomQuote(item['title'], maxLength=128)
 
             if quoteText is not None:
@@ -521,10 +610,11 @@ class WhatMovieIsThisQuoteFrom(MovieQuestion):
 
         self.addCorrectAnswer(row['movieid'], row['title'], image=row['art']['poster'])
 
-        theRest = library.getMovies(['title', 'art']).withFilters(defaultFilters).excludeTitles(
-            self.getAnswerTexts()).limitTo(3).asList()
-        for movie in theRest:
-            self.addAnswer(movie['movieid'], movie['title'], image=movie['art']['poster'])
+        otherMovieIds = LIBRARY.getMovieDistractors().getDistractors(
+            row['movieid'], 6, LIBRARY.getMovieIds(defaultFilters), difficulty=getDistractorDifficulty())
+        for movie in LIBRARY.getMovies(['title', 'art']).withIds(otherMovieIds).asList():
+            if len(self.answers) < 4 and not movie['title'] in self.getAnswerTexts():
+                self.addAnswer(movie['movieid'], movie['title'], image=movie['art']['poster'])
 
         random.shuffle(self.answers)
         quoteDisplayType.setQuoteText(quoteText)
@@ -542,14 +632,14 @@ class WhatMovieIsNewestQuestion(MovieQuestion):
         """
         super(WhatMovieIsNewestQuestion, self).__init__()
 
-        movie = library.getMovies(['title', 'year', 'art']).withFilters(defaultFilters).fromYear(1900).limitTo(
+        movie = LIBRARY.getMovies(['title', 'year', 'art']).withFilters(defaultFilters).fromYear(1900).limitTo(
             1).asItem()
         if not movie:
             raise QuestionException('No movies found')
 
         self.addCorrectAnswer(id=movie['movieid'], text=movie['title'], image=movie['art']['poster'])
 
-        otherMovies = library.getMovies(['title', 'art']).withFilters(defaultFilters).fromYear(1900).toYear(
+        otherMovies = LIBRARY.getMovies(['title', 'art']).withFilters(defaultFilters).fromYear(1900).toYear(
             movie['year']).limitTo(3).asList()
         if len(otherMovies) < 3:
             raise QuestionException("Less than 3 movies found; bailing out")
@@ -573,7 +663,7 @@ class WhoDirectedThisMovieQuestion(MovieQuestion):
         super(WhoDirectedThisMovieQuestion, self).__init__()
 
         movie = None
-        items = library.getMovies(['title', 'director', 'art']).withFilters(defaultFilters).limitTo(10).asList()
+        items = LIBRARY.getMovies(['title', 'director', 'art']).withFilters(defaultFilters).limitTo(10).asList()
         for item in items:
             if not item['director']:
                 continue
@@ -587,11 +677,10 @@ class WhoDirectedThisMovieQuestion(MovieQuestion):
         director = random.choice(movie['director'])
         self.addCorrectAnswer(id=movie['movieid'], text=director)
 
-        otherMovies = library.getMovies(['director']).withFilters(defaultFilters).excludeTitles(movie['title']).limitTo(
-            10).asList()
-        for otherMovie in otherMovies:
-            if not otherMovie['director']:
-                continue
+        otherMovieIds = LIBRARY.getMovieDistractors().getDistractors(
+            movie['movieid'], 10, LIBRARY.getMovieIds(defaultFilters),
+            accept=lambda movieId: LIBRARY.movies.getValue(movieId, 'director'), difficulty=getDistractorDifficulty())
+        for otherMovie in LIBRARY.getMovies(['director']).withIds(otherMovieIds).asList():
 
             directorFound = False
             for otherDirector in otherMovie['director']:
@@ -622,32 +711,22 @@ class WhatMovieIsNotDirectedByQuestion(MovieQuestion):
         """
         super(WhatMovieIsNotDirectedByQuestion, self).__init__()
 
-        # Find a bunch of directors
-        directors = list()
-        items = library.getMovies(['title', 'director']).withFilters(defaultFilters).limitTo(10).asList()
-        for item in items:
-            directors.extend(iter(item['director']))
-
-        # Find one that has at least three movies
-        movies = None
-        director = None
-        for director in directors:
-        #            if not director['thumbnail']:
-        #                continue
-            movies = library.getMovies(['title', 'art']).withFilters(defaultFilters).directedBy(director).limitTo(
-                3).asList()
-
-            if len(movies) >= 3:
-                break
+        movieIndex = LIBRARY.getMovieIndex()
+        movieIds = LIBRARY.getMovieIds(defaultFilters)
 
-        if len(movies) < 3:
+        # Find a director with at least three movies
+        director = movieIndex.randomKey('director', minimum=3, within=movieIds)
+        if director is None:
             raise QuestionException("Didn't find a director with at least three movies")
 
+        movies = LIBRARY.getMovies(['title', 'art']).withIds(movieIndex.having('director', director, movieIds)).limitTo(
+            3).asList()
+
         # Find movie not directed by director
-        otherMovie = library.getMovies(['title', 'art']).withFilters(defaultFilters).notDirectedBy(director).limitTo(
-            1).asItem()
-        if not otherMovie:
+        otherMovieIds = movieIndex.without('director', director, movieIds)
+        if not otherMovieIds:
             raise QuestionException('No movie found')
+        otherMovie = LIBRARY.getMovies(['title', 'art']).withIds(otherMovieIds).limitTo(1).asItem()
         self.addCorrectAnswer(director, otherMovie['title'], image=otherMovie['art']['poster'])
 
         for movie in movies:
@@ -670,50 +749,40 @@ class WhatActorIsInTheseMoviesQuestion(MovieQuestion):
         threePhotoDisplayType = ThreePhotoDisplayType()
         super(WhatActorIsInTheseMoviesQuestion, self).__init__(threePhotoDisplayType)
 
-        # Find a bunch of actors
-        actors = list()
-        items = library.getMovies(['title', 'cast']).withFilters(defaultFilters).limitTo(10).asList()
-        for item in items:
-            actors.extend(iter(item['cast']))
-
-        # Find one that has at least three movies
-        movies = None
-        actor = None
-        for actor in actors:
-            if not 'thumbnail' in actor:
-                continue
-            movies = library.getMovies(['title', 'art']).withFilters(defaultFilters).withActor(actor['name']).limitTo(
-                3).asList()
-
-            if len(movies) >= 3:
-                break
+        movieIndex = LIBRARY.getMovieIndex()
+        movieIds = LIBRARY.getMovieIds(defaultFilters)
 
-        if len(movies) < 3:
+        # Find an actor with thumbnail and at least three movies
+        actor = movieIndex.randomKey('actor', minimum=3, within=movieIds, accept=LIBRARY.getActorThumbnail)
+        if actor is None:
             raise QuestionException("Didn't find an actor with at least three movies")
 
         # Setup the display with three movies
+        movies = LIBRARY.getMovies(['title', 'art']).withIds(movieIndex.having('actor', actor, movieIds)).limitTo(
+            3).asList()
         for movie in movies:
             threePhotoDisplayType.addPhoto(movie['art']['poster'], movie['title'])
 
-        # Find movie without actor
-        otherMovie = library.getMovies(['title', 'art']).withFilters(defaultFilters).withoutActor(
-            actor['name']).limitTo(1).asItem()
-        if not otherMovie:
+        # Find movies without actor
+        otherMovieIds = movieIndex.without('actor', actor, movieIds)
+        if not otherMovieIds:
             raise QuestionException('No movie found')
-        self.addCorrectAnswer(actor['name'], actor['title'], image=actor['thumbnail'])
+        self.addCorrectAnswer(actor, actor, image=LIBRARY.getActorThumbnail(actor))
 
-        # Find another bunch of actors
+        # Find another bunch of actors, not in any of the three movies
+        shownMovieIds = set([movie['movieid'] for movie in movies])
         actors = list()
-        items = library.getMovies(['title', 'cast']).withFilters(defaultFilters).withoutActor(actor['name']).limitTo(
-            10).asList()
+        items = LIBRARY.getMovies(['cast']).withIds(otherMovieIds).limitTo(10).asList()
         for item in items:
             actors.extend(iter(item['cast']))
 
         random.shuffle(actors)
-        for actor in actors:
-            if not 'thumbnail' in actor:
+        for otherActor in actors:
+            if not 'thumbnail' in otherActor or otherActor['name'] in self.getAnswerTexts():
                 continue
-            self.addAnswer(-1, actor['name'], image=actor['thumbnail'])
+            if movieIndex.having('actor', otherActor['name'], shownMovieIds):
+                continue
+            self.addAnswer(-1, otherActor['name'], image=otherActor['thumbnail'])
             if len(self.answers) == 4:
                 break
 
@@ -733,7 +802,7 @@ class WhatActorIsInMovieBesidesOtherActorQuestion(MovieQuestion):
         super(WhatActorIsInMovieBesidesOtherActorQuestion, self).__init__()
 
         # Find a bunch of movies
-        items = library.getMovies(['title', 'cast', 'art']).withFilters(defaultFilters).limitTo(10).asList()
+        items = LIBRARY.getMovies(['title', 'cast', 'art']).withFilters(defaultFilters).limitTo(10).asList()
         movie = None
         for item in items:
             if len(item['cast']) >= 2:
@@ -751,7 +820,7 @@ class WhatActorIsInMovieBesidesOtherActorQuestion(MovieQuestion):
 
         # Find another bunch of actors
         otherActors = list()
-        items = library.getMovies(['title', 'cast']).withFilters(defaultFilters).withoutActor(
+        items = LIBRARY.getMovies(['title', 'cast']).withFilters(defaultFilters).withoutActor(
             actorOne['name']).withoutActor(actorTwo['name']).limitTo(10).asList()
         for item in items:
             otherActors.extend(iter(item['cast']))
@@ -781,7 +850,7 @@ class WhatMovieHasTheLongestRuntimeQuestion(MovieQuestion):
         super(WhatMovieHasTheLongestRuntimeQuestion, self).__init__()
 
         # Find a bunch of movies
-        items = library.getMovies(['title', 'runtime', 'art']).withFilters(defaultFilters).limitTo(10).asList()
+        items = LIBRARY.getMovies(['title', 'runtime', 'art']).withFilters(defaultFilters).limitTo(10).asList()
         movie = None
         otherMovies = list()
         for item in items:
@@ -838,20 +907,21 @@ class WhatTVShowIsThisQuestion(TVQuestion):
         videoDisplayType = VideoDisplayType()
         super(WhatTVShowIsThisQuestion, self).__init__(videoDisplayType)
 
-        show = library.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
+        show = LIBRARY.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
         if not show:
             raise QuestionException('No tvshows found')
         self.addCorrectAnswer(id=show['tvshowid'], text=show['title'], image=show['art']['poster'])
 
-        episode = library.getEpisodes(['file']).withFilters(defaultFilters).fromShow(show['title']).limitTo(
+        episode = LIBRARY.getEpisodes(['file']).withFilters(defaultFilters).fromShow(show['title']).limitTo(
             1).asItem()
         if not episode:
             raise QuestionException('TVshow has no episodes')
 
-        otherShows = library.getTVShows(['title', 'art']).withFilters(defaultFilters).excludeTitles(
-            [show['title']]).limitTo(3).asList()
-        for otherShow in otherShows:
-            self.addAnswer(id=otherShow['tvshowid'], text=otherShow['title'], image=otherShow['art']['poster'])
+        otherShowIds = LIBRARY.getTVShowDistractors().getDistractors(
+            show['tvshowid'], 6, LIBRARY.getTVShowIds(defaultFilters), difficulty=getDistractorDifficulty())
+        for otherShow in LIBRARY.getTVShows(['title', 'art']).withIds(otherShowIds).asList():
+            if len(self.answers) < 4 and not otherShow['title'] in self.getAnswerTexts():
+                self.addAnswer(id=otherShow['tvshowid'], text=otherShow['title'], image=otherShow['art']['poster'])
 
         random.shuffle(self.answers)
         self.text = strings(Q_WHAT_TVSHOW_IS_THIS)
@@ -870,14 +940,14 @@ class WhatSeasonIsThisQuestion(TVQuestion):
         videoDisplayType = VideoDisplayType()
         super(WhatSeasonIsThisQuestion, self).__init__(videoDisplayType)
 
-        show = library.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
+        show = LIBRARY.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
         if not show:
             raise QuestionException('No tvshows found')
 
-        seasons = library.getSeasons(show['tvshowid'], ['season', 'art']).limitTo(4).asList()
+        seasons = LIBRARY.getSeasons(show['tvshowid'], ['season', 'art']).limitTo(4).asList()
         correctIdx = random.randint(0, len(seasons) - 1)
 
-        episode = library.getEpisodes(['file']).withFilters(defaultFilters).fromShow(
+        episode = LIBRARY.getEpisodes(['file']).withFilters(defaultFilters).fromShow(
             show['title']).fromSeason(seasons[correctIdx]['season']).limitTo(1).asItem()
         if not episode:
             raise QuestionException('TVshow has no episodes')
@@ -904,15 +974,15 @@ class WhatEpisodeIsThisQuestion(TVQuestion):
         videoDisplayType = VideoDisplayType()
         super(WhatEpisodeIsThisQuestion, self).__init__(videoDisplayType)
 
-        show = library.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
+        show = LIBRARY.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
         if not show:
             raise QuestionException('No tvshows found')
 
-        season = library.getSeasons(show['tvshowid'], ['season', 'art']).limitTo(14).asItem()
+        season = LIBRARY.getSeasons(show['tvshowid'], ['season', 'art']).limitTo(14).asItem()
         if not season:
             raise QuestionException('No seasons found')
 
-        episodes = library.getEpisodes(['episode', 'title', 'file']).fromShow(show['title']).fromSeason(
+        episodes = LIBRARY.getEpisodes(['episode', 'title', 'file']).fromShow(show['title']).fromSeason(
             season['season']).limitTo(4).asList()
         correctIdx = random.randint(0, len(episodes) - 1)
 
@@ -938,15 +1008,15 @@ class WhenWasTVShowFirstAiredQuestion(TVQuestion):
         """
         super(WhenWasTVShowFirstAiredQuestion, self).__init__()
 
-        show = library.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
+        show = LIBRARY.getTVShows(['title', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
         if not show:
             raise QuestionException('No shows found')
 
-        season = library.getSeasons(show['tvshowid'], ['season']).limitTo(1).asItem()
+        season = LIBRARY.getSeasons(show['tvshowid'], ['season']).limitTo(1).asItem()
         if not season:
             raise QuestionException('No seasons found')
 
-        episode = library.getEpisodes(['firstaired']).withFilters(defaultFilters).episode(1).fromShow(
+        episode = LIBRARY.getEpisodes(['firstaired']).withFilters(defaultFilters).episode(1).fromShow(
             show['title']).fromSeason(season['season']).limitTo(1).asItem()
         if not episode:
             raise QuestionException('No episodes found')
@@ -990,7 +1060,7 @@ class WhoPlayedRoleInTVShowQuestion(TVQuestion):
         """
         super(WhoPlayedRoleInTVShowQuestion, self).__init__()
 
-        show = library.getTVShows(['title', 'genre', 'cast', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
+        show = LIBRARY.getTVShows(['title', 'genre', 'cast', 'art']).withFilters(defaultFilters).limitTo(1).asItem()
         if not show or len(show['cast']) < 4:
             raise QuestionException('No tvshows found')
 
@@ -1032,8 +1102,11 @@ class WhatTVShowIsThisQuoteFrom(TVQuestion):
         quoteDisplayType = QuoteDisplayType()
         super(WhatTVShowIsThisQuoteFrom, self).__init__(quoteDisplayType)
 
-        episode = library.getEpisodes(['showtitle', 'season', 'episode', 'art']).withFilters(defaultFilters).limitTo(
-            1).asItem()
+        if not IMDB.isDataLoaded():
+            raise ImdbDataNotLoadedException('IMDb data is not loaded yet')
+
+        episode = LIBRARY.getEpisodes(['showtitle', 'season', 'episode', 'art', 'tvshowid']).withFilters(
+            defaultFilters).limitTo(1).asItem()
         if not episode:
             raise QuestionException('No episodes found')
 
@@ -1044,10 +1117,11 @@ class WhatTVShowIsThisQuoteFrom(TVQuestion):
 
         self.addCorrectAnswer(id=episode['showtitle'], text=episode['showtitle'], image=episode['art']['tvshow.poster'])
 
-        otherShows = library.getTVShows(['title', 'art']).withFilters(defaultFilters).excludeTitles(
-            [episode['showtitle']]).limitTo(3).asList()
-        for otherShow in otherShows:
-            self.addAnswer(id=otherShow['title'].encode('utf-8', 'ignore'), text=otherShow['title'], image=otherShow['art']['poster'])
+        otherShowIds = LIBRARY.getTVShowDistractors().getDistractors(
+            episode['tvshowid'], 6, LIBRARY.getTVShowIds(defaultFilters), difficulty=getDistractorDifficulty())
+        for otherShow in LIBRARY.getTVShows(['title', 'art']).withIds(otherShowIds).asList():
+            if len(self.answers) < 4 and not otherShow['title'] in self.getAnswerTexts():
+                self.addAnswer(id=otherShow['title'].encode('utf-8', 'ignore'), text=otherShow['title'], image=otherShow['art']['poster'])
 
         random.shuffle(self.answers)
         quoteDisplayType.setQuoteText(quoteText)
@@ -1063,7 +1137,7 @@ class WhatTVShowIsThisThemeFromQuestion(TVQuestion):
         audioDisplayType = AudioDisplayType()
         super(WhatTVShowIsThisThemeFromQuestion, self).__init__(audioDisplayType)
 
-        items = library.getTVShows(['title', 'file', 'art']).withFilters(defaultFilters).limitTo(4).asList()
+        items = LIBRARY.getTVShows(['title', 'file', 'art']).withFilters(defaultFilters).limitTo(4).asList()
         show = None
         otherShows = list()
         for item in items:
@@ -1103,23 +1177,25 @@ class WhatSongIsThisQuestion(MusicQuestion):
         audioDisplayType = AudioDisplayType()
         super(WhatSongIsThisQuestion, self).__init__(audioDisplayType)
 
-        correctAnswer = library.getSongs(['title', 'artist', 'artistid', 'file', 'thumbnail']).withFilters(defaultFilters).limitTo(1).asItem()
+        correctAnswer = LIBRARY.getSongs(['title', 'artist', 'artistid', 'file', 'thumbnail']).withFilters(defaultFilters).limitTo(1).asItem()
         if not correctAnswer:
             raise QuestionException('No songs found')
 
         self.addCorrectAnswer(id=correctAnswer['file'], text=correctAnswer['title'], image=correctAnswer['thumbnail'])
 
         # Fill with random songs
-        theRest = library.getSongs(['title', 'artist', 'thumbnail']).withFilters(defaultFilters).excludeTitles(
-            self.getAnswerTexts()).withArtist(correctAnswer['artist'][0]).limitTo(4 - len(self.answers)).asList()
+        theRest = LIBRARY.getSongs(['title', 'artist', 'thumbnail']).withFilters(defaultFilters).excludeIds(
+            [correctAnswer['songid']]).withArtist(correctAnswer['artist'][0]).limitTo(10).asList()
         for song in theRest:
-            self.addAnswer(id=-1, text=song['title'], image=song['thumbnail'])
+            # the same song may be on several albums
+            if len(self.answers) < 4 and not song['title'] in self.getAnswerTexts():
+                self.addAnswer(id=-1, text=song['title'], image=song['thumbnail'])
 
         random.shuffle(self.answers)
         self.text = strings(Q_WHAT_SONG_IS_THIS, correctAnswer['artist'][0])
         audioDisplayType.setAudioFile(correctAnswer['file'])
 
-        artist = library.getArtistDetails(correctAnswer['artistid'][0], ['fanart']).asItem()
+        artist = LIBRARY.getArtistDetails(correctAnswer['artistid'][0], ['fanart']).asItem()
         self.setFanartFile(artist['fanart'])
 
     @staticmethod
@@ -1132,18 +1208,18 @@ class WhoMadeThisSongQuestion(MusicQuestion):
         audioDisplayType = AudioDisplayType()
         super(WhoMadeThisSongQuestion, self).__init__(audioDisplayType)
 
-        correctAnswer = library.getArtists().withFilters(defaultFilters).limitTo(1).asItem()
-        artist = library.getArtistDetails(correctAnswer['artistid'], ['thumbnail']).asItem()
-        song = library.getSongs(['title', 'file']).withFilters(defaultFilters).withArtist(correctAnswer['artist']).limitTo(1).asItem()
+        correctAnswer = LIBRARY.getArtists().withFilters(defaultFilters).limitTo(1).asItem()
+        artist = LIBRARY.getArtistDetails(correctAnswer['artistid'], ['thumbnail']).asItem()
+        song = LIBRARY.getSongs(['title', 'file']).withFilters(defaultFilters).withArtist(correctAnswer['artist']).limitTo(1).asItem()
         if not correctAnswer or not song:
             raise QuestionException('No artist or song found')
 
         self.addCorrectAnswer(id=correctAnswer['artistid'], text=correctAnswer['artist'], image=artist['thumbnail'])
 
         # Fill with random artists
-        theRest = library.getArtists().withFilters(defaultFilters).withoutArtist(correctAnswer['artist']).limitTo(4 - len(self.answers)).asList()
+        theRest = LIBRARY.getArtists().withFilters(defaultFilters).withoutArtist(correctAnswer['artist']).limitTo(4 - len(self.answers)).asList()
         for item in theRest:
-            artist = library.getArtistDetails(item['artistid'], ['thumbnail']).asItem()
+            artist = LIBRARY.getArtistDetails(item['artistid'], ['thumbnail']).asItem()
             self.addAnswer(id=item['artist'], text=item['artist'], image=artist['thumbnail'])
 
         random.shuffle(self.answers)
@@ -1160,18 +1236,18 @@ class WhoMadeThisAlbumQuestion(MusicQuestion):
         photoDisplayType = PhotoDisplayType()
         super(WhoMadeThisAlbumQuestion, self).__init__(photoDisplayType)
 
-        correctAnswer = library.getArtists().withFilters(defaultFilters).limitTo(1).asItem()
-        artist = library.getArtistDetails(correctAnswer['artistid'], ['thumbnail']).asItem()
-        album = library.getAlbums(['title', 'fanart', 'thumbnail']).withFilters(defaultFilters).withArtist(correctAnswer['artist']).limitTo(1).asItem()
+        correctAnswer = LIBRARY.getArtists().withFilters(defaultFilters).limitTo(1).asItem()
+        artist = LIBRARY.getArtistDetails(correctAnswer['artistid'], ['thumbnail']).asItem()
+        album = LIBRARY.getAlbums(['title', 'fanart', 'thumbnail']).withFilters(defaultFilters).withArtist(correctAnswer['artist']).limitTo(1).asItem()
         if not correctAnswer or not album:
             raise QuestionException('No artist or album found')
 
         self.addCorrectAnswer(id=correctAnswer['artistid'], text=correctAnswer['artist'], image=artist['thumbnail'])
 
         # Fill with random artists
-        theRest = library.getArtists().withFilters(defaultFilters).withoutArtist(correctAnswer['artist']).limitTo(4 - len(self.answers)).asList()
+        theRest = LIBRARY.getArtists().withFilters(defaultFilters).withoutArtist(correctAnswer['artist']).limitTo(4 - len(self.answers)).asList()
         for item in theRest:
-            artist = library.getArtistDetails(item['artistid'], ['thumbnail']).asItem()
+            artist = LIBRARY.getArtistDetails(item['artistid'], ['thumbnail']).asItem()
             self.addAnswer(id=item['artist'], text=item['artist'], image=artist['thumbnail'])
 
         random.shuffle(self.answers)
@@ -1188,6 +1264,17 @@ class QuestionException(Exception):
     pass
 
 
+class ImdbDataNotLoadedException(QuestionException):
+    pass
+
+
+def getDistractorDifficulty():
+    """
+    Returns how similar the wrong answers picked by distractor.DistractorEngine should be.
+    """
+    return distractor.DIFFICULTIES.get(ADDON.getSetting(SETT_DISTRACTOR_DIFFICULTY), distractor.DIFFICULTY_NORMAL)
+
+
 def getEnabledQuestionCandidates(gameInstance):
     """
         Gets random question from one of the Question subclasses.
@@ -1205,6 +1292,14 @@ def getEnabledQuestionCandidates(gameInstance):
     return questionCandidates
 
 
+def _getQuestionTypes():
+    questionTypes = dict()
+    for base in [MovieQuestion, TVQuestion, MusicQuestion]:
+        for candidate in base.__subclasses__():
+            questionTypes[candidate.__name__] = candidate
+    return questionTypes
+
+
 def isAnyMovieQuestionsEnabled():
     subclasses = MovieQuestion.__subclasses__()
     subclasses = [subclass for subclass in subclasses if subclass.isEnabled()]
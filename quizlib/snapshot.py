@@ -0,0 +1,1105 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import array
+import marshal
+import os
+import random
+import struct
+import threading
+import time
+
+import game
+import imdb
+import library
+import logger
+from index import LibraryIndex
+from distractor import DistractorEngine
+
+log = logger.getLogger('snapshot')
+
+MOVIE_PROPERTIES = ['title', 'set', 'genre', 'file', 'art', 'cast', 'year', 'tagline', 'studio', 'director',
+                    'runtime', 'mpaa', 'playcount']
+TVSHOW_PROPERTIES = ['title', 'genre', 'cast', 'file', 'art', 'mpaa', 'playcount']
+SEASON_PROPERTIES = ['season', 'art', 'tvshowid']
+EPISODE_PROPERTIES = ['title', 'showtitle', 'season', 'episode', 'file', 'firstaired', 'art', 'tvshowid',
+                      'playcount']
+SONG_PROPERTIES = ['title', 'artist', 'artistid', 'file', 'thumbnail', 'genre', 'playcount']
+ALBUM_PROPERTIES = ['title', 'artist', 'artistid', 'fanart', 'thumbnail', 'genre', 'playcount']
+ARTIST_PROPERTIES = ['thumbnail', 'fanart']
+
+# How much sharing the values of a field makes items alike when picking wrong answers
+MOVIE_SIMILARITY_WEIGHTS = {'set': 4.0, 'genre': 2.0, 'actor': 1.5, 'director': 1.0, 'studio': 1.0}
+MOVIE_YEAR_WEIGHT = 1.0
+TVSHOW_SIMILARITY_WEIGHTS = {'genre': 2.0, 'actor': 1.5}
+
+# The tables loaded for each game type, the seasons are loaded along with the tv shows
+GAMETYPE_TABLES = {
+    game.GAMETYPE_MOVIE: ['movies'],
+    game.GAMETYPE_TVSHOW: ['tvshows', 'episodes'],
+    game.GAMETYPE_MUSIC: ['songs', 'albums', 'artists']
+}
+# The tables holding the item types of library notifications
+NOTIFICATION_TABLES = {
+    'movie': 'movies',
+    'tvshow': 'tvshows',
+    'episode': 'episodes',
+    'song': 'songs',
+    'album': 'albums',
+    'artist': 'artists'
+}
+# The query class, list method, details method, details result key and properties of the items of each table
+TABLE_QUERIES = {
+    'movies': (library.VideoQuery, 'VideoLibrary.GetMovies', 'VideoLibrary.GetMovieDetails', 'moviedetails',
+               MOVIE_PROPERTIES),
+    'tvshows': (library.VideoQuery, 'VideoLibrary.GetTVShows', 'VideoLibrary.GetTVShowDetails', 'tvshowdetails',
+                TVSHOW_PROPERTIES),
+    'episodes': (library.VideoQuery, 'VideoLibrary.GetEpisodes', 'VideoLibrary.GetEpisodeDetails', 'episodedetails',
+                 EPISODE_PROPERTIES),
+    'songs': (library.AudioQuery, 'AudioLibrary.GetSongs', 'AudioLibrary.GetSongDetails', 'songdetails',
+              SONG_PROPERTIES),
+    'albums': (library.AudioQuery, 'AudioLibrary.GetAlbums', 'AudioLibrary.GetAlbumDetails', 'albumdetails',
+               ALBUM_PROPERTIES),
+    'artists': (library.AudioQuery, 'AudioLibrary.GetArtists', 'AudioLibrary.GetArtistDetails', 'artistdetails',
+                ARTIST_PROPERTIES)
+}
+
+# Tables without a date added to find the newest item by, their fingerprint is the number of items
+UNDATED_TABLES = ['artists']
+
+# Properties stored in compact integer arrays
+INT_PROPERTIES = ['year', 'runtime', 'playcount', 'season', 'episode', 'tvshowid']
+# Properties that are lists of strings or ids in the JSON-RPC response
+LIST_PROPERTIES = ['genre', 'studio', 'director', 'artist', 'artistid']
+
+
+class Table(object):
+    """
+    Column oriented storage of one type of library item, eg. movies or episodes.
+
+    Each property is kept in its own column, integer properties in arrays and strings interned, so
+    a library of many thousand items only costs a few megabytes.
+    """
+
+    def __init__(self, resultKey, idKey, properties, filterFields, indexFields=None, listProperties=LIST_PROPERTIES):
+        """
+        @param resultKey: the key in the JSON-RPC result holding the items, eg. movies
+        @type resultKey: str
+        @param idKey: the key holding the library id of each item, eg. movieid
+        @type idKey: str
+        @param properties: the properties to store for each item
+        @type properties: list
+        @param filterFields: maps filter fields used by library.Query to the stored property
+        @type filterFields: dict
+        @param indexFields: the filter fields to build postings for, eg. actor
+        @type indexFields: list
+        @param listProperties: the properties holding lists in the JSON-RPC response
+        @type listProperties: list
+        """
+        self.resultKey = resultKey
+        self.idKey = idKey
+        self.properties = properties
+        self.filterFields = filterFields
+        self.listProperties = [prop for prop in properties if prop in listProperties]
+
+        self.ids = array.array('l')
+        self.labels = list()
+        self.columns = dict()
+        for prop in properties:
+            if prop in INT_PROPERTIES:
+                self.columns[prop] = array.array('l')
+            else:
+                self.columns[prop] = list()
+
+        self.rowsById = dict()
+        self.index = LibraryIndex(indexFields or [])
+        self.thumbnails = dict()
+        self.strings = dict()
+        self.filteredIds = dict()
+        self.version = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, item):
+        self.filteredIds.clear()
+        self.version += 1
+        idx = len(self.ids)
+        itemId = item.get(self.idKey, -1) if self.idKey else idx
+        self.ids.append(itemId)
+        self.rowsById[itemId] = idx
+        self.labels.append(self._intern(item.get('label', '')))
+
+        for prop in self.properties:
+            value = item.get(prop)
+            if prop in INT_PROPERTIES:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    value = 0
+            elif prop in self.listProperties:
+                if value is None:
+                    value = ()
+                elif isinstance(value, list):
+                    value = tuple([self._intern(v) for v in value])
+                else:
+                    value = (self._intern(value),)
+            elif prop == 'cast':
+                value = tuple([(self._intern(actor.get('name', '')), actor.get('role', ''), actor.get('thumbnail'))
+                               for actor in value or []])
+                for actor in value:
+                    if actor[2] is not None:
+                        self.thumbnails[actor[0]] = actor[2]
+            elif prop == 'art':
+                value = value or dict()
+            else:
+                value = self._intern(value)
+            self.columns[prop].append(value)
+
+        for field in self.index.fields:
+            self.index.add(itemId, field, self._values(self.filterFields[field], idx))
+
+    def toData(self):
+        """
+        Returns the content of the table as a dict of marshal-compatible values, see fromData().
+        """
+        columns = dict()
+        for prop, column in self.columns.iteritems():
+            if prop in INT_PROPERTIES:
+                columns[prop] = column.tostring()
+            else:
+                columns[prop] = column
+        return {'ids': self.ids.tostring(), 'labels': self.labels, 'columns': columns, 'thumbnails': self.thumbnails,
+                'index': self.index.toData()}
+
+    def fromData(self, data):
+        """
+        Fills the empty table with the content returned by toData().
+
+        @return: the table
+        """
+        # marshal does not share equal strings, intern them again
+        intern = self.strings.setdefault
+        self.ids.fromstring(data['ids'])
+        self.labels = [intern(label, label) for label in data['labels']]
+        for prop in self.properties:
+            column = data['columns'][prop]
+            if prop in INT_PROPERTIES:
+                self.columns[prop].fromstring(column)
+            elif prop in self.listProperties:
+                self.columns[prop] = [tuple([intern(v, v) for v in value]) for value in column]
+            elif prop == 'cast':
+                self.columns[prop] = [tuple([(intern(actor[0], actor[0]), actor[1], actor[2]) for actor in value])
+                                      for value in column]
+            elif prop == 'art':
+                self.columns[prop] = column
+            else:
+                self.columns[prop] = [intern(value, value) for value in column]
+        if len(self.labels) != len(self.ids) or [prop for prop in self.properties
+                                                 if len(self.columns[prop]) != len(self.ids)]:
+            raise ValueError('Columns of %s differ in length' % self.resultKey)
+
+        self.thumbnails = data['thumbnails']
+        self.rowsById = dict([(itemId, idx) for idx, itemId in enumerate(self.ids)])
+        self.index.fromData(data['index'])
+        self.version += 1
+        return self
+
+    def upsert(self, item):
+        """
+        Adds the item, replacing the stored item with the same library id.
+        """
+        self.remove(item.get(self.idKey))
+        self.append(item)
+
+    def remove(self, itemId):
+        """
+        Removes the item with the library id. The last row is moved into its place,
+        so removing an item does not shift the other rows.
+
+        @return: True if the item was found
+        """
+        idx = self.rowsById.pop(itemId, None)
+        if idx is None:
+            return False
+        self.filteredIds.clear()
+        self.version += 1
+
+        for field in self.index.fields:
+            self.index.discard(itemId, field, self._values(self.filterFields[field], idx))
+
+        last = len(self.ids) - 1
+        if idx != last:
+            self.ids[idx] = self.ids[last]
+            self.labels[idx] = self.labels[last]
+            for column in self.columns.itervalues():
+                column[idx] = column[last]
+            self.rowsById[self.ids[idx]] = idx
+
+        self.ids.pop()
+        self.labels.pop()
+        for column in self.columns.itervalues():
+            column.pop()
+        return True
+
+    def getIds(self, filters):
+        """
+        Returns the ids of all items matching the filters. The result is cached, as the same
+        default filters are used for every question in a game.
+
+        @param filters: list of JSON-RPC filters, eg. QuizGui.defaultLibraryFilters
+        @type filters: list
+        """
+        key = repr(filters)
+        if not key in self.filteredIds:
+            predicates = [self._compileFilter(f) for f in filters]
+            predicates = [p for p in predicates if p is not None]
+            self.filteredIds[key] = frozenset([self.ids[idx] for idx in xrange(len(self.ids))
+                                               if all(p(idx) for p in predicates)])
+        return self.filteredIds[key]
+
+    def query(self, query):
+        """
+        Evaluates a library.Query against the table, returning a dict shaped like the JSON-RPC response.
+
+        @param query: the query holding filters, limits and sort order
+        @type query: library.Query
+        """
+        if self.idKey and self.idKey in query.params:
+            return self._details(query)
+
+        predicates = [self._compileFilter(f) for f in query.filters]
+        predicates = [p for p in predicates if p is not None]
+
+        limit = None
+        if 'limits' in query.params:
+            limit = query.params['limits']['end'] - query.params['limits']['start']
+
+        randomOrder = query.params.get('sort', {}).get('method') == 'random'
+
+        rows = list()
+        for idx in self._candidates(query, randomOrder):
+            if query.excludedIds and self.ids[idx] in query.excludedIds:
+                continue
+            for predicate in predicates:
+                if not predicate(idx):
+                    break
+            else:
+                rows.append(self.row(idx, query.properties))
+                if limit is not None and len(rows) >= limit:
+                    break
+
+        return {'id': query.query['id'], 'jsonrpc': '2.0', 'result': {self.resultKey: rows}}
+
+    def row(self, idx, properties=None):
+        """
+        Materializes a single item as a fresh dict, so callers are free to modify it.
+        """
+        item = {'label': self.labels[idx]}
+        if self.idKey:
+            item[self.idKey] = self.ids[idx]
+
+        for prop in properties or []:
+            if not prop in self.columns:
+                continue
+            value = self.columns[prop][idx]
+            if prop in self.listProperties:
+                value = list(value)
+            elif prop == 'cast':
+                value = [self._castMember(actor) for actor in value]
+            elif prop == 'art':
+                value = dict(value)
+            item[prop] = value
+
+        return item
+
+    def _details(self, query):
+        result = dict()
+        idx = self.rowsById.get(query.params[self.idKey])
+        if idx is not None:
+            result[query.resultKey] = self.row(idx, query.properties)
+        return {'id': query.query['id'], 'jsonrpc': '2.0', 'result': result}
+
+    def _candidates(self, query, randomOrder):
+        """
+        Narrows the rows to inspect using the item ids of the query and the postings of
+        any indexed "is" filters. The filters are still evaluated on each candidate.
+        """
+        itemIds = query.itemIds
+        for f in query.filters:
+            if f.get('operator') == 'is' and f.get('field') in self.index.fields:
+                values = f['value'] if isinstance(f['value'], list) else [f['value']]
+                if self.filterFields[f['field']] in INT_PROPERTIES:
+                    values = [int(_toNumber(value)) for value in values]
+                postings = set()
+                for value in values:
+                    postings.update(self.index.get(f['field'], value))
+                if itemIds is None:
+                    itemIds = postings
+                else:
+                    itemIds = itemIds & postings
+
+        if itemIds is None:
+            indices = range(len(self.ids))
+        else:
+            indices = sorted([self.rowsById[itemId] for itemId in itemIds if itemId in self.rowsById])
+
+        if randomOrder:
+            return _randomOrder(indices)
+        return iter(indices)
+
+    def _castMember(self, actor):
+        castMember = {'name': actor[0], 'role': actor[1]}
+        if actor[2] is not None:
+            castMember['thumbnail'] = actor[2]
+        return castMember
+
+    def _intern(self, value):
+        if isinstance(value, basestring):
+            return self.strings.setdefault(value, value)
+        return value
+
+    def getValue(self, itemId, prop):
+        """
+        Returns the stored value of a property of the item with the library id, eg. the tagline of a movie.
+        """
+        return self.columns[prop][self.rowsById[itemId]]
+
+    def setValue(self, itemId, prop, value):
+        """
+        Changes the stored value of a property that is not indexed, eg. the content rating of an episode.
+        """
+        self.columns[prop][self.rowsById[itemId]] = self._intern(value)
+        self.filteredIds.clear()
+        self.version += 1
+
+    def getFieldValues(self, field, idx):
+        """
+        Returns the values of a filter field for the item in row idx, eg. the names of the cast for actor.
+        """
+        return self._values(self.filterFields[field], idx)
+
+    def _values(self, prop, idx):
+        value = self.columns[prop][idx]
+        if prop in self.listProperties:
+            return value
+        elif prop == 'cast':
+            return [actor[0] for actor in value]
+        return (value,)
+
+    def _compileFilter(self, filter):
+        """
+        Compiles a JSON-RPC filter into a predicate taking a row index.
+        Filters on fields not known by this table are ignored.
+        """
+        if 'and' in filter or 'or' in filter:
+            predicates = [self._compileFilter(f) for f in filter.get('and', filter.get('or'))]
+            predicates = [p for p in predicates if p is not None]
+            if 'and' in filter:
+                return lambda idx: all(p(idx) for p in predicates)
+            else:
+                return lambda idx: any(p(idx) for p in predicates)
+
+        prop = self.filterFields.get(filter['field'])
+        if prop is None or prop not in self.columns:
+            return None
+
+        operator = filter['operator']
+        expected = filter['value']
+        if not isinstance(expected, list):
+            expected = [expected]
+
+        if prop in INT_PROPERTIES or operator in ['greaterthan', 'lessthan']:
+            expected = [_toNumber(e) for e in expected]
+            compare = _NUMERIC_OPERATORS.get(operator)
+            convert = _toNumber
+        else:
+            expected = [unicode(e).lower() for e in expected]
+            compare = _STRING_OPERATORS.get(operator)
+            convert = lambda v: (v or u'').lower()
+
+        if compare is None:
+            return None
+
+        negated = operator in ['isnot', 'doesnotcontain']
+
+        def predicate(idx):
+            values = [convert(v) for v in self._values(prop, idx)]
+            matched = any(compare(v, e) for v in values for e in expected)
+            if negated:
+                return not matched
+            return matched
+
+        return predicate
+
+
+class SeasonTable(Table):
+    def _candidates(self, query, randomOrder):
+        if 'tvshowid' in query.params:
+            query.withIds(self.index.get('tvshowid', query.params['tvshowid']))
+        return super(SeasonTable, self)._candidates(query, randomOrder)
+
+
+class SnapshotQuery(object):
+    """
+    Mixin evaluating a library.Query against a Table instead of sending it to XBMC.
+    """
+
+    def __init__(self, table, params, properties=None, resultKey=None):
+        super(SnapshotQuery, self).__init__(None, params, properties, resultKey or table.resultKey)
+        self.table = table
+        self.itemIds = None
+
+    def buildRequest(self):
+        # evaluated locally, also when added to a library.QueryBatch
+        return None
+
+    def getResponse(self):
+        return self.table.query(self)
+
+    def withIds(self, itemIds):
+        """
+        Limits the query to the items with the given library ids, eg. from a LibraryIndex.
+        """
+        if self.itemIds is None:
+            self.itemIds = set(itemIds)
+        else:
+            self.itemIds = self.itemIds & set(itemIds)
+        return self
+
+
+class SnapshotVideoQuery(SnapshotQuery, library.VideoQuery):
+    pass
+
+
+class SnapshotAudioQuery(SnapshotQuery, library.AudioQuery):
+    pass
+
+
+def createMoviesTable():
+    return Table('movies', 'movieid', MOVIE_PROPERTIES, {
+        'title': 'title',
+        'set': 'set',
+        'genre': 'genre',
+        'actor': 'cast',
+        'year': 'year',
+        'director': 'director',
+        'studio': 'studio',
+        'playcount': 'playcount',
+        'mpaarating': 'mpaa'
+    }, ['actor', 'director', 'genre', 'set', 'studio', 'year'])
+
+
+def createTVShowsTable():
+    return Table('tvshows', 'tvshowid', TVSHOW_PROPERTIES, {
+        'title': 'title',
+        'tvshow': 'title',
+        'genre': 'genre',
+        'actor': 'cast',
+        'playcount': 'playcount',
+        'mpaarating': 'mpaa',
+        'rating': 'mpaa'
+    }, ['tvshow', 'actor', 'genre'])
+
+
+def createSeasonsTable():
+    return SeasonTable('seasons', None, SEASON_PROPERTIES, {
+        'season': 'season',
+        'tvshowid': 'tvshowid'
+    }, ['tvshowid'])
+
+
+def createEpisodesTable():
+    return Table('episodes', 'episodeid', EPISODE_PROPERTIES + ['mpaa'], {
+        'title': 'title',
+        'tvshow': 'showtitle',
+        'season': 'season',
+        'episode': 'episode',
+        'playcount': 'playcount',
+        'mpaarating': 'mpaa',
+        'rating': 'mpaa'
+    }, ['tvshow', 'season'])
+
+
+def createSongsTable():
+    return Table('songs', 'songid', SONG_PROPERTIES, {
+        'title': 'title',
+        'artist': 'artist',
+        'genre': 'genre',
+        'playcount': 'playcount'
+    }, ['artist', 'genre'])
+
+
+def createAlbumsTable():
+    return Table('albums', 'albumid', ALBUM_PROPERTIES, {
+        'title': 'title',
+        'artist': 'artist',
+        'genre': 'genre',
+        'playcount': 'playcount'
+    }, ['artist', 'genre'])
+
+
+def createArtistsTable():
+    return Table('artists', 'artistid', ['artist'] + ARTIST_PROPERTIES, {
+        'artist': 'artist'
+    }, ['artist'], listProperties=[])
+
+
+TABLE_FACTORIES = {
+    'movies': createMoviesTable,
+    'tvshows': createTVShowsTable,
+    'seasons': createSeasonsTable,
+    'episodes': createEpisodesTable,
+    'songs': createSongsTable,
+    'albums': createAlbumsTable,
+    'artists': createArtistsTable
+}
+
+
+class LibrarySnapshot(object):
+    """
+    In-memory copy of the XBMC library used while generating questions.
+
+    The snapshot is loaded at the start of each game and offers the same getMovies(), getTVShows(), etc.
+    functions as the library module. The returned queries support the same filters, but are evaluated
+    locally without any JSON-RPC calls.
+
+    Once loaded, a table is kept in sync instead of being loaded again: the items changed according to
+    library notifications, see onNotification(), are fetched or removed when the next game starts.
+    Without notifications, eg. before a monitor.LibraryMonitor listens or after a library scan,
+    the snapshot catches up by comparing the ids of the items and fetching the items added since.
+    """
+    # Load the table again rather than fetching more changed items than this part of it
+    MAX_CHANGED_RATIO = 0.25
+    # Allowance for the clock of the XBMC database when asking for items added since the last sync
+    CLOCK_MARGIN_SECONDS = 300
+
+    CACHE_MAGIC = 'MQLS'
+    CACHE_VERSION = 1
+    CACHE_HEADER = struct.Struct('<4sII')
+
+    def __init__(self):
+        self.movies = None
+        self.tvshows = None
+        self.seasons = None
+        self.episodes = None
+        self.songs = None
+        self.albums = None
+        self.artists = None
+        self.movieDistractors = None
+        self.tvShowDistractors = None
+
+        self.lock = threading.Lock()
+        self.listening = False
+        self.changes = dict()
+        self.staleTables = set()
+        self.syncTimes = dict()
+
+        self.cachePath = None
+        self.cacheLoaded = threading.Event()
+        self.cacheLoaded.set()
+        self.savedVersions = dict()
+
+    def load(self, gameType):
+        """
+        Loads the parts of the library needed for the game type, or brings them up to date if already loaded.
+
+        @param gameType: one of the game.GAMETYPE_* constants
+        @type gameType: str
+        """
+        # a cached copy of the tables may be loading
+        self.cacheLoaded.wait()
+
+        startTime = time.time()
+        tableNames = GAMETYPE_TABLES[gameType]
+        self.lock.acquire()
+        try:
+            # changes notified from now on are applied by the next load
+            changes = dict([(name, self.changes.pop(name, dict())) for name in tableNames])
+            staleTables = [name for name in tableNames if not self.listening or name in self.staleTables]
+            self.staleTables.difference_update(tableNames)
+        finally:
+            self.lock.release()
+
+        if [name for name in tableNames if getattr(self, name) is None]:
+            if gameType == game.GAMETYPE_MOVIE:
+                self.loadMovies()
+            elif gameType == game.GAMETYPE_TVSHOW:
+                self.loadTVShows()
+            elif gameType == game.GAMETYPE_MUSIC:
+                self.loadMusic()
+            for name in tableNames:
+                self.syncTimes[name] = startTime
+            log.info("Loaded %s library snapshot in %.2f seconds", gameType, time.time() - startTime)
+        else:
+            for name in staleTables:
+                self._catchUp(name, changes[name])
+            self._applyChanges(changes)
+            log.info("Synchronized %s library snapshot in %.2f seconds", gameType, time.time() - startTime)
+
+        if self.cachePath is not None and [name for name in tableNames
+                                           if getattr(self, name).version != self.savedVersions.get(name)]:
+            try:
+                self.saveCache()
+            except (IOError, OSError), ex:
+                log.warning("Unable to save library snapshot to %s: %s", self.cachePath, ex)
+
+    def loadCacheInBackground(self, path):
+        """
+        Starts loading the tables saved in the file in a background thread, eg. in the addon profile
+        while the splash screen is shown. The tables are saved there again when they change.
+        load() waits for the tables, and catches up with the library on the tables it has changed since.
+
+        @param path: the file to keep the saved tables in
+        @type path: str
+        """
+        self.cachePath = path
+        self.cacheLoaded.clear()
+        loader = threading.Thread(target=self._loadCacheInBackground, name='SnapshotCacheLoader')
+        loader.daemon = True
+        loader.start()
+
+    def _loadCacheInBackground(self):
+        try:
+            self.loadCache()
+        except Exception, ex:
+            log.exception("%s while loading library snapshot from %s", ex.__class__.__name__, self.cachePath)
+        finally:
+            self.cacheLoaded.set()
+
+    def loadCache(self):
+        """
+        Loads the tables saved in the cache file, unless the file is missing or has another format.
+        Tables whose fingerprint differs from the library's are marked to catch up with the library.
+
+        @return: True if the tables were loaded
+        """
+        if not os.path.exists(self.cachePath):
+            return False
+
+        startTime = time.time()
+        f = open(self.cachePath, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        try:
+            magic, version, marshalVersion = self.CACHE_HEADER.unpack_from(data)
+            if magic != self.CACHE_MAGIC or version != self.CACHE_VERSION or marshalVersion != marshal.version:
+                log.info("Ignoring library snapshot %s with unsupported version", self.cachePath)
+                return False
+            content = marshal.loads(data[self.CACHE_HEADER.size:])
+            tables = dict([(name, TABLE_FACTORIES[name]().fromData(tableData))
+                           for name, tableData in content['tables'].iteritems()])
+        except (struct.error, EOFError, ValueError, TypeError, KeyError):
+            log.exception("Ignoring invalid library snapshot %s", self.cachePath)
+            return False
+        loadTime = time.time() - startTime
+
+        fingerprints = self._queryFingerprints([name for name in tables if name in TABLE_QUERIES])
+        self.lock.acquire()
+        try:
+            for name, table in tables.iteritems():
+                if getattr(self, name) is not None:
+                    continue
+                setattr(self, name, table)
+                self.savedVersions[name] = table.version
+                if name in TABLE_QUERIES:
+                    self.syncTimes[name] = content['syncTimes'].get(name, 0)
+                    if fingerprints[name] != content['fingerprints'].get(name):
+                        self.staleTables.add(name)
+        finally:
+            self.lock.release()
+
+        log.info("Loaded library snapshot of %s in %.3f seconds, %s changed since", ', '.join(sorted(tables)),
+                 loadTime, ', '.join(sorted(self.staleTables)) or 'nothing')
+        return True
+
+    def saveCache(self):
+        """
+        Saves the loaded tables to the cache file, along with the fingerprint of the library.
+        """
+        startTime = time.time()
+        names = [name for name in TABLE_FACTORIES if getattr(self, name) is not None]
+        content = {
+            'tables': dict([(name, getattr(self, name).toData()) for name in names]),
+            'fingerprints': self._queryFingerprints([name for name in names if name in TABLE_QUERIES]),
+            'syncTimes': self.syncTimes
+        }
+        data = marshal.dumps(content)
+
+        directory = os.path.dirname(self.cachePath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        f = open(self.cachePath + '.tmp', 'wb')
+        try:
+            f.write(self.CACHE_HEADER.pack(self.CACHE_MAGIC, self.CACHE_VERSION, marshal.version))
+            f.write(data)
+        finally:
+            f.close()
+        imdb.replaceFile(self.cachePath + '.tmp', self.cachePath)
+
+        for name in names:
+            self.savedVersions[name] = getattr(self, name).version
+        log.info("Saved library snapshot to %s (%d bytes) in %.3f seconds", self.cachePath,
+                 self.CACHE_HEADER.size + len(data), time.time() - startTime)
+
+    def _queryFingerprints(self, names):
+        """
+        Returns a cheap fingerprint of each table in the library with a single batch request:
+        the number of items and the id of the newest item.
+        """
+        batch = library.QueryBatch()
+        queries = dict()
+        for name in names:
+            queryClass, listMethod, detailsMethod, detailsKey, properties = TABLE_QUERIES[name]
+            params = dict()
+            if not name in UNDATED_TABLES:
+                params['sort'] = {'method': 'dateadded', 'order': 'descending'}
+            queries[name] = batch.add(queryClass(listMethod, params, None, name).limitTo(1))
+        batch.execute()
+
+        fingerprints = dict()
+        for name, query in queries.iteritems():
+            result = query.getResponse().get('result', dict())
+            items = result.get(name) or [dict()]
+            idKey = library.ID_KEYS[name]
+            fingerprints[name] = (result.get('limits', dict()).get('total'), items[0].get(idKey))
+        return fingerprints
+
+    def startListening(self):
+        """
+        Tells the snapshot that library notifications are passed to onNotification() from now on,
+        so the tables loaded no longer need to catch up with the library at the start of each game.
+        """
+        self.lock.acquire()
+        try:
+            if not self.listening:
+                # changes before now were not notified
+                self.staleTables.update([name for name in TABLE_QUERIES if getattr(self, name) is not None])
+            self.listening = True
+        finally:
+            self.lock.release()
+
+    def onNotification(self, method, data):
+        """
+        Records the library item changed according to a notification, it is fetched or removed by the next load().
+        May be called from any thread.
+
+        @param method: the notification, eg. VideoLibrary.OnUpdate
+        @type method: str
+        @param data: the decoded data of the notification, eg. {'item': {'id': 1, 'type': 'movie'}}
+        @type data: dict
+        """
+        if method.endswith('.OnScanFinished') or method.endswith('.OnCleanFinished'):
+            # each item scanned is notified as well, catch up in case any notification was missed
+            if method.startswith('VideoLibrary.'):
+                names = GAMETYPE_TABLES[game.GAMETYPE_MOVIE] + GAMETYPE_TABLES[game.GAMETYPE_TVSHOW]
+            else:
+                names = GAMETYPE_TABLES[game.GAMETYPE_MUSIC]
+            self.lock.acquire()
+            try:
+                self.staleTables.update(names)
+            finally:
+                self.lock.release()
+            return
+
+        if not (method.endswith('.OnUpdate') or method.endswith('.OnRemove')) or not isinstance(data, dict):
+            return
+        item = data.get('item', data)
+        name = NOTIFICATION_TABLES.get(item.get('type'))
+        if name is None or item.get('id') is None:
+            return
+
+        self.lock.acquire()
+        try:
+            self.changes.setdefault(name, dict())[item['id']] = method.endswith('.OnUpdate')
+        finally:
+            self.lock.release()
+
+    def _catchUp(self, name, changes):
+        """
+        Finds the items of a table removed from or added to the library since it was synchronized,
+        adding them to changes, and stores the items added to the library since then.
+        """
+        table = getattr(self, name)
+        queryClass, listMethod, detailsMethod, detailsKey, properties = TABLE_QUERIES[name]
+        startTime = time.time()
+        since = self.syncTimes.get(name, 0) - self.CLOCK_MARGIN_SECONDS
+
+        batch = library.QueryBatch()
+        # only the label and id of every item
+        allItems = batch.add(queryClass(listMethod, {}, None, name))
+        addedItems = batch.add(queryClass(listMethod, {}, properties, name).withFilters([{
+            'operator': 'after',
+            'field': 'dateadded',
+            'value': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since))
+        }]))
+        batch.execute()
+
+        for item in addedItems.asList():
+            self._upsert(name, item)
+            changes.pop(item.get(table.idKey), None)
+
+        libraryIds = set([item.get(table.idKey) for item in allItems.asList()])
+        snapshotIds = set(table.ids)
+        for itemId in snapshotIds - libraryIds:
+            changes[itemId] = False
+        for itemId in libraryIds - snapshotIds:
+            changes.setdefault(itemId, True)
+        self.syncTimes[name] = startTime
+
+    def _applyChanges(self, changes):
+        """
+        Removes the items recorded as removed and fetches the items recorded as updated with a single batch request.
+
+        @param changes: maps table names to dicts of library ids mapped to True if updated, False if removed
+        @type changes: dict
+        """
+        batch = library.QueryBatch()
+        updates = list()
+        for name, tableChanges in changes.iteritems():
+            table = getattr(self, name)
+            if len(tableChanges) > max(self.MAX_CHANGED_RATIO * len(table), 1):
+                log.info("Loading %s again for %d changes", name, len(tableChanges))
+                self._reload(name)
+                continue
+
+            queryClass, listMethod, detailsMethod, detailsKey, properties = TABLE_QUERIES[name]
+            for itemId, updated in tableChanges.iteritems():
+                if updated:
+                    query = queryClass(detailsMethod, {table.idKey: itemId}, properties, detailsKey)
+                    updates.append((name, itemId, batch.add(query)))
+                else:
+                    table.remove(itemId)
+        batch.execute()
+
+        for name, itemId, query in updates:
+            item = query.asList()
+            if item:
+                self._upsert(name, item)
+            else:
+                getattr(self, name).remove(itemId)
+
+        if changes.get('tvshows'):
+            self._loadSeasons()
+            self._rateEpisodes(changes['tvshows'])
+
+        for name, tableChanges in changes.iteritems():
+            if tableChanges:
+                log.debug("Applied %d changes to %s", len(tableChanges), name)
+
+    def _upsert(self, name, item):
+        if name == 'episodes':
+            item = self._rateEpisode(item)
+        getattr(self, name).upsert(item)
+
+    def _reload(self, name):
+        queryClass, listMethod, detailsMethod, detailsKey, properties = TABLE_QUERIES[name]
+        table = TABLE_FACTORIES[name]()
+        if name == 'episodes':
+            for item in queryClass(listMethod, {}, properties, name).asList():
+                table.append(self._rateEpisode(item))
+        else:
+            self._fill(table, queryClass(listMethod, {}, properties, name))
+        setattr(self, name, table)
+
+    def loadMovies(self):
+        self.movies = createMoviesTable()
+        self._fill(self.movies, library.VideoQuery('VideoLibrary.GetMovies', {}, MOVIE_PROPERTIES, 'movies'))
+
+    def loadTVShows(self):
+        self.tvshows = createTVShowsTable()
+        self._fill(self.tvshows, library.VideoQuery('VideoLibrary.GetTVShows', {}, TVSHOW_PROPERTIES, 'tvshows'))
+        self._loadSeasons()
+
+        self.episodes = createEpisodesTable()
+        self._appendEpisodes(library.VideoQuery('VideoLibrary.GetEpisodes', {}, EPISODE_PROPERTIES, 'episodes').asList())
+
+    def loadMusic(self):
+        self.songs = createSongsTable()
+        self._fill(self.songs, library.AudioQuery('AudioLibrary.GetSongs', {}, SONG_PROPERTIES, 'songs'))
+
+        self.albums = createAlbumsTable()
+        self._fill(self.albums, library.AudioQuery('AudioLibrary.GetAlbums', {}, ALBUM_PROPERTIES, 'albums'))
+
+        self.artists = createArtistsTable()
+        self._fill(self.artists, library.AudioQuery('AudioLibrary.GetArtists', {}, ARTIST_PROPERTIES, 'artists'))
+
+    def loadFixture(self, fixture):
+        """
+        Loads the snapshot from lists of items shaped like JSON-RPC results instead of from XBMC.
+
+        @param fixture: dict with the items keyed by result key, eg. {'movies': [...], 'tvshows': [...]}
+        @type fixture: dict
+        """
+        self.movies = createMoviesTable()
+        self.tvshows = createTVShowsTable()
+        self.seasons = createSeasonsTable()
+        self.episodes = createEpisodesTable()
+        self.songs = createSongsTable()
+        self.albums = createAlbumsTable()
+        self.artists = createArtistsTable()
+
+        for table in [self.movies, self.tvshows, self.seasons, self.songs, self.albums, self.artists]:
+            for item in fixture.get(table.resultKey, []):
+                table.append(item)
+        self._appendEpisodes(fixture.get('episodes', []))
+
+    def _loadSeasons(self):
+        # the seasons have no library ids to update them by, so they are loaded again when the tv shows change
+        seasons = createSeasonsTable()
+        batch = library.QueryBatch()
+        for tvShowId in self.tvshows.ids:
+            batch.add(library.VideoQuery('VideoLibrary.GetSeasons', {'tvshowid': tvShowId}, SEASON_PROPERTIES, 'seasons'))
+        batch.execute()
+        for query in batch.queries:
+            self._fill(seasons, query)
+        self.seasons = seasons
+
+    def _appendEpisodes(self, items):
+        for item in items:
+            self.episodes.append(self._rateEpisode(item))
+
+    def _rateEpisode(self, item):
+        # episodes are filtered on the content rating of their tv show
+        item = dict(item)
+        item['mpaa'] = None
+        if item.get('tvshowid') in self.tvshows.rowsById:
+            item['mpaa'] = self.tvshows.getValue(item['tvshowid'], 'mpaa')
+        return item
+
+    def _rateEpisodes(self, tvShowIds):
+        if self.episodes is None:
+            return
+        for episodeId, tvShowId in zip(self.episodes.ids, self.episodes.columns['tvshowid']):
+            if tvShowId in tvShowIds:
+                rating = None
+                if tvShowId in self.tvshows.rowsById:
+                    rating = self.tvshows.getValue(tvShowId, 'mpaa')
+                self.episodes.setValue(episodeId, 'mpaa', rating)
+
+    def getMovies(self, properties=None):
+        return SnapshotVideoQuery(self.movies, {'sort': {'method': 'random'}}, properties)
+
+    def getTVShows(self, properties=None):
+        return SnapshotVideoQuery(self.tvshows, {'sort': {'method': 'random'}}, properties)
+
+    def getSeasons(self, tvShowId, properties=None):
+        return SnapshotVideoQuery(self.seasons, {'sort': {'method': 'random'}, 'tvshowid': tvShowId}, properties)
+
+    def getEpisodes(self, properties=None):
+        return SnapshotVideoQuery(self.episodes, {'sort': {'method': 'random'}}, properties)
+
+    def getSongs(self, properties=None):
+        return SnapshotAudioQuery(self.songs, {'sort': {'method': 'random'}}, properties)
+
+    def getAlbums(self, properties=None):
+        return SnapshotAudioQuery(self.albums, {'sort': {'method': 'random'}}, properties)
+
+    def getArtists(self, properties=None):
+        return SnapshotAudioQuery(self.artists, {'sort': {'method': 'random'}}, ['artist'] + (properties or []))
+
+    def getArtistDetails(self, artistId, properties=None):
+        return SnapshotAudioQuery(self.artists, {'artistid': artistId}, properties, 'artistdetails')
+
+    def getMovieIndex(self):
+        """
+        @rtype: index.LibraryIndex
+        """
+        return self.movies.index
+
+    def getMovieDistractors(self):
+        """
+        @rtype: distractor.DistractorEngine
+        """
+        if self.movieDistractors is None or self.movieDistractors.table is not self.movies \
+                or self.movieDistractors.version != self.movies.version:
+            self.movieDistractors = DistractorEngine(self.movies, MOVIE_SIMILARITY_WEIGHTS, MOVIE_YEAR_WEIGHT)
+        return self.movieDistractors
+
+    def getTVShowDistractors(self):
+        """
+        @rtype: distractor.DistractorEngine
+        """
+        if self.tvShowDistractors is None or self.tvShowDistractors.table is not self.tvshows \
+                or self.tvShowDistractors.version != self.tvshows.version:
+            self.tvShowDistractors = DistractorEngine(self.tvshows, TVSHOW_SIMILARITY_WEIGHTS)
+        return self.tvShowDistractors
+
+    def getMovieIds(self, filters):
+        """
+        Returns the ids of the movies matching the filters, eg. the default filters of the game.
+        """
+        return self.movies.getIds(filters)
+
+    def getTVShowIds(self, filters):
+        """
+        Returns the ids of the tv shows matching the filters, eg. the default filters of the game.
+        """
+        return self.tvshows.getIds(filters)
+
+    def getActorThumbnail(self, name):
+        """
+        Returns the thumbnail of the actor or None if the actor has no thumbnail.
+        """
+        return self.movies.thumbnails.get(name)
+
+    def _fill(self, table, query):
+        for item in query.asList():
+            table.append(item)
+
+
+def _randomOrder(indices):
+    """
+    Yields the indices in random order, shuffling lazily so a query limited to a few items
+    does not pay for shuffling the entire table.
+    """
+    end = len(indices)
+    while end > 0:
+        pick = random.randint(0, end - 1)
+        end -= 1
+        indices[pick], indices[end] = indices[end], indices[pick]
+        yield indices[end]
+
+
+def _toNumber(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+_NUMERIC_OPERATORS = {
+    'is': lambda v, e: v == e,
+    'isnot': lambda v, e: v == e,
+    'greaterthan': lambda v, e: v > e,
+    'lessthan': lambda v, e: v < e
+}
+
+_STRING_OPERATORS = {
+    'is': lambda v, e: v == e,
+    'isnot': lambda v, e: v == e,
+    'contains': lambda v, e: e in v,
+    'doesnotcontain': lambda v, e: e in v,
+    'startswith': lambda v, e: v.startswith(e),
+    'endswith': lambda v, e: v.endswith(e)
+}
@@ -0,0 +1,242 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+import json
+import re
+import socket
+import threading
+import time
+
+
+class XbmcTransport(object):
+    """
+    Sends JSON-RPC requests in-process through xbmc.executeJSONRPC.
+    """
+
+    def execute(self, command):
+        """
+        @param command: the JSON encoded request or batch of requests
+        @type command: str
+        @return: the JSON encoded response
+        """
+        import xbmc
+
+        return xbmc.executeJSONRPC(command)
+
+
+class SocketTransport(object):
+    """
+    Sends JSON-RPC requests over a persistent TCP connection to the XBMC JSON-RPC server,
+    so a process running outside XBMC can reuse one connection for all its queries.
+
+    XBMC does not delimit the messages on the connection and sends notifications between
+    the responses, so messages are split by matching braces and notifications are skipped.
+    """
+    DEFAULT_PORT = 9090
+    RECEIVE_SIZE = 65536
+    TOKEN_PATTERN = re.compile(r'[{}\[\]"\\]')
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, timeout=30, notificationCallback=None):
+        """
+        @param notificationCallback: optional callable invoked with each notification received
+        @type notificationCallback: method
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.notificationCallback = notificationCallback
+        self.socket = None
+        self.buffer = ''
+        self.lock = threading.Lock()
+
+    def execute(self, command):
+        self.lock.acquire()
+        try:
+            try:
+                return self._execute(command)
+            except socket.error:
+                # the connection may have been closed by XBMC since the last request, retry once
+                self.close()
+                return self._execute(command)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+        self.socket = None
+        self.buffer = ''
+
+    def _execute(self, command):
+        if self.socket is None:
+            self.socket = socket.create_connection((self.host, self.port), self.timeout)
+        self.socket.sendall(command)
+
+        while True:
+            message = self._receiveMessage()
+            if message.startswith('{') and '"method"' in message and not '"result"' in message:
+                decoded = json.loads(message)
+                if not 'id' in decoded:
+                    if self.notificationCallback is not None:
+                        self.notificationCallback(decoded)
+                    continue
+            return message
+
+    def _receiveMessage(self):
+        depth = 0
+        inString = False
+        start = None
+        position = 0
+        while True:
+            m = self.TOKEN_PATTERN.search(self.buffer, position)
+            if m is None or (inString and m.group() == '\\' and m.end() == len(self.buffer)):
+                # the rest of the message has not been received yet
+                if m is None:
+                    position = len(self.buffer)
+                else:
+                    position = m.start()
+                self._receive()
+                continue
+
+            token = m.group()
+            position = m.end()
+            if inString:
+                if token == '\\':
+                    # skip the escaped character
+                    position += 1
+                elif token == '"':
+                    inString = False
+            elif token == '"':
+                inString = True
+            elif token in '{[':
+                if depth == 0:
+                    start = m.start()
+                depth += 1
+            elif token in '}]':
+                depth -= 1
+                if depth == 0:
+                    message = self.buffer[start:position]
+                    self.buffer = self.buffer[position:]
+                    return message
+
+    def _receive(self):
+        data = self.socket.recv(self.RECEIVE_SIZE)
+        if not data:
+            raise socket.error('Connection closed by %s:%d' % (self.host, self.port))
+        self.buffer += data
+
+
+class FakeTransport(object):
+    """
+    In-memory stand-in for the XBMC JSON-RPC server, serving a library fixture.
+
+    Queries are evaluated with the same filter semantics as snapshot.Table, so question generation
+    can run and be measured without XBMC, eg. with a library created by fixture.createLibrary().
+    """
+    METHODS = {
+        'VideoLibrary.GetMovies': ('movies', 'movies'),
+        'VideoLibrary.GetMovieDetails': ('movies', 'moviedetails'),
+        'VideoLibrary.GetTVShows': ('tvshows', 'tvshows'),
+        'VideoLibrary.GetTVShowDetails': ('tvshows', 'tvshowdetails'),
+        'VideoLibrary.GetSeasons': ('seasons', 'seasons'),
+        'VideoLibrary.GetEpisodes': ('episodes', 'episodes'),
+        'VideoLibrary.GetEpisodeDetails': ('episodes', 'episodedetails'),
+        'AudioLibrary.GetSongs': ('songs', 'songs'),
+        'AudioLibrary.GetSongDetails': ('songs', 'songdetails'),
+        'AudioLibrary.GetAlbums': ('albums', 'albums'),
+        'AudioLibrary.GetAlbumDetails': ('albums', 'albumdetails'),
+        'AudioLibrary.GetArtists': ('artists', 'artists'),
+        'AudioLibrary.GetArtistDetails': ('artists', 'artistdetails')
+    }
+    CONTENT = {
+        'Library.HasContent(Movies)': 'movies',
+        'Library.HasContent(TVShows)': 'tvshows',
+        'Library.HasContent(Music)': 'songs'
+    }
+
+    def __init__(self, fixture, latency=0.0):
+        """
+        @param fixture: dict with the items keyed by result key, eg. {'movies': [...], 'tvshows': [...]}
+        @type fixture: dict
+        @param latency: seconds to wait for each request, to simulate a remote server
+        @type latency: float
+        """
+        # imported here, as snapshot imports library which imports this module
+        import snapshot
+
+        self.snapshot = snapshot.LibrarySnapshot()
+        self.snapshot.loadFixture(fixture)
+        self.latency = latency
+        self.requests = 0
+
+    def execute(self, command):
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests += 1
+
+        request = json.loads(command)
+        if type(request) == list:
+            response = [self._handle(r) for r in request]
+        else:
+            response = self._handle(request)
+        return json.dumps(response)
+
+    def _handle(self, request):
+        import snapshot
+
+        method = request.get('method')
+        params = request.get('params', dict())
+        if method == 'JSONRPC.Ping':
+            return self._result(request, 'pong')
+        elif method == 'XBMC.GetInfoBooleans':
+            result = dict()
+            for boolean in params.get('booleans', []):
+                table = getattr(self.snapshot, self.CONTENT.get(boolean, ''), None)
+                result[boolean] = table is not None and len(table) > 0
+            return self._result(request, result)
+        elif not method in self.METHODS:
+            return {'id': request.get('id'), 'jsonrpc': '2.0',
+                    'error': {'code': -32601, 'message': 'Method not found.'}}
+
+        tableName, resultKey = self.METHODS[method]
+        table = getattr(self.snapshot, tableName)
+        properties = params.get('properties')
+        if tableName == 'artists':
+            # XBMC always includes the name of artists
+            properties = ['artist'] + (properties or [])
+        query = snapshot.SnapshotVideoQuery(table, dict(params), properties, resultKey)
+        query.query['id'] = request.get('id')
+        if 'filter' in params:
+            query.filters.append(params['filter'])
+
+        response = table.query(query)
+        if resultKey == table.resultKey:
+            items = response['result'][resultKey]
+            total = len(items)
+            if 'limits' in params:
+                total = len(table.getIds(query.filters))
+            response['result']['limits'] = {'start': 0, 'end': len(items), 'total': total}
+        return response
+
+    def _result(self, request, result):
+        return {'id': request.get('id'), 'jsonrpc': '2.0', 'result': result}
@@ -0,0 +1,169 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+"""
+Tests the resumable and conditional download of the IMDb lists against a local HTTP server.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import BaseHTTPServer
+import gzip
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import benchmark
+
+benchmark.installXbmcModules(tempfile.mkdtemp())
+
+import imdb
+
+ETAG = '"quotes-1"'
+LAST_MODIFIED = 'Fri, 01 Mar 2013 12:00:00 GMT'
+
+
+def compress(data):
+    buffer = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=buffer, mode='wb')
+    f.write(data)
+    f.close()
+    return buffer.getvalue()
+
+
+class ListsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves server.body with an ETag and Last-Modified header,
+    answering Range, If-Range and If-None-Match requests like the IMDb mirrors.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.body
+        offset = 0
+        range = self.headers.get('Range')
+        if range is not None and self.headers.get('If-Range') in [ETAG, LAST_MODIFIED]:
+            offset = int(range[len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (offset, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - offset))
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+
+        if server.truncateAt is not None:
+            self.wfile.write(body[offset:server.truncateAt])
+        else:
+            self.wfile.write(body[offset:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.listsPath = tempfile.mkdtemp()
+        self.data = ''.join('# "Movie %d" (2000)\nQuote %d\n\n' % (i, i) for i in range(20000))
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ListsRequestHandler)
+        self.server.body = compress(self.data)
+        self.server.truncateAt = None
+        self.server.requests = list()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        self.imdb = imdb.Imdb(self.listsPath, 'http://127.0.0.1:%d/' % self.server.server_port)
+        self.destination = os.path.join(self.listsPath, imdb.Imdb.QUOTES_LIST)
+        self.partPath = self.destination + '.gz.part'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.listsPath)
+
+    def download(self):
+        return self.imdb._downloadGzipFile(self.imdb.quotesUrl, self.destination)
+
+    def readDestination(self):
+        f = open(self.destination, 'rb')
+        data = f.read()
+        f.close()
+        return data
+
+    def testCompleteDownload(self):
+        self.assertEqual(imdb.Imdb.DOWNLOAD_COMPLETE, self.download())
+        self.assertEqual(self.data, self.readDestination())
+        self.assertFalse(os.path.exists(self.partPath))
+        self.assertNotIn('range', self.server.requests[0])
+
+    def testResumePartialFile(self):
+        offset = len(self.server.body) / 2
+        f = open(self.partPath, 'wb')
+        f.write(self.server.body[:offset])
+        f.close()
+        self.imdb._saveDownloadState(self.imdb.quotesUrl, {'etag': ETAG, 'lastModified': LAST_MODIFIED, 'complete': False})
+
+        self.assertEqual(imdb.Imdb.DOWNLOAD_COMPLETE, self.download())
+        self.assertEqual('bytes=%d-' % offset, self.server.requests[0]['range'])
+        self.assertEqual(ETAG, self.server.requests[0]['if-range'])
+        self.assertEqual(self.data, self.readDestination())
+        self.assertFalse(os.path.exists(self.partPath))
+
+    def testUnchangedFileIsNotDownloaded(self):
+        self.assertEqual(imdb.Imdb.DOWNLOAD_COMPLETE, self.download())
+        self.imdb._setDownloadComplete(self.imdb.quotesUrl)
+
+        self.assertEqual(imdb.Imdb.DOWNLOAD_UNCHANGED, self.download())
+        self.assertEqual(ETAG, self.server.requests[1]['if-none-match'])
+        self.assertEqual(LAST_MODIFIED, self.server.requests[1]['if-modified-since'])
+        self.assertEqual(self.data, self.readDestination())
+
+    def testTruncatedDownloadIsResumed(self):
+        self.server.truncateAt = len(self.server.body) / 3
+        self.assertRaises(IOError, self.download)
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertFalse(os.path.exists(self.destination + '.tmp'))
+        self.assertEqual(self.server.truncateAt, os.path.getsize(self.partPath))
+
+        self.server.truncateAt = None
+        self.assertEqual(imdb.Imdb.DOWNLOAD_COMPLETE, self.download())
+        self.assertEqual('bytes=%d-' % (len(self.server.body) / 3), self.server.requests[1]['range'])
+        self.assertEqual(self.data, self.readDestination())
+
+
+if __name__ == '__main__':
+    unittest.main()
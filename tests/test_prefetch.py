@@ -0,0 +1,100 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+"""
+Tests how QuestionPrefetcher.buildQuestion reports the question types to the QuestionScheduler.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import benchmark
+
+benchmark.installXbmcModules(tempfile.mkdtemp())
+
+import prefetch
+import question
+
+
+class FakeQuestion(object):
+    def __init__(self, id):
+        self.id = id
+
+    def getAnswers(self):
+        return ['a', 'b', 'c', 'd']
+
+    def getUniqueIdentifier(self):
+        return self.id
+
+
+def duplicateQuestion(defaultLibraryFilters):
+    return FakeQuestion('same')
+
+
+def failingQuestion(defaultLibraryFilters):
+    raise question.QuestionException('No questions of this type')
+
+
+class BuildQuestionTest(unittest.TestCase):
+    def createPrefetcher(self, candidates, previousQuestions):
+        prefetcher = prefetch.QuestionPrefetcher(candidates, list(), previousQuestions)
+        # a fixed order, so the failing type always follows a build of the duplicate
+        prefetcher.scheduler.getCandidates = lambda: list(candidates)
+        return prefetcher
+
+    def getStatistics(self, prefetcher, candidate):
+        for name, attempts, successes, averageCost, disabled in prefetcher.scheduler.getStatistics():
+            if name == candidate.__name__:
+                return attempts, successes
+        return None
+
+    def testFailureAfterDuplicateIsRecordedAsFailure(self):
+        prefetcher = self.createPrefetcher([failingQuestion, duplicateQuestion], ['same'])
+
+        self.assertEqual(None, prefetcher.buildQuestion())
+        attempts, successes = self.getStatistics(prefetcher, failingQuestion)
+        self.assertTrue(attempts > 1)
+        self.assertEqual(0, successes)
+
+    def testDuplicateIsNeverReturned(self):
+        prefetcher = self.createPrefetcher([duplicateQuestion], ['same'])
+
+        self.assertEqual(None, prefetcher.buildQuestion())
+        self.assertEqual(['same'], prefetcher.previousQuestions)
+
+    def testNewQuestionIsReturned(self):
+        prefetcher = self.createPrefetcher([failingQuestion, duplicateQuestion], list())
+
+        q = prefetcher.buildQuestion()
+        self.assertEqual('same', q.getUniqueIdentifier())
+        self.assertEqual(['same'], prefetcher.previousQuestions)
+        self.assertEqual((1, 0), self.getStatistics(prefetcher, failingQuestion))
+        self.assertEqual((1, 1), self.getStatistics(prefetcher, duplicateQuestion))
+
+
+if __name__ == '__main__':
+    unittest.main()
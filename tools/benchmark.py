@@ -0,0 +1,315 @@
+#
+#      Copyright (C) 2013 Tommy Winther
+#      http://tommy.winther.nu
+#
+#  This Program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2, or (at your option)
+#  any later version.
+#
+#  This Program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this Program; see the file LICENSE.txt.  If not, write to
+#  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+#  http://www.gnu.org/copyleft/gpl.html
+#
+
+"""
+Headless benchmark of question generation.
+
+Builds every MovieQuestion, TVQuestion and MusicQuestion subclass a number of times against
+synthetic libraries served by transport.FakeTransport. The xbmc, xbmcaddon, xbmcgui and xbmcvfs
+modules are replaced by minimal stand-ins, with settings defaults read from resources/settings.xml.
+
+For each library size and question type the build latency (p50/p95), JSON-RPC calls and bytes per
+question are reported, and optionally saved as JSON to compare versions. Builds raising QuestionException
+are reported as failed and other exceptions as errors, both counted by exception type and message.
+
+Usage: python tools/benchmark.py --sizes 1000,10000,100000 --iterations 100 --output results.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import types
+import xml.etree.ElementTree as ElementTree
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+GAME_TYPES = ['movie', 'tvshow', 'music']
+FIXTURE_PATHS = ('/movies/', '/tvshows/', '/music/', '/art/')
+# the most frequent reasons printed per question, all of them are saved to the JSON output
+MAX_REASONS = 3
+
+
+def installXbmcModules(profilePath, verbose=False):
+    """
+    Installs stand-ins for the modules provided by XBMC, just enough for quizlib to build questions.
+    """
+    xbmc = types.ModuleType('xbmc')
+    xbmc.LOGDEBUG, xbmc.LOGINFO, xbmc.LOGNOTICE, xbmc.LOGWARNING, xbmc.LOGERROR = range(5)
+
+    def log(msg, level=xbmc.LOGNOTICE):
+        if verbose:
+            print >> sys.stderr, msg
+
+    def executeJSONRPC(command):
+        raise RuntimeError('JSON-RPC requests must go through library.setTransport()')
+
+    xbmc.log = log
+    xbmc.executeJSONRPC = executeJSONRPC
+    xbmc.translatePath = lambda path: path
+    xbmc.sleep = lambda milliseconds: time.sleep(milliseconds / 1000.0)
+    xbmc.getInfoLabel = lambda label: ''
+    xbmc.Player = type('Player', (object,), {})
+    xbmc.Monitor = type('Monitor', (object,), {})
+
+    settings = dict()
+    for setting in ElementTree.parse(os.path.join(ROOT, 'resources', 'settings.xml')).iter('setting'):
+        if setting.get('id') is not None:
+            settings[setting.get('id')] = setting.get('default', '')
+
+    localizedStrings = dict()
+    po = open(os.path.join(ROOT, 'resources', 'language', 'English', 'strings.po')).read().decode('utf-8')
+    for m in re.finditer(r'msgctxt "#([0-9]+)"\s+msgid "(.*)"', po):
+        localizedStrings[int(m.group(1))] = m.group(2)
+
+    class Addon(object):
+        def __init__(self, id=None):
+            pass
+
+        def getSetting(self, id):
+            return settings.get(id, '')
+
+        def setSetting(self, id, value):
+            settings[id] = value
+
+        def getLocalizedString(self, id):
+            return localizedStrings.get(id, u'')
+
+        def getAddonInfo(self, id):
+            if id == 'profile':
+                return profilePath
+            elif id == 'path':
+                return ROOT
+            elif id == 'version':
+                return _getAddonVersion()
+            return ''
+
+    xbmcaddon = types.ModuleType('xbmcaddon')
+    xbmcaddon.Addon = Addon
+
+    def exists(path):
+        # the files of the synthetic libraries do not exist, but the questions check for them
+        return path.startswith(FIXTURE_PATHS) or os.path.exists(path)
+
+    xbmcvfs = types.ModuleType('xbmcvfs')
+    xbmcvfs.exists = exists
+
+    xbmcgui = types.ModuleType('xbmcgui')
+    for name in ['ListItem', 'Dialog', 'DialogProgress', 'WindowXML', 'WindowXMLDialog']:
+        setattr(xbmcgui, name, type(name, (object,), {}))
+
+    for module in [xbmc, xbmcaddon, xbmcvfs, xbmcgui]:
+        sys.modules[module.__name__] = module
+    sys.path.insert(0, os.path.join(ROOT, 'quizlib'))
+
+
+class CountingTransport(object):
+    """
+    Counts the requests sent through another transport and the bytes sent and received.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.calls = 0
+        self.bytes = 0
+
+    def execute(self, command):
+        response = self.transport.execute(command)
+        self.calls += 1
+        self.bytes += len(command) + len(response)
+        return response
+
+
+def percentile(values, p):
+    """
+    @return: the p'th percentile of values using the nearest rank method, or None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def benchmarkGameType(gameType, transport, iterations):
+    import question
+    import snapshot
+
+    candidates = {
+        'movie': question.MovieQuestion,
+        'tvshow': question.TVQuestion,
+        'music': question.MusicQuestion
+    }[gameType].__subclasses__()
+
+    question.LIBRARY = snapshot.LibrarySnapshot()
+    transport.calls = transport.bytes = 0
+    startTime = time.time()
+    question.LIBRARY.load(gameType)
+    result = {
+        'gameType': gameType,
+        'snapshot': {
+            'seconds': round(time.time() - startTime, 4),
+            'rpcCalls': transport.calls,
+            'rpcBytes': transport.bytes
+        },
+        'questions': list()
+    }
+
+    for candidate in candidates:
+        timings = list()
+        failureReasons = dict()
+        errorReasons = dict()
+        transport.calls = transport.bytes = 0
+        for iteration in range(iterations):
+            startTime = time.time()
+            try:
+                candidate([])
+                timings.append((time.time() - startTime) * 1000)
+            except question.QuestionException, ex:
+                _countReason(failureReasons, ex)
+            except Exception, ex:
+                # a bug in the question rather than a library without suitable items
+                _countReason(errorReasons, ex)
+        failures = sum(failureReasons.values())
+        errors = sum(errorReasons.values())
+
+        result['questions'].append({
+            'name': candidate.__name__,
+            'enabled': bool(candidate.isEnabled()),
+            'iterations': iterations,
+            'failures': failures,
+            'errors': errors,
+            'failureReasons': failureReasons,
+            'errorReasons': errorReasons,
+            'failureRate': round(float(failures) / iterations, 4),
+            'errorRate': round(float(errors) / iterations, 4),
+            'p50Ms': _round(percentile(timings, 50)),
+            'p95Ms': _round(percentile(timings, 95)),
+            'rpcCallsPerQuestion': round(float(transport.calls) / iterations, 4),
+            'rpcBytesPerQuestion': round(float(transport.bytes) / iterations, 1)
+        })
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks question generation against synthetic libraries.')
+    parser.add_argument('--sizes', default='1000,10000', help='comma separated numbers of movies, eg. 1000,10000,100000')
+    parser.add_argument('--iterations', type=int, default=100, help='questions to build of each type')
+    parser.add_argument('--game-types', default=','.join(GAME_TYPES), help='comma separated game types')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic libraries')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per JSON-RPC request')
+    parser.add_argument('--output', help='file to save the results to as JSON')
+    parser.add_argument('--verbose', action='store_true', help='print the quizlib log to stderr')
+    args = parser.parse_args(argv)
+
+    installXbmcModules(tempfile.mkdtemp(prefix='moviequiz-benchmark-'), args.verbose)
+    import fixture
+    import library
+    import transport
+
+    results = {
+        'version': _getAddonVersion(),
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': args.iterations,
+        'seed': args.seed,
+        'libraries': list()
+    }
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        startTime = time.time()
+        libraryFixture = fixture.createLibrary(movies=size, tvShows=max(size / 30, 1), artists=max(size / 20, 1),
+                                               seed=args.seed)
+        counts = dict([(key, len(items)) for key, items in libraryFixture.iteritems()])
+        fixtureSeconds = time.time() - startTime
+
+        countingTransport = CountingTransport(transport.FakeTransport(libraryFixture, args.latency))
+        libraryFixture = None
+        library.setTransport(countingTransport)
+
+        libraryResult = {
+            'size': size,
+            'items': counts,
+            'fixtureSeconds': round(fixtureSeconds, 4),
+            'gameTypes': list()
+        }
+        for gameType in args.game_types.split(','):
+            gameTypeResult = benchmarkGameType(gameType, countingTransport, args.iterations)
+            libraryResult['gameTypes'].append(gameTypeResult)
+            _printGameType(size, gameTypeResult)
+        results['libraries'].append(libraryResult)
+
+    print
+    print '* not enabled with the default settings'
+
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+        print 'Results saved to %s' % args.output
+
+
+def _printGameType(size, result):
+    snapshotResult = result['snapshot']
+    print
+    print '%s questions, %d movies, snapshot loaded in %.3f s with %d calls (%d bytes)' % (
+        result['gameType'], size, snapshotResult['seconds'], snapshotResult['rpcCalls'], snapshotResult['rpcBytes'])
+    print '%-45s %9s %9s %7s %10s %8s %8s' % ('question', 'p50 ms', 'p95 ms', 'calls', 'bytes', 'failed', 'errors')
+    for q in result['questions']:
+        print '%-45s %9s %9s %7.2f %10.1f %7.1f%% %7.1f%%' % (
+            q['name'] + ('' if q['enabled'] else ' *'), _format(q['p50Ms']), _format(q['p95Ms']),
+            q['rpcCallsPerQuestion'], q['rpcBytesPerQuestion'], q['failureRate'] * 100, q['errorRate'] * 100)
+
+    for q in result['questions']:
+        for kind, reasons in [('error', q['errorReasons']), ('failed', q['failureReasons'])]:
+            for reason, count in sorted(reasons.items(), key=lambda item: item[1], reverse=True)[:MAX_REASONS]:
+                print '  %s %s %dx: %s' % (q['name'], kind, count, reason)
+
+
+def _countReason(reasons, ex):
+    try:
+        reason = u'%s: %s' % (ex.__class__.__name__, unicode(ex))
+    except UnicodeError:
+        reason = u'%s: %r' % (ex.__class__.__name__, ex.args)
+    reasons[reason] = reasons.get(reason, 0) + 1
+
+
+def _round(value):
+    if value is None:
+        return None
+    return round(value, 4)
+
+
+def _format(value):
+    if value is None:
+        return '-'
+    return '%.3f' % value
+
+
+def _getAddonVersion():
+    return ElementTree.parse(os.path.join(ROOT, 'addon.xml')).getroot().get('version')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])